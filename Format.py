@@ -1,6 +1,16 @@
 import argparse
 import csv
 import json
+import re
+import sqlite3
+from collections import Counter
+from contextlib import closing
+
+import columnar
+from parse_cache import add_cache_arguments, cache_from_args
+from profiling import Profiler, profile_mode
+from record_io import COMPRESSIONS, FORMATS, DocumentWriter, output_path
+from stream_json import iter_array
 
 
 def parse_args():
@@ -11,18 +21,52 @@ def parse_args():
     parser.add_argument("-d", "--dependencyInput", type=str, required=True, help="please input the input dependency file path")
     parser.add_argument("-p", "--projectname", type=str, required=True, help="please input the project name")
     parser.add_argument("-o", "--output", type=str, required=True, help="please input the output file path")
+    parser.add_argument("-s", "--stream", action="store_true",
+                        help="read the raw tool output incrementally instead of loading it whole")
+    parser.add_argument("-f", "--format", type=str, default="json", choices=FORMATS + ['columnar'],
+                        help="output record format: indented json, compact json, json lines or binary columnar")
+    parser.add_argument("-z", "--compress", type=str, default="none", choices=COMPRESSIONS,
+                        help="compress the output files")
+    parser.add_argument("--profile", type=str, nargs="?", const="full", choices=['full', 'time'],
+                        help="write per-phase time and memory to <output>/<tool>_<projectname>_profile.json, "
+                             "'time' skips the slow tracemalloc accounting")
+    add_cache_arguments(parser)
     args = parser.parse_args()
-    return args.tool, args.entityInput, args.dependencyInput, args.projectname, args.output
+    return args.tool, args.entityInput, args.dependencyInput, args.projectname, args.output, args.stream, \
+           args.format, args.compress, cache_from_args(args), profile_mode(args.profile)
+
 
+# 转换器的输出规则变化时加一，旧的解析缓存自然失效
+CONVERTER_VERSION = 1
+# 每个工具产出的表，understand只转换依赖
+TOOL_KINDS = {'understand': ['dependency']}
+# 当前转换写入的解析缓存和键，由main设置
+parse_cache = None
+cache_key = None
+# 开启--profile时由main替换，每个输出文件记为一个阶段，流式解析的时间也算在里面
+profiler = Profiler(enabled=False)
 
-def output_file(cell: dict, json_path: str, projectname:str, type:str):
-    info = dict()
-    info["schemaVersion"] = 1.0
-    info[type] = cell
-    info['projectName'] = projectname
-    entity_str = json.dumps(info, indent=4)
-    with open(json_path, 'w') as json_file:
-        json_file.write(entity_str)
+
+# 逐条写出记录，默认格式与json.dumps(info, indent=4)完全一致，但不会在内存里拼出整个字符串；
+# 列式输出也是边读边写，只有写解析缓存(非流式转换)时才在内存里建出整张表
+def output_file(cell, json_path: str, projectname:str, type:str, fmt: str = 'json', compress: str = 'none'):
+    with profiler.phase(type):
+        if parse_cache is not None:
+            table = columnar.table_from_records(type, cell, projectname)
+            parse_cache.put(cache_key, type, table)
+            if fmt == 'columnar':
+                columnar.write_table(output_path(json_path, fmt), table)
+                return
+            cell = iter(table)
+        if fmt == 'columnar':
+            with columnar.ColumnarWriter(output_path(json_path, fmt), type, projectname) as writer:
+                for record in cell:
+                    writer.append(record)
+            return
+        with DocumentWriter(output_path(json_path, fmt, compress), fmt, compress) as writer:
+            writer.field("schemaVersion", 1.0)
+            writer.section(type, cell)
+            writer.field('projectName', projectname)
 
 
 def Entity(entityID, entityName, entityType, entityFile = None, startLine = -1, startColumn = -1, endLine = -1, endColumn = -1):
@@ -50,162 +94,254 @@ def Dependency(dependencyType, dependencySrcID, dependencydestID, startLine = -1
     return dependency
 
 
-def enre_format(path: str, projectname:str, output:str):
-    with open(path, 'r', encoding='utf-8') as understand_file:
-        enre_result = json.load(understand_file)
-    nodes = enre_result['variables']
-    edges = enre_result['cells']
-
-    node_count = list()
-    edge_count = list()
-
+def enre_entities(nodes):
     for node in nodes:
         if node['external'] == True:
             break
-        node_count.append(Entity(node['id'], node['qualifiedName'], node['category']))
+        yield Entity(node['id'], node['qualifiedName'], node['category'])
+
+
+def enre_dependencies(edges):
     for edge in edges:
         values = edge['values']
         for value in values.keys():
             type = value
-        edge_count.append(Dependency(type, edge['src'], edge['dest']))
-    output_file(node_count, output+"/enre_"+projectname+"_entity.json", projectname, "entity")
-    output_file(edge_count, output+"/enre_"+projectname+"_dependency.json", projectname, "dependency")
+        yield Dependency(type, edge['src'], edge['dest'])
 
 
-def understand_format(entity_path: str, dependency_path:str, projectname:str, output:str):
-    with open(dependency_path, 'r', encoding='utf-8') as understand_file:
-        understand_edge = json.load(understand_file)
-    edges = understand_edge['cells']
-    edge_count = list()
+def enre_format(path: str, projectname:str, output:str, stream: bool = False,
+                fmt: str = "json", compress: str = "none"):
+    if stream:
+        nodes = iter_array(path, 'variables')
+        edges = iter_array(path, 'cells')
+    else:
+        with open(path, 'r', encoding='utf-8') as understand_file:
+            enre_result = json.load(understand_file)
+        nodes = enre_result['variables']
+        edges = enre_result['cells']
+    output_file(enre_entities(nodes), output+"/enre_"+projectname+"_entity.json", projectname, "entity", fmt, compress)
+    output_file(enre_dependencies(edges), output+"/enre_"+projectname+"_dependency.json", projectname, "dependency", fmt, compress)
+
+
+def understand_dependencies(edges):
     for edge in edges:
         details = edge['details']
         for detail in details:
             src = detail['src']
             dest = detail['dest']
-            edge_count.append(Dependency(detail['type'], src['object'], dest['object']))
-    output_file(edge_count, output + "/understand_" + projectname + "_dependency.json", projectname, "dependency")
+            yield Dependency(detail['type'], src['object'], dest['object'])
 
 
-def sourcetrail_format(entity_path: str, dependency_path:str, projectname:str, output:str):
-    entity_dict = {"1": "symbol", "4": "built-in", "16": "namespace", "32": "package",
-                   "128": "public class", "256": "interface", "512": "Annotation",
-                   "1024": "global variable", "2048": "field", "4096": "function",
-                   "8192": "method", "16384": "enum", "32768": "enumerator", "65536": "typedef",
-                   "131072": "class", "262144": "file", "524144": "macro", "1048576": "union"}
+def understand_format(entity_path: str, dependency_path:str, projectname:str, output:str, stream: bool = False,
+                      fmt: str = "json", compress: str = "none"):
+    if stream:
+        edges = iter_array(dependency_path, 'cells')
+    else:
+        with open(dependency_path, 'r', encoding='utf-8') as understand_file:
+            understand_edge = json.load(understand_file)
+        edges = understand_edge['cells']
+    output_file(understand_dependencies(edges), output + "/understand_" + projectname + "_dependency.json", projectname, "dependency", fmt, compress)
 
-    dependency_dict = {"1": "scope resolve", "2": "type use", "4": "use", "8": "call",
-                       "16": "extend", "32": "override", "64": "type argument",
-                       "256": "include", "512": "import", "2048": "macro use",
-                       "4096": "annotation use"}
-    csvFile = open(entity_path, "r")
-    dict_reader = csv.DictReader(csvFile)
 
-    node_list = list()
-    for row in dict_reader:
-        if row['serialized_name'].__contains__("	s	p"):
-            row['serialized_name'] = row['serialized_name'].replace("	s	p", "")
-        if row['serialized_name'].__contains__("/	m"):
-            row['serialized_name'] = row['serialized_name'].replace("/	m", "")
-        if row['serialized_name'].__contains__("::	m.:main:."):
-            row['serialized_name'] = row['serialized_name'].replace("::	m.:main:.", "")
-        if row['serialized_name'].__contains__("::    m"):
-            row['serialized_name'] = row['serialized_name'].replace("::    m", "")
-        if row['serialized_name'].__contains__("\tn"):
-            row['serialized_name'] = row['serialized_name'].replace("\tn", ".")
-        if row['serialized_name'].__contains__("\tm"):
-            row['serialized_name'] = row['serialized_name'].replace("\tm", "")
-        if row['serialized_name'].__contains__("\ts"):
-            row['serialized_name'] = row['serialized_name'].replace("\ts", "")
-        if row['serialized_name'].__contains__("\tp"):
-            row['serialized_name'] = row['serialized_name'].replace("\tp", "")
-        if row['type'] in entity_dict.keys():
-            type = entity_dict[row['type']]
-        else:
-            type = None
-            print(row['type'])
-            print(row['serialized_name'])
-        node_list.append(Entity(int(row['id']), row['serialized_name'], type))
-    output_file(node_list, output + "/sourcetrail_" + projectname + "_entity.json", projectname, "entity")
+SOURCETRAIL_ENTITY_TYPES = {"1": "symbol", "4": "built-in", "16": "namespace", "32": "package",
+                            "128": "public class", "256": "interface", "512": "Annotation",
+                            "1024": "global variable", "2048": "field", "4096": "function",
+                            "8192": "method", "16384": "enum", "32768": "enumerator", "65536": "typedef",
+                            "131072": "class", "262144": "file", "524144": "macro", "1048576": "union"}
+
+SOURCETRAIL_DEPENDENCY_TYPES = {"1": "scope resolve", "2": "type use", "4": "use", "8": "call",
+                                "16": "extend", "32": "override", "64": "type argument",
+                                "256": "include", "512": "import", "2048": "macro use",
+                                "4096": "annotation use"}
+
+# serialized_name里要删除的分隔标记，用一个预编译的正则一次扫描删掉，再把名字层级分隔符\tn换成'.'
+SERIALIZED_NAME_MARKS = re.compile("\ts\tp|/\tm|::\tm\\.:main:\\.|::    m|\t[msp]")
+SQLITE_MAGIC = b"SQLite format 3\x00"
 
 
-    csvFile = open(dependency_path, "r")
-    dict_reader = csv.DictReader(csvFile)
+def decode_serialized_name(name: str):
+    return SERIALIZED_NAME_MARKS.sub("", name).replace("\tn", ".")
+
+
+def is_sqlite(path: str):
+    with open(path, "rb") as file:
+        return file.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+
+
+# Sourcetrail的节点和边：(id, type, serialized_name) 和 (type, source_node_id, target_node_id)
+# .srctrldb直接整表查询，否则读手工导出的node.csv和edge.csv；类型统一成字符串
+def sourcetrail_rows(entity_path: str, dependency_path: str):
+    if is_sqlite(entity_path):
+        with closing(sqlite3.connect(f"file:{entity_path}?mode=ro", uri=True)) as connection:
+            nodes = connection.execute("SELECT id, CAST(type AS TEXT), serialized_name FROM node").fetchall()
+            edges = connection.execute(
+                "SELECT CAST(type AS TEXT), source_node_id, target_node_id FROM edge").fetchall()
+        return nodes, edges
+    with open(entity_path, "r", newline="") as csvFile:
+        nodes = [(int(row['id']), row['type'], row['serialized_name']) for row in csv.DictReader(csvFile)]
+    with open(dependency_path, "r", newline="") as csvFile:
+        edges = [(row['type'], int(row['source_node_id']), int(row['target_node_id']))
+                 for row in csv.DictReader(csvFile)]
+    return nodes, edges
+
+
+def sourcetrail_format(entity_path: str, dependency_path:str, projectname:str, output:str,
+                       fmt: str = "json", compress: str = "none"):
+    nodes, edges = sourcetrail_rows(entity_path, dependency_path)
+
+    unknown_nodes = Counter()
+    node_list = list()
+    for id, node_type, serialized_name in nodes:
+        type = SOURCETRAIL_ENTITY_TYPES.get(node_type)
+        if type is None:
+            unknown_nodes[node_type] += 1
+        node_list.append(Entity(id, decode_serialized_name(serialized_name), type))
+    output_file(node_list, output + "/sourcetrail_" + projectname + "_entity.json", projectname, "entity", fmt, compress)
+
+    unknown_edges = Counter()
     edge_list = list()
-    for row in dict_reader:
-        if row['type'] in dependency_dict.keys():
-            type = dependency_dict[row['type']]
-        else:
-            type = None
-            print(row['type'])
-            print(row)
-        edge_list.append(Dependency(type, int(row['source_node_id']), int(row['target_node_id'])))
-    output_file(edge_list, output + "/sourcetrail_" + projectname + "_dependency.json", projectname, "dependency")
+    for edge_type, source_node_id, target_node_id in edges:
+        type = SOURCETRAIL_DEPENDENCY_TYPES.get(edge_type)
+        if type is None:
+            unknown_edges[edge_type] += 1
+        edge_list.append(Dependency(type, source_node_id, target_node_id))
+    output_file(edge_list, output + "/sourcetrail_" + projectname + "_dependency.json", projectname, "dependency", fmt, compress)
+    if unknown_nodes or unknown_edges:
+        print(f"unknown sourcetrail types: node {dict(unknown_nodes)}, edge {dict(unknown_edges)}")
 
 
-def depends_format(entity_path: str, dependency_path:str, projectname:str, output:str):
-    with open(entity_path, 'r', encoding='utf-8') as txtfile:
-        nodes = txtfile.read()
-    node_list = nodes.split("\n")
-    node_count = list()
-    for node in node_list:
+def depends_entities(lines):
+    for node in lines:
         node_info = node.split("/")
         if len(node_info) >= 3:
             type = node_info[2].split(".")[-1]
             type = type.replace("Entity", "")
-            node_count.append(Entity(int(node_info[0]),  node_info[1], type))
-    output_file(node_count, output + "/depends_" + projectname + "_entity.json", projectname, "entity")
-    with open(dependency_path, 'r', encoding='utf-8') as depends_file:
-        depends_edge = json.load(depends_file)
-    edge_count = list()
-    for cell in depends_edge['cells']:
+            yield Entity(int(node_info[0]),  node_info[1], type)
+
+
+def depends_dependencies(cells):
+    for cell in cells:
         values = cell['values']
         for value in values.keys():
-            edge_count.append(Dependency(value, cell['src'], cell['dest']))
-    output_file(edge_count, output + "/depends_" + projectname + "_dependency.json", projectname, "dependency")
-
-
-def code2graph_format(entity_path: str, dependency_path:str, projectname:str, output:str):
-    f = open(entity_path, encoding="utf-8")
-    file_text = f.read()
-    f.close()
-    lines = file_text.split("\n")
-    entityList = list()
-    dependencyList = list()
-    for line in lines:
-        if len(line) > 11:
-            if (line.__contains__("->")) & ("id=" not in line):
-                srcID = int(line[2:line.find("-") - 1])
-                destID = int(line[line.find(">") + 2:line.find("[") - 1])
-                indexes = line.split("\"")
-                type = None
-                for i in range(len(indexes)):
-                    if indexes[i].__contains__("type="):
-                        type = indexes[i + 1]
-                dependencyList.append(Dependency(type, srcID, destID))
-            else:
-                indexes = line.split("\"")
-                entityName = None
-                for i in range(len(indexes)):
-                    if indexes[i].endswith("id="):
-                        entityId = int(indexes[i + 1])
-                    if indexes[i].__eq__(" uri="):
-                        entityName = indexes[i + 1]
-                    if indexes[i].__eq__(" type="):
-                        entityType = indexes[i + 1]
-                entityList.append(Entity(entityId, entityName, entityType))
-    output_file(entityList, output + "/code2graph_" + projectname + "_entity.json", projectname, "entity")
-    output_file(dependencyList, output + "/code2graph_" + projectname + "_dependency.json", projectname, "dependency")
+            yield Dependency(value, cell['src'], cell['dest'])
 
 
-if __name__ == "__main__":
-    tool, entityInput, dependencyInput, projectname, output = parse_args()
+def depends_format(entity_path: str, dependency_path:str, projectname:str, output:str, stream: bool = False,
+                   fmt: str = "json", compress: str = "none"):
+    with open(entity_path, 'r', encoding='utf-8') as txtfile:
+        if stream:
+            node_list = (line[:-1] if line.endswith("\n") else line for line in txtfile)
+        else:
+            node_list = txtfile.read().split("\n")
+        output_file(depends_entities(node_list), output + "/depends_" + projectname + "_entity.json", projectname, "entity", fmt, compress)
+    if stream:
+        cells = iter_array(dependency_path, 'cells')
+    else:
+        with open(dependency_path, 'r', encoding='utf-8') as depends_file:
+            depends_edge = json.load(depends_file)
+        cells = depends_edge['cells']
+    output_file(depends_dependencies(cells), output + "/depends_" + projectname + "_dependency.json", projectname, "dependency", fmt, compress)
+
+
+# DOT语句：行首是节点名，边多一个"-> 目标"，属性都在方括号里，形如 key="value"，值里允许\"转义
+DOT_NODE = re.compile(r'^[ \t]*(\d+)[ \t]*\[(.*)\]', re.MULTILINE)
+DOT_EDGE = re.compile(r'^[ \t]*(\d+)[ \t]*->[ \t]*(\d+)[ \t]*\[(.*)\]', re.MULTILINE)
+DOT_ATTRIBUTE = re.compile(r'(\w+)[ \t]*=[ \t]*"([^"\\]*(?:\\.[^"\\]*)*)"')
+DOT_CHUNK_SIZE = 1 << 20
+
+
+# 按块读取DOT文件，每块在最后一个换行处切开，整块交给正则找语句，不匹配的行在正则内部跳过
+def dot_chunks(path: str):
+    with open(path, encoding="utf-8") as dot_file:
+        rest = ""
+        while True:
+            chunk = dot_file.read(DOT_CHUNK_SIZE)
+            if not chunk:
+                if rest:
+                    yield rest
+                return
+            chunk = rest + chunk
+            end = chunk.rfind("\n") + 1
+            rest = chunk[end:]
+            if end:
+                yield chunk[:end]
+
+
+def code2graph_entities(path: str):
+    for chunk in dot_chunks(path):
+        for name, attribute_text in DOT_NODE.findall(chunk):
+            attributes = dict(DOT_ATTRIBUTE.findall(attribute_text))
+            yield Entity(int(attributes.get("id", name)), attributes.get("uri"), attributes.get("type"))
+
+
+def code2graph_dependencies(path: str):
+    for chunk in dot_chunks(path):
+        for src, dest, attribute_text in DOT_EDGE.findall(chunk):
+            attributes = dict(DOT_ATTRIBUTE.findall(attribute_text))
+            yield Dependency(attributes.get("type"), int(src), int(dest))
+
+
+# 实体和边在DOT里是交错的，分两遍读文件，每遍都是流式的，内存占用和图的大小无关
+def code2graph_format(entity_path: str, dependency_path:str, projectname:str, output:str,
+                      fmt: str = "json", compress: str = "none"):
+    output_file(code2graph_entities(entity_path), output + "/code2graph_" + projectname + "_entity.json", projectname, "entity", fmt, compress)
+    output_file(code2graph_dependencies(entity_path), output + "/code2graph_" + projectname + "_dependency.json", projectname, "dependency", fmt, compress)
+
+
+# 输入文件和上次解析时完全相同，直接从缓存的表写出结果
+def cached_format(cache, key, tool: str, projectname: str, output: str, fmt: str, compress: str):
+    kinds = TOOL_KINDS.get(tool, ['entity', 'dependency'])
+    tables = [cache.get(key, kind) for kind in kinds]
+    if None in tables:
+        return False
+    for kind, table in zip(kinds, tables):
+        json_path = output + "/" + tool + "_" + projectname + "_" + kind + ".json"
+        if fmt == 'columnar':
+            columnar.copy_table(cache.entry(key, kind), output_path(json_path, fmt), projectname)
+        else:
+            output_file(iter(table), json_path, projectname, kind, fmt, compress)
+        table.close()
+    return True
+
+
+# 每个转换器实际读取的输入文件：enre和code2graph只读-e，understand只读-d，.srctrldb的sourcetrail只读-e。
+# 解析缓存的键只哈希这些文件，batch.py判断Format是否需要重跑也看这些文件
+def converter_inputs(tool: str, entity_path: str, dependency_path: str):
+    if tool == 'understand':
+        return [dependency_path]
+    if tool in ['enre', 'code2graph'] or (tool == 'sourcetrail' and is_sqlite(entity_path)):
+        return [entity_path]
+    return [entity_path, dependency_path]
+
+
+def convert(tool, entityInput, dependencyInput, projectname, output, stream, fmt, compress):
     if tool == "enre":
-        enre_format(entityInput, projectname, output)
+        enre_format(entityInput, projectname, output, stream, fmt, compress)
     if tool == "understand":
-        understand_format(entityInput, dependencyInput, projectname, output)
+        understand_format(entityInput, dependencyInput, projectname, output, stream, fmt, compress)
     if tool == "sourcetrail":
-        sourcetrail_format(entityInput, dependencyInput, projectname, output)
+        sourcetrail_format(entityInput, dependencyInput, projectname, output, fmt=fmt, compress=compress)
     if tool == "depends":
-        depends_format(entityInput, dependencyInput, projectname, output)
+        depends_format(entityInput, dependencyInput, projectname, output, stream, fmt, compress)
     if tool == "code2graph":
-        code2graph_format(entityInput, dependencyInput, projectname, output)
\ No newline at end of file
+        code2graph_format(entityInput, dependencyInput, projectname, output, fmt=fmt, compress=compress)
+
+
+if __name__ == "__main__":
+    tool, entityInput, dependencyInput, projectname, output, stream, fmt, compress, cache, profiler = parse_args()
+    if cache.enabled:
+        with profiler.phase('cache_key'):
+            cache_key = cache.key(tool, CONVERTER_VERSION, *converter_inputs(tool, entityInput, dependencyInput))
+        with profiler.phase('cached'):
+            hit = cached_format(cache, cache_key, tool, projectname, output, fmt, compress)
+        if not hit:
+            # 流式转换不写缓存：写缓存要先在内存里建出整张表，流式的内存上限就没了，命中时仍然内存映射读取
+            if not stream:
+                parse_cache = cache
+            with profiler.phase('convert'):
+                convert(tool, entityInput, dependencyInput, projectname, output, stream, fmt, compress)
+    else:
+        with profiler.phase('convert'):
+            convert(tool, entityInput, dependencyInput, projectname, output, stream, fmt, compress)
+    if profiler.write(output + "/" + tool + "_" + projectname + "_profile.json", 'Format'):
+        print(f'profile: {output}/{tool}_{projectname}_profile.json')
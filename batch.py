@@ -0,0 +1,263 @@
+import argparse
+import ast
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from Format import TOOL_KINDS, converter_inputs, is_sqlite
+from differ import COMPARERS
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+TOOLS = ['code2graph', 'sourcetrail', 'understand', 'enre', 'depends']
+# 记录每一步上次成功时的命令行，命令行变了(比如换了--typed)即使输出比输入新也要重跑
+STATE_FILE = '.batch_state.json'
+# 这些工具的Format要读单独的依赖文件
+DEPENDENCY_REQUIRED = ['understand', 'depends']
+
+
+# 一步就是一次命令行调用：输入文件、输出文件、依赖的上游步骤
+class Step:
+    def __init__(self, name: str, argv: list, inputs: list, outputs: list, after: list):
+        self.name = name
+        self.argv = argv
+        self.inputs = inputs
+        self.outputs = outputs
+        self.after = after
+        self.status = 'pending'
+        self.seconds = 0.0
+        self.result = ''
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("manifest", type=str, help="JSON manifest listing the raw tool outputs of every project")
+    parser.add_argument("-o", "--output", type=str, help="output directory, overrides the manifest")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="steps run at the same time")
+    parser.add_argument("-k", "--steps", type=str, default='.*', help="regular expression selecting steps to run")
+    parser.add_argument("--lsh", action="store_true", help="use MinHash LSH candidates for sourcetrail vs depends")
+    parser.add_argument("-t", "--typed", action="store_true",
+                        help="only match edges whose normalized dependency types agree")
+    parser.add_argument("--force", action="store_true", help="run the steps even if their outputs are up to date")
+    parser.add_argument("-n", "--dry-run", action="store_true", help="only print the steps and whether they would run")
+    parser.add_argument("--no-cache", action="store_true", help="pass --no-cache to every step")
+    args = parser.parse_args()
+    try:
+        with open(args.manifest, 'r', encoding='utf-8') as file:
+            manifest = json.load(file)
+    except (OSError, ValueError) as error:
+        parser.error(f'cannot read manifest {args.manifest}: {error}')
+    # 清单里的相对路径(包括output)相对清单所在目录，-o相对当前目录
+    base = os.path.dirname(os.path.abspath(args.manifest))
+    output = args.output or (manifest.get('output') and os.path.join(base, manifest['output']))
+    if not output:
+        parser.error('no output directory, give -o or "output" in the manifest')
+    try:
+        projects = check_manifest(manifest, base)
+    except ValueError as error:
+        parser.error(str(error))
+    return projects, os.path.abspath(output), args.jobs, re.compile(args.steps), args.lsh, args.typed, \
+           args.force, args.dry_run, args.no_cache
+
+
+# 清单格式：
+# {"output": "./survey",
+#  "projects": {"halo": {"tools": {"enre": {"entity": "...", "dependency": "..."}, ...},
+#                        "pairs": [["enre", "understand"], ...]}}}
+# pairs省略时比较两边工具都有的所有COMPARERS组合；enre、code2graph和.srctrldb的sourcetrail只需要entity，
+# node.csv导出的sourcetrail还要edge.csv作为dependency
+def check_manifest(manifest: dict, base: str):
+    projects = dict()
+    for project, config in manifest.get('projects', dict()).items():
+        tools = dict()
+        for tool, files in config.get('tools', dict()).items():
+            if tool not in TOOLS:
+                raise ValueError(f'{project}: unknown tool {tool!r}, expected one of {TOOLS}')
+            if 'entity' not in files:
+                raise ValueError(f'{project}/{tool}: expected entity file')
+            paths = {kind: os.path.join(base, path) for kind, path in files.items()}
+            if 'dependency' not in paths and needs_dependency(tool, paths['entity']):
+                raise ValueError(f'{project}/{tool}: expected entity and dependency files')
+            tools[tool] = paths
+        pairs = [tuple(pair) for pair in config.get('pairs', [])] or \
+                [pair for pair in COMPARERS if pair[0] in tools and pair[1] in tools]
+        for pair in pairs:
+            if pair not in COMPARERS or pair[0] not in tools or pair[1] not in tools:
+                raise ValueError(f'{project}: no entity comparer or missing tool for pair {pair}')
+        projects[project] = {'tools': tools, 'pairs': pairs}
+    if not projects:
+        raise ValueError('the manifest lists no projects')
+    return projects
+
+
+def needs_dependency(tool: str, entity: str):
+    if tool in DEPENDENCY_REQUIRED:
+        return True
+    if tool != 'sourcetrail':
+        return False
+    try:
+        return not is_sqlite(entity)
+    except OSError as error:
+        raise ValueError(f'cannot read {entity}: {error}')
+
+
+# 每个项目的DAG：每个工具一次Format -> 每对工具的实体比较 -> 用实体比较结果做依赖比较
+def build_steps(projects: dict, output: str, lsh: bool, typed: bool, no_cache: bool):
+    steps = []
+    cache = ['--no-cache'] if no_cache else []
+    for project, config in projects.items():
+        directory = os.path.join(output, project)
+        formatted = dict()
+        for tool, files in config['tools'].items():
+            kinds = TOOL_KINDS.get(tool, ['entity', 'dependency'])
+            outputs = {kind: os.path.join(directory, f'{tool}_{project}_{kind}.json') for kind in kinds}
+            # understand的实体文件本来就是归一化的，直接拿来比较
+            if 'entity' not in kinds:
+                outputs['entity'] = files['entity']
+            # 不读依赖文件的工具(enre、code2graph、.srctrldb)随便给个-d，Format会忽略
+            dependency = files.get('dependency', files['entity'])
+            inputs = converter_inputs(tool, files['entity'], dependency)
+            name = f'{project}/format-{tool}'
+            steps.append(Step(name, ['Format.py', '-t', tool, '-e', files['entity'], '-d', dependency,
+                                     '-p', project, '-o', directory] + cache,
+                              inputs, [outputs[kind] for kind in kinds], []))
+            formatted[tool] = (name, outputs)
+        for l_tool, r_tool in config['pairs']:
+            l_name, l_outputs = formatted[l_tool]
+            r_name, r_outputs = formatted[r_tool]
+            entity_output = os.path.join(directory, f'{l_tool}_{r_tool}_entity_output.json')
+            argv = ['differ.py', f'--ltype={l_tool}', f'--lhs={l_outputs["entity"]}', f'--rtype={r_tool}',
+                    f'--rhs={r_outputs["entity"]}', '--compare=entity', f'--output={entity_output}'] + cache
+            if lsh:
+                argv.append('--lsh')
+            entity_name = f'{project}/differ-{l_tool}-{r_tool}'
+            steps.append(Step(entity_name, argv, [l_outputs['entity'], r_outputs['entity']], [entity_output],
+                              [l_name, r_name]))
+            dependency_output = os.path.join(directory, f'{l_tool}_{r_tool}_dependency_output.json')
+            argv = ['dependency_diff.py', '-lt', l_tool, '-rt', r_tool, '-e', entity_output,
+                    '-ld', l_outputs['dependency'], '-rd', r_outputs['dependency'], '-p', project,
+                    '-o', dependency_output] + cache
+            if typed:
+                argv.append('--typed')
+            steps.append(Step(f'{project}/dependency-{l_tool}-{r_tool}', argv,
+                              [entity_output, l_outputs['dependency'], r_outputs['dependency']],
+                              [dependency_output], [entity_name, l_name, r_name]))
+    return steps
+
+
+# 输出都存在、都不比任何输入旧、命令行也和上次一样时跳过
+def up_to_date(step: Step, state: dict):
+    if state.get(step.name) != step.argv:
+        return False
+    try:
+        newest_input = max(os.path.getmtime(path) for path in step.inputs)
+        return all(os.path.getmtime(path) >= newest_input for path in step.outputs)
+    except (OSError, ValueError):
+        return False
+
+
+# 子进程里跑一步，differ和dependency_diff最后一行打印的是结果统计
+def run(step: Step):
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable] + step.argv, cwd=ROOT, capture_output=True, text=True)
+    seconds = time.perf_counter() - start
+    if process.returncode:
+        return seconds, False, process.stderr.strip().splitlines()[-1] if process.stderr.strip() else \
+            f'exited with {process.returncode}'
+    lines = process.stdout.strip().splitlines()
+    for line in reversed(lines):
+        if line.startswith('{'):
+            try:
+                return seconds, True, ast.literal_eval(line)
+            except (ValueError, SyntaxError):
+                break
+    return seconds, True, ''
+
+
+# 上游全部完成(跑完或者已是最新)的步骤就可以提交，上游失败的步骤标为blocked
+def schedule(steps: list, jobs: int, selected, force: bool, state: dict, state_path: str):
+    by_name = {step.name: step for step in steps}
+    remaining = list(steps)
+    running = dict()
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        while remaining or running:
+            for step in list(remaining):
+                upstream = [by_name[name].status for name in step.after]
+                if any(status in ('failed', 'blocked') for status in upstream):
+                    step.status = 'blocked'
+                elif any(status in ('pending', 'running') for status in upstream):
+                    continue
+                elif not selected.search(step.name) or (not force and 'ran' not in upstream and up_to_date(step, state)):
+                    step.status = 'up-to-date' if selected.search(step.name) else 'skipped'
+                else:
+                    step.status = 'running'
+                    for path in step.outputs:
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                    running[executor.submit(run, step)] = step
+                remaining.remove(step)
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step = running.pop(future)
+                step.seconds, ok, step.result = future.result()
+                step.status = 'ran' if ok else 'failed'
+                if ok:
+                    state[step.name] = step.argv
+                else:
+                    state.pop(step.name, None)
+                save_state(state_path, state)
+                print(f'{step.status:<7}{step.seconds:>9.2f}s  {step.name}  {step.result}', flush=True)
+
+
+def load_state(path: str):
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return dict()
+
+
+def save_state(path: str, state: dict):
+    with open(path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(state, file, indent=4)
+    os.replace(path + '.tmp', path)
+
+
+def summary(steps: list, wall: float):
+    print(f"\n{'step':<48}{'status':<12}{'seconds':>9}  result")
+    for step in steps:
+        print(f"{step.name:<48}{step.status:<12}{step.seconds:>9.2f}  {step.result}")
+    counts = dict()
+    for step in steps:
+        counts[step.status] = counts.get(step.status, 0) + 1
+    busy = sum(step.seconds for step in steps)
+    print(f"\n{len(steps)} steps {counts}, {busy:.1f}s of work in {wall:.1f}s wall")
+
+
+if __name__ == "__main__":
+    PROJECTS, OUTPUT, JOBS, SELECTED, LSH, TYPED, FORCE, DRY_RUN, NO_CACHE = parse_args()
+    STEPS = build_steps(PROJECTS, OUTPUT, LSH, TYPED, NO_CACHE)
+    os.makedirs(OUTPUT, exist_ok=True)
+    STATE_PATH = os.path.join(OUTPUT, STATE_FILE)
+    STATE = load_state(STATE_PATH)
+    if DRY_RUN:
+        # 步骤按拓扑序生成，上游要重跑的下游也要重跑
+        WOULD_RUN = set()
+        for each in STEPS:
+            if not SELECTED.search(each.name):
+                print(f"{'skipped':<12}{each.name}")
+                continue
+            if FORCE or WOULD_RUN.intersection(each.after) or not up_to_date(each, STATE):
+                WOULD_RUN.add(each.name)
+            print(f"{'run' if each.name in WOULD_RUN else 'up-to-date':<12}{each.name}")
+        sys.exit(0)
+    START = time.perf_counter()
+    schedule(STEPS, JOBS, SELECTED, FORCE, STATE, STATE_PATH)
+    summary(STEPS, time.perf_counter() - START)
+    if any(each.status in ('failed', 'blocked') for each in STEPS):
+        sys.exit(1)
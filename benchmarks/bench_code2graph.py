@@ -0,0 +1,116 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Format
+
+
+ENTITY_TYPES = ['FILE', 'CLASS', 'METHOD', 'FIELD', 'VARIABLE']
+EDGE_TYPES = ['caller', 'parameter', 'annotation', 'casted_object']
+
+
+# 生成code2graph风格的DOT：节点带id/uri/type属性，边只带type，节点和边交错出现
+def generate(path: str, nodes: int, edges_per_node: int, seed: int = 1):
+    generator = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as dot_file:
+        dot_file.write('digraph G {\n')
+        for i in range(nodes):
+            dot_file.write(f'  {i} [id="{i}" uri="file:///src/main/java/run/halo/pkg{i % 97}/Class{i // 20}.java'
+                           f'#member{i}" type="{ENTITY_TYPES[i % len(ENTITY_TYPES)]}"];\n')
+            for _ in range(edges_per_node if i else 0):
+                dot_file.write(f'  {i} -> {generator.randrange(i)} '
+                               f'[type="{EDGE_TYPES[generator.randrange(len(EDGE_TYPES))]}"];\n')
+        dot_file.write('}\n')
+
+
+# 改动之前的code2graph_format解析部分：整个文件读进来再逐行split
+def legacy_parse(entity_path: str):
+    f = open(entity_path, encoding="utf-8")
+    file_text = f.read()
+    f.close()
+    lines = file_text.split("\n")
+    entityList = list()
+    dependencyList = list()
+    for line in lines:
+        if len(line) > 11:
+            if (line.__contains__("->")) & ("id=" not in line):
+                srcID = int(line[2:line.find("-") - 1])
+                destID = int(line[line.find(">") + 2:line.find("[") - 1])
+                indexes = line.split("\"")
+                type = None
+                for i in range(len(indexes)):
+                    if indexes[i].__contains__("type="):
+                        type = indexes[i + 1]
+                dependencyList.append(Format.Dependency(type, srcID, destID))
+            else:
+                indexes = line.split("\"")
+                entityName = None
+                for i in range(len(indexes)):
+                    if indexes[i].endswith("id="):
+                        entityId = int(indexes[i + 1])
+                    if indexes[i].__eq__(" uri="):
+                        entityName = indexes[i + 1]
+                    if indexes[i].__eq__(" type="):
+                        entityType = indexes[i + 1]
+                entityList.append(Format.Entity(entityId, entityName, entityType))
+    return entityList, dependencyList
+
+
+# 和code2graph_format一样只逐条消费记录，不留在内存里
+def streaming_parse(entity_path: str):
+    entities = sum(1 for _ in Format.code2graph_entities(entity_path))
+    dependencies = sum(1 for _ in Format.code2graph_dependencies(entity_path))
+    return entities, dependencies
+
+
+def measure(parse, path: str, repeat: int):
+    seconds = min(timed(parse, path) for _ in range(repeat))
+    tracemalloc.start()
+    parse(path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def timed(parse, path: str):
+    start = time.perf_counter()
+    parse(path)
+    return time.perf_counter() - start
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", type=str, help="existing DOT file, a synthetic graph is generated by default")
+    parser.add_argument("-n", "--nodes", type=int, default=200000, help="nodes of the synthetic graph")
+    parser.add_argument("-e", "--edges-per-node", type=int, default=4, help="outgoing edges per synthetic node")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="timed runs per parser, the best one is reported")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    path = args.input
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), 'code2graph.dot')
+        generate(path, args.nodes, args.edges_per_node)
+    size = os.path.getsize(path) / (1 << 20)
+
+    legacy_entities, legacy_dependencies = legacy_parse(path)
+    same = (legacy_entities == list(Format.code2graph_entities(path))
+            and legacy_dependencies == list(Format.code2graph_dependencies(path)))
+    print(f"{path}: {size:.1f} MB, {len(legacy_entities)} entities, {len(legacy_dependencies)} edges, "
+          f"records {'identical' if same else 'DIFFER'}")
+    del legacy_entities, legacy_dependencies
+    print(f"{'parser':<12}{'seconds':>10}{'MB/s':>10}{'peak MB':>10}")
+    for name, parse in [('legacy', legacy_parse), ('streaming', streaming_parse)]:
+        seconds, peak = measure(parse, path, args.repeat)
+        print(f"{name:<12}{seconds:>10.2f}{size / seconds:>10.1f}{peak / (1 << 20):>10.1f}")
+    if args.input is None:
+        os.remove(path)
+        os.rmdir(os.path.dirname(path))
@@ -0,0 +1,84 @@
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import columnar
+import dependency_diff
+import differ
+from record_io import iter_section
+
+
+# 改动之前的记录类：每个实例一个__dict__，字符串不驻留
+class DictEntity:
+    def __init__(self, source, dataset):
+        for key in ['entityID', 'entityName', 'entityType', 'entityFile',
+                    'startLine', 'startColumn', 'endLine', 'endColumn']:
+            setattr(self, key, source[key])
+        self.dataset = dataset
+
+
+class DictDependency:
+    def __init__(self, source, dataset):
+        for key in ['dependencyType', 'dependencySrcID', 'startLine', 'startColumn', 'endLine', 'endColumn']:
+            setattr(self, key, source[key])
+        self.dependencyDestID = source.get('dependencyDestID', source.get('dependencydestID'))
+        self.dataset = dataset
+
+
+# 从JSON文本开始构造记录，丢掉中间的dict之后统计仍被记录占用的内存（包括字符串）
+def measure(build, text: str, count: int):
+    tracemalloc.start()
+    records = json.loads(text)
+    result = build(records)
+    del records
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return retained / max(count, 1)
+
+
+def report(path: str, kind: str, tool: str):
+    records = list(iter_section(path, kind))
+    text = json.dumps(records)
+    if kind == 'entity':
+        legacy = lambda rs: [DictEntity(each, tool) for each in rs]
+        slotted = lambda rs: [differ.Entity.construct(each, tool) for each in rs]
+    else:
+        legacy = lambda rs: [DictDependency(each, tool) for each in rs]
+        slotted = lambda rs: [dependency_diff.Dependency.construct(each, tool) for each in rs]
+    return {
+        'file': path,
+        'records': len(records),
+        'dict_bytes': measure(legacy, text, len(records)),
+        'slots_bytes': measure(slotted, text, len(records)),
+        'table_bytes': measure(lambda rs: columnar.table_from_records(kind, rs), text, len(records)),
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("inputs", nargs='*', help="tool:kind:path triples, the halo tables by default")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    inputs = parse_args().inputs or [
+        'enre:entity:' + os.path.join(root, 'halo', 'enre_halo_entity.json'),
+        'depends:entity:' + os.path.join(root, 'halo', 'depends_halo_entity.json'),
+        'understand:entity:' + os.path.join(root, 'input', 'understand_halo_entity.json'),
+        'enre:dependency:' + os.path.join(root, 'halo', 'enre_halo_dependency.json'),
+        'understand:dependency:' + os.path.join(root, 'halo', 'understand_halo_dependency.json'),
+    ]
+    print(f"{'file':<40}{'records':>9}{'__dict__':>10}{'__slots__':>11}{'table':>9}  (bytes/record)")
+    for each in inputs:
+        tool, kind, path = each.split(':', 2)
+        row = report(path, kind, tool)
+        print(f"{os.path.basename(row['file']):<40}{row['records']:>9}{row['dict_bytes']:>10.0f}"
+              f"{row['slots_bytes']:>11.0f}{row['table_bytes']:>9.0f}")
@@ -0,0 +1,28 @@
+import atexit
+import os
+import runpy
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from profiling import peak_rss_mb
+
+
+# 在子进程里测自己的峰值RSS，退出时作为stderr最后一行报告给suite.py，Windows上没有os.wait4
+# Unix上再算上已经回收的子进程(并行加载和分片比较的worker)，Windows上只有这个进程本身
+def report():
+    peak = peak_rss_mb()
+    if os.name == 'posix':
+        import resource
+        children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        children = children if sys.platform == 'darwin' else children * 1024
+        peak = max(peak, round(children / (1 << 20), 1))
+    sys.stderr.write(f'\npeak_rss_mb {peak}\n')
+    sys.stderr.flush()
+
+
+if __name__ == "__main__":
+    sys.argv = sys.argv[1:]
+    atexit.register(report)
+    runpy.run_path(os.path.join(ROOT, sys.argv[0]), run_name='__main__')
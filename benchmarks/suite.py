@@ -0,0 +1,160 @@
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+
+import synthetic
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stage.py')
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+PAIRS = [('enre', 'depends'), ('understand', 'depends'), ('enre', 'understand'), ('sourcetrail', 'depends')]
+
+
+# 一个阶段就是一次命令行调用：名字、参数、输入文件(算吞吐量)、处理的记录数
+def stages(data: str, output: str, manifest: dict):
+    files = {tool: {kind: os.path.join(data, name) for kind, name in names.items()}
+             for tool, names in manifest['files'].items()}
+    records = manifest['records']
+    result = []
+    for tool in manifest['tools']:
+        inputs = sorted(set(files[tool].values()))
+        result.append((f'format-{tool}', ['Format.py', '-t', tool, '-e', files[tool]['entity'],
+                                          '-d', files[tool]['dependency'], '-p', 'synthetic', '-o', output, '--no-cache'],
+                       inputs, records[tool]['entity'] + records[tool]['dependency']))
+
+    # Understand的实体文件本来就是归一化的，不经过Format
+    def entity_file(tool):
+        return files[tool]['entity'] if tool == 'understand' else os.path.join(output, f'{tool}_synthetic_entity.json')
+
+    for l_tool, r_tool in PAIRS:
+        if l_tool not in files or r_tool not in files:
+            continue
+        argv = ['differ.py', f'--ltype={l_tool}', f'--lhs={entity_file(l_tool)}', f'--rtype={r_tool}',
+                f'--rhs={entity_file(r_tool)}', '--compare=entity',
+                f'--output={os.path.join(output, f"{l_tool}_{r_tool}_entity_output.json")}', '--no-cache']
+        if l_tool == 'sourcetrail':
+            argv.append('--lsh')
+        result.append((f'differ-{l_tool}-{r_tool}', argv, [entity_file(l_tool), entity_file(r_tool)],
+                       records[l_tool]['entity'] + records[r_tool]['entity']))
+    if 'enre' in files and 'understand' in files:
+        dependencies = [os.path.join(output, f'{tool}_synthetic_dependency.json') for tool in ['enre', 'understand']]
+        result.append(('dependency-enre-understand',
+                       ['dependency_diff.py', '-lt', 'enre', '-rt', 'understand',
+                        '-e', os.path.join(output, 'enre_understand_entity_output.json'),
+                        '-ld', dependencies[0], '-rd', dependencies[1], '-p', 'synthetic',
+                        '-o', os.path.join(output, 'enre_understand_dependency_output.json'), '--no-cache'],
+                       dependencies, records['enre']['dependency'] + records['understand']['dependency']))
+    return result
+
+
+# 子进程跑一个阶段，由stage.py包一层，子进程自己测峰值RSS并在stderr最后一行报告，取不到时是None
+def run(argv: list):
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, STAGE] + argv, cwd=ROOT, stdout=subprocess.DEVNULL,
+                             stderr=subprocess.PIPE, text=True, errors='replace')
+    seconds = time.perf_counter() - start
+    lines = process.stderr.strip().splitlines()
+    if process.returncode:
+        raise RuntimeError(f'{argv[0]} exited with {process.returncode}:\n{process.stderr}')
+    peak = lines[-1].split()[1] if lines and lines[-1].startswith('peak_rss_mb ') else 'None'
+    return seconds, None if peak == 'None' else float(peak)
+
+
+# 数据按规模缓存在workdir下，参数没变就不重新生成
+def prepare(workdir: str, entities: int, edges: int, overlap: float, seed: int):
+    data = os.path.join(workdir, str(entities))
+    try:
+        with open(os.path.join(data, 'manifest.json'), 'r', encoding='utf-8') as file:
+            manifest = json.load(file)
+        if (manifest['entities'], manifest['edges'], manifest['overlap'], manifest['seed']) == (entities, edges, overlap, seed):
+            return data, manifest
+    except (OSError, ValueError, KeyError):
+        pass
+    print(f'generating {entities} entities, {edges} edges in {data}')
+    return data, synthetic.generate(data, entities, edges, overlap, seed)
+
+
+# 比基线慢或者占内存多出tolerance就算回退，很短的阶段额外放宽slack秒，避免计时抖动误报
+def regressions(results: dict, baseline: dict, tolerance: float, slack: float):
+    found = []
+    for size, measured in results.items():
+        for stage, current in measured.items():
+            base = baseline.get(size, dict()).get(stage)
+            if base is None:
+                continue
+            if current['seconds'] > base['seconds'] * (1 + tolerance) + slack:
+                found.append(f"{size}/{stage}: {current['seconds']:.2f}s vs baseline {base['seconds']:.2f}s")
+            # 没有测到RSS的一方(比如Windows上取不到)不比较内存
+            if None in (current['peak_rss_mb'], base['peak_rss_mb']):
+                continue
+            if current['peak_rss_mb'] > base['peak_rss_mb'] * (1 + tolerance):
+                found.append(f"{size}/{stage}: {current['peak_rss_mb']:.0f}MB vs baseline {base['peak_rss_mb']:.0f}MB")
+    return found
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--sizes", type=int, nargs='+', default=[10000],
+                        help="entities of each synthetic project, from 10k up to 10M")
+    parser.add_argument("-m", "--edges-per-entity", type=float, default=2.0, help="dependencies per entity")
+    parser.add_argument("-r", "--overlap", type=float, default=0.8, help="probability that a tool reports an entity or edge")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("-w", "--workdir", type=str, default=os.path.join(ROOT, '.bench'),
+                        help="where the synthetic data and stage outputs are kept")
+    parser.add_argument("-k", "--stages", type=str, default='.*', help="regular expression selecting stages")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per stage, the fastest one is reported")
+    parser.add_argument("-b", "--baseline", type=str, default=BASELINE)
+    parser.add_argument("-u", "--update-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("-t", "--tolerance", type=float, default=0.25, help="allowed relative slowdown or memory growth")
+    parser.add_argument("--slack", type=float, default=0.3, help="allowed absolute slowdown in seconds")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    selected = re.compile(args.stages)
+    results = dict()
+    print(f"{'size':>9}  {'stage':<30}{'seconds':>9}{'MB/s':>9}{'krec/s':>9}{'peak MB':>9}")
+    for entities in args.sizes:
+        data, manifest = prepare(args.workdir, entities, int(entities * args.edges_per_entity), args.overlap, args.seed)
+        output = os.path.join(data, 'output')
+        os.makedirs(output, exist_ok=True)
+        measured = results.setdefault(str(entities), dict())
+        for name, argv, inputs, records in stages(data, output, manifest):
+            if not selected.search(name):
+                continue
+            runs = [run(argv) for _ in range(args.repeat)]
+            seconds = min(each[0] for each in runs)
+            peaks = [each[1] for each in runs if each[1] is not None]
+            peak = max(peaks) if peaks else None
+            size = sum(os.path.getsize(each) for each in inputs) / (1 << 20)
+            measured[name] = {'seconds': round(seconds, 3), 'peak_rss_mb': peak,
+                              'input_mb': round(size, 2), 'records': records}
+            print(f"{entities:>9}  {name:<30}{seconds:>9.2f}{size / seconds:>9.1f}"
+                  f"{records / seconds / 1000:>9.1f}{'-' if peak is None else f'{peak:.1f}':>9}", flush=True)
+
+    if args.update_baseline:
+        stored = dict()
+        if os.path.exists(args.baseline):
+            with open(args.baseline, 'r', encoding='utf-8') as file:
+                stored = json.load(file)
+        stored['machine'] = f'{platform.machine()} {platform.system()} python {platform.python_version()}'
+        for size, measured in results.items():
+            stored.setdefault('results', dict()).setdefault(size, dict()).update(measured)
+        with open(args.baseline, 'w', encoding='utf-8') as file:
+            json.dump(stored, file, indent=4)
+        print(f'baseline written to {args.baseline}')
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            found = regressions(results, json.load(file).get('results', dict()), args.tolerance, args.slack)
+        for each in found:
+            print(f'REGRESSION {each}')
+        if found:
+            sys.exit(1)
+        print('no regressions against the baseline')
@@ -0,0 +1,262 @@
+import argparse
+import json
+import math
+import os
+import random
+
+
+# 合成项目：每个类占BLOCK个连续的实体下标，依次是文件(每PACKAGE_EVERY个类的第一个换成包)、类、方法、字段，
+# 实体的种类和名字都由下标算出来，不需要把整个项目放在内存里
+BLOCK = 20
+METHODS = range(2, 10)
+PACKAGE_EVERY = 50
+EDGE_KINDS = ['call', 'use', 'import', 'extend', 'implement', 'cast', 'set', 'parameter']
+TOOLS = ['enre', 'understand', 'sourcetrail', 'depends', 'code2graph']
+MASK = (1 << 64) - 1
+
+
+def entity_kind(i: int):
+    position = i % BLOCK
+    if position == 0:
+        return 'package' if (i // BLOCK) % PACKAGE_EVERY == 0 else 'file'
+    if position == 1:
+        return 'class'
+    return 'method' if position in METHODS else 'field'
+
+
+# 名字由词表拼出来，长短和字符都有变化，模糊匹配的候选分布才接近真实项目
+WORDS = ['cache', 'lock', 'post', 'comment', 'user', 'attachment', 'option', 'theme', 'menu', 'tag', 'category',
+         'journal', 'photo', 'link', 'sheet', 'backup', 'migration', 'token', 'authentication', 'event', 'listener',
+         'handler', 'filter', 'repository', 'service', 'controller', 'property', 'config', 'template', 'render']
+VERBS = ['get', 'set', 'list', 'find', 'create', 'update', 'remove', 'convert', 'build', 'handle', 'validate',
+         'publish', 'increase', 'refresh', 'import', 'export']
+RETURN_TYPES = ['void', 'int', 'boolean', 'long', 'java.lang.String', 'java.util.List', 'java.util.Optional']
+
+
+def word(key: int, capital: bool = False):
+    each = WORDS[(key * 2654435761 >> 7) % len(WORDS)]
+    return each.capitalize() if capital else each
+
+
+def entity_name(i: int):
+    klass = i // BLOCK
+    package = f'com.synth.{word(klass // PACKAGE_EVERY)}{klass // PACKAGE_EVERY}'
+    class_name = f'{package}.{word(klass, True)}{word(klass * 7 + 3, True)}{klass}'
+    kind = entity_kind(i)
+    if kind == 'package':
+        return package
+    if kind == 'file':
+        return f'D:/synth/src/{class_name.replace(".", "/")}.java'
+    if kind == 'class':
+        return class_name
+    if kind == 'method':
+        return f'{class_name}.{VERBS[(i * 40503 >> 3) % len(VERBS)]}{word(i * 3 + 1, True)}'
+    return f'{class_name}.{word(i * 5 + 2)}{i % BLOCK}'
+
+
+# 每个工具看到的实体和边由哈希决定，overlap是每个工具看到某个实体的概率，两个工具的重合率约为overlap^2
+class ToolView:
+    def __init__(self, tool: str, entities: int, overlap: float, seed: int):
+        generator = random.Random(f'{seed}:{tool}')
+        self.tool = tool
+        self.entities = entities
+        self.salt = generator.getrandbits(64)
+        self.threshold = int(overlap * (1 << 24))
+        # 工具内的ID是下标的一个仿射置换，各工具的ID互不相同
+        self.scale = generator.randrange(1, max(entities, 2))
+        while math.gcd(self.scale, entities) != 1:
+            self.scale += 1
+        self.offset = generator.randrange(entities)
+        self.counts = {'entity': 0, 'dependency': 0}
+
+    def sees(self, key: int):
+        return (((key + self.salt) * 0x9E3779B97F4A7C15) & MASK) >> 40 < self.threshold
+
+    def id(self, i: int):
+        return (i * self.scale + self.offset) % self.entities
+
+
+def edges(entities: int, count: int, seed: int):
+    generator = random.Random(f'{seed}:edges')
+    for _ in range(count):
+        yield generator.randrange(entities), generator.randrange(entities), EDGE_KINDS[generator.randrange(len(EDGE_KINDS))]
+
+
+def visible_edges(view: ToolView, entities: int, count: int, seed: int):
+    for number, (src, dest, kind) in enumerate(edges(entities, count, seed)):
+        if view.sees(src) and view.sees(dest) and view.sees(entities + number):
+            view.counts['dependency'] += 1
+            yield view.id(src), view.id(dest), kind
+
+
+def visible_entities(view: ToolView):
+    for i in range(view.entities):
+        if view.sees(i):
+            view.counts['entity'] += 1
+            yield view.id(i), i
+
+
+# 把可迭代对象按JSON数组逐个元素写出，不在内存里拼整个数组
+def write_array(file, values):
+    file.write('[')
+    for number, value in enumerate(values):
+        file.write(',\n' if number else '\n')
+        file.write(json.dumps(value))
+    file.write('\n]')
+
+
+ENRE_CATEGORIES = {'package': 'Package', 'file': 'File', 'class': 'Class', 'method': 'Method', 'field': 'Variable'}
+ENRE_EDGES = {'call': 'Call', 'use': 'Use', 'import': 'Import', 'extend': 'Inherit', 'implement': 'Implement',
+              'cast': 'Cast', 'set': 'Set', 'parameter': 'Parameter'}
+
+
+def enre_name(i: int):
+    # ENRE的文件实体用类的全限定名
+    if entity_kind(i) == 'file':
+        return entity_name(i - i % BLOCK + 1)
+    return entity_name(i)
+
+
+def write_enre(path: str, view: ToolView, entities: int, count: int, seed: int):
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write('{"schemaVersion": "1.0", "variables": ')
+        write_array(file, ({'id': tool_id, 'qualifiedName': enre_name(i), 'category': ENRE_CATEGORIES[entity_kind(i)],
+                            'external': False} for tool_id, i in visible_entities(view)))
+        file.write(', "cells": ')
+        write_array(file, ({'src': src, 'dest': dest, 'values': {ENRE_EDGES[kind]: 1}}
+                           for src, dest, kind in visible_edges(view, entities, count, seed)))
+        file.write('}\n')
+
+
+UNDERSTAND_TYPES = {'package': 'Package', 'file': 'File', 'class': 'Public Class', 'method': 'Public Method',
+                    'field': 'Private Variable'}
+UNDERSTAND_EDGES = {'call': 'Call', 'use': 'Use', 'import': 'Import', 'extend': 'Extend', 'implement': 'Implement',
+                    'cast': 'Cast', 'set': 'Set', 'parameter': 'Typed'}
+
+
+# Understand的实体本来就是归一化的JSON，依赖是按(src, dest)分组的cells
+def write_understand(entity_path: str, dependency_path: str, view: ToolView, entities: int, count: int, seed: int):
+    with open(entity_path, 'w', encoding='utf-8') as file:
+        file.write('{"schemaVersion": 1.0, "entity": ')
+        write_array(file, ({'entityID': tool_id, 'entityName': entity_name(i),
+                            'entityType': UNDERSTAND_TYPES[entity_kind(i)], 'entityFile': None,
+                            'startLine': -1, 'startColumn': -1, 'endLine': -1, 'endColumn': -1}
+                           for tool_id, i in visible_entities(view)))
+        file.write(', "projectName": "synthetic"}\n')
+    with open(dependency_path, 'w', encoding='utf-8') as file:
+        file.write('{"name": "synthetic", "cells": ')
+        write_array(file, ({'src': src, 'dest': dest, 'details': [
+            {'src': {'object': src}, 'dest': {'object': dest}, 'type': UNDERSTAND_EDGES[kind]}]}
+            for src, dest, kind in visible_edges(view, entities, count, seed)))
+        file.write('}\n')
+
+
+SOURCETRAIL_TYPES = {'package': 32, 'file': 262144, 'class': 128, 'method': 8192, 'field': 2048}
+SOURCETRAIL_EDGES = {'call': 8, 'use': 4, 'import': 512, 'extend': 16, 'implement': 16,
+                     'cast': 2, 'set': 4, 'parameter': 64}
+
+
+# Sourcetrail的serialized_name：路径或名字的每一级后面跟\ts\tp，级与级之间用\tn连接
+def sourcetrail_name(i: int):
+    name = entity_name(i)
+    if entity_kind(i) == 'file':
+        return '/\tm' + name + '\ts\tp'
+    if entity_kind(i) == 'method':
+        # 方法名后面跟着返回类型，解码后直接接在名字后面
+        return '.\tm' + '\ts\tp\tn'.join(name.split('.')) + '\ts' + RETURN_TYPES[i % len(RETURN_TYPES)] + '\tp'
+    return '.\tm' + '\ts\tp\tn'.join(name.split('.')) + '\ts\tp'
+
+
+def write_sourcetrail(node_path: str, edge_path: str, view: ToolView, entities: int, count: int, seed: int):
+    with open(node_path, 'w', encoding='utf-8', newline='') as file:
+        file.write('id,type,serialized_name\r\n')
+        for tool_id, i in visible_entities(view):
+            file.write(f'{tool_id},{SOURCETRAIL_TYPES[entity_kind(i)]},{sourcetrail_name(i)}\r\n')
+    with open(edge_path, 'w', encoding='utf-8', newline='') as file:
+        file.write('id,type,source_node_id,target_node_id\r\n')
+        for number, (src, dest, kind) in enumerate(visible_edges(view, entities, count, seed)):
+            file.write(f'{entities + number},{SOURCETRAIL_EDGES[kind]},{src},{dest}\r\n')
+
+
+DEPENDS_TYPES = {'package': 'Package', 'file': 'File', 'class': 'Type', 'method': 'Function', 'field': 'Var'}
+DEPENDS_EDGES = {'call': 'Call', 'use': 'Use', 'import': 'Import', 'extend': 'Extend', 'implement': 'Implement',
+                 'cast': 'Cast', 'set': 'Use', 'parameter': 'Parameter'}
+
+
+def write_depends(entity_path: str, dependency_path: str, view: ToolView, entities: int, count: int, seed: int):
+    with open(entity_path, 'w', encoding='utf-8') as file:
+        for tool_id, i in visible_entities(view):
+            name = entity_name(i).replace('/', '\\') if entity_kind(i) == 'file' else entity_name(i)
+            file.write(f'{tool_id}/{name}/class depends.entity.{DEPENDS_TYPES[entity_kind(i)]}Entity\n')
+    with open(dependency_path, 'w', encoding='utf-8') as file:
+        file.write('{"schemaVersion": "1.0", "name": "synthetic", "cells": ')
+        write_array(file, ({'src': src, 'dest': dest, 'values': {DEPENDS_EDGES[kind]: 1.0}}
+                           for src, dest, kind in visible_edges(view, entities, count, seed)))
+        file.write('}\n')
+
+
+CODE2GRAPH_TYPES = {'package': 'PACKAGE', 'file': 'FILE', 'class': 'CLASS', 'method': 'METHOD', 'field': 'VARIABLE'}
+CODE2GRAPH_EDGES = {'call': 'caller', 'use': 'caller', 'import': 'annotation', 'extend': 'annotation',
+                    'implement': 'annotation', 'cast': 'casted_object', 'set': 'caller', 'parameter': 'parameter'}
+
+
+def write_code2graph(path: str, view: ToolView, entities: int, count: int, seed: int):
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write('digraph G {\n')
+        for tool_id, i in visible_entities(view):
+            file.write(f'  {tool_id} [id="{tool_id}" uri="{entity_name(i)}" type="{CODE2GRAPH_TYPES[entity_kind(i)]}"];\n')
+        for src, dest, kind in visible_edges(view, entities, count, seed):
+            file.write(f'  {src} -> {dest} [type="{CODE2GRAPH_EDGES[kind]}"];\n')
+        file.write('}\n')
+
+
+# 各工具的原始输出文件，键是Format.py的-e/-d参数
+OUTPUTS = {
+    'enre': {'entity': 'enre.json', 'dependency': 'enre.json'},
+    'understand': {'entity': 'understand_entity.json', 'dependency': 'understand.json'},
+    'sourcetrail': {'entity': 'node.csv', 'dependency': 'edge.csv'},
+    'depends': {'entity': 'depends.txt', 'dependency': 'depends.json'},
+    'code2graph': {'entity': 'code2graph.dot', 'dependency': 'code2graph.dot'},
+}
+
+
+def generate(directory: str, entities: int, edge_count: int, overlap: float, seed: int = 1, tools=TOOLS):
+    os.makedirs(directory, exist_ok=True)
+    records = dict()
+    for tool in tools:
+        view = ToolView(tool, entities, overlap, seed)
+        files = {kind: os.path.join(directory, name) for kind, name in OUTPUTS[tool].items()}
+        if tool == 'enre':
+            write_enre(files['entity'], view, entities, edge_count, seed)
+        elif tool == 'understand':
+            write_understand(files['entity'], files['dependency'], view, entities, edge_count, seed)
+        elif tool == 'sourcetrail':
+            write_sourcetrail(files['entity'], files['dependency'], view, entities, edge_count, seed)
+        elif tool == 'depends':
+            write_depends(files['entity'], files['dependency'], view, entities, edge_count, seed)
+        elif tool == 'code2graph':
+            write_code2graph(files['entity'], view, entities, edge_count, seed)
+        records[tool] = view.counts
+    manifest = {'entities': entities, 'edges': edge_count, 'overlap': overlap, 'seed': seed, 'tools': list(tools),
+                'files': {tool: OUTPUTS[tool] for tool in tools}, 'records': records}
+    with open(os.path.join(directory, 'manifest.json'), 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=4)
+    return manifest
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("output", type=str, help="directory for the generated tool outputs")
+    parser.add_argument("-n", "--entities", type=int, default=10000, help="entities of the synthetic project")
+    parser.add_argument("-m", "--edges", type=int, default=None, help="dependencies of the synthetic project, 2x entities by default")
+    parser.add_argument("-r", "--overlap", type=float, default=0.8,
+                        help="probability that a tool reports an entity or edge, tools agree on about overlap^2")
+    parser.add_argument("-s", "--seed", type=int, default=1)
+    parser.add_argument("-t", "--tools", type=str, nargs='*', choices=TOOLS, default=TOOLS)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    generate(args.output, args.entities, args.edges if args.edges is not None else 2 * args.entities,
+             args.overlap, args.seed, args.tools)
@@ -0,0 +1,373 @@
+import argparse
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+from array import array
+
+import record_io
+
+
+# 二进制列式中间格式，与schemaVersion 1.0的JSON一一对应
+# 文件结构: MAGIC | 版本(uint32) | 头长度(uint32) | JSON头 | 按8字节对齐的各列
+# 整数列是定长小端数组，字符串列存字典编码，字典本身是偏移数组加UTF-8字节串
+MAGIC = b'STACOL\x00\x00'
+VERSION = 1
+PREAMBLE = struct.Struct('<8sII')
+ALIGNMENT = 8
+
+LOCATION_COLUMNS = ['startLine', 'startColumn', 'endLine', 'endColumn']
+# 每种表的列: (列名, 类型码, 字符串字典名)，字符串列的值是字典下标，None用-1表示
+SCHEMA = {
+    'entity': [('entityID', 'q', None), ('entityName', 'i', 'names'), ('entityType', 'i', 'types'),
+               ('entityFile', 'i', 'files')] + [(name, 'i', None) for name in LOCATION_COLUMNS],
+    'dependency': [('dependencyType', 'i', 'types'), ('dependencySrcID', 'q', None),
+                   ('dependencyDestID', 'q', None)] + [(name, 'i', None) for name in LOCATION_COLUMNS],
+}
+# 旧版本Format写出的依赖文件用的是dependencydestID
+ALIASES = {'dependencyDestID': 'dependencydestID'}
+
+
+def is_columnar(path: str):
+    with open(path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+# 字符串驻留表：相同的字符串只存一份，编码为下标
+# 从文件加载时按需解码，每个下标只解码一次，之后所有记录共享同一个str对象
+class StringPool:
+    def __init__(self, offsets=None, blob=None):
+        self.offsets = offsets
+        self.blob = blob
+        self.codes = dict()
+        self.values = []
+        if offsets is not None:
+            self.values = [None] * (len(offsets) - 1)
+
+    def __len__(self):
+        return len(self.values)
+
+    def intern(self, value):
+        if value is None:
+            return -1
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+    def __getitem__(self, code: int):
+        if code < 0:
+            return None
+        value = self.values[code]
+        if value is None:
+            value = str(self.blob[self.offsets[code]:self.offsets[code + 1]], 'utf-8')
+            self.values[code] = value
+        return value
+
+    def encode(self):
+        offsets = array('q', [0])
+        blob = bytearray()
+        for code in range(len(self)):
+            blob += self[code].encode('utf-8')
+            offsets.append(len(blob))
+        return offsets, bytes(blob)
+
+
+# 一张列式表：写入时列是array，从文件加载时列是mmap上的memoryview，不复制数据
+class Table:
+    def __init__(self, kind: str, projectname: str = None):
+        self.kind = kind
+        self.projectname = projectname
+        self.columns = {name: array(code) for name, code, _ in SCHEMA[kind]}
+        self.pools = {pool: StringPool() for _, _, pool in SCHEMA[kind] if pool is not None}
+        self.pool_of = {name: pool for name, _, pool in SCHEMA[kind]}
+        self.mapped = None
+
+    def __len__(self):
+        return len(self.columns[SCHEMA[self.kind][0][0]])
+
+    def append(self, record: dict):
+        for name, _, pool in SCHEMA[self.kind]:
+            value = record[name] if name in record or name not in ALIASES else record[ALIASES[name]]
+            self.columns[name].append(value if pool is None else self.pools[pool].intern(value))
+
+    def value(self, name: str, i: int):
+        pool = self.pool_of[name]
+        value = self.columns[name][i]
+        return value if pool is None else self.pools[pool][value]
+
+    def record(self, i: int):
+        return {name: self.columns[name][i] if pool is None else self.pools[pool][self.columns[name][i]]
+                for name, _, pool in SCHEMA[self.kind]}
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.record(i)
+
+    def close(self):
+        if self.mapped is not None:
+            self.columns = dict()
+            self.pools = dict()
+            self.mapped.close()
+            self.mapped = None
+
+
+def table_from_records(kind: str, records, projectname: str = None):
+    table = Table(kind, projectname)
+    for record in records:
+        table.append(record)
+    return table
+
+
+# 头后面补空格，保证各列从8字节对齐的位置开始
+def encode_header(header: dict):
+    header_bytes = json.dumps(header).encode('utf-8')
+    return header_bytes + b' ' * ((-(PREAMBLE.size + len(header_bytes))) % ALIGNMENT)
+
+
+# 按文件布局切成一段段字节：前导、头、各列和补齐的空字节，整数列不复制，直接给出底层内存
+# 写文件和写共享内存共用，总长度就是各段长度之和
+def table_chunks(table: Table):
+    blobs = []
+    for name, _, _ in SCHEMA[table.kind]:
+        blobs.append((name, table.columns[name]))
+    for pool_name, pool in table.pools.items():
+        offsets, blob = pool.encode()
+        blobs.append((pool_name + '.offsets', offsets))
+        blobs.append((pool_name + '.blob', blob))
+    segments = []
+    data_chunks = []
+    for name, data in blobs:
+        typecode = data.typecode if isinstance(data, array) else data.format if isinstance(data, memoryview) else 'B'
+        data = little_endian_bytes(data, typecode)
+        segments.append((name, typecode, len(data)))
+        data_chunks.append(data)
+        data_chunks.append(b'\x00' * ((-len(data)) % ALIGNMENT))
+    return [preamble(table.kind, table.projectname, len(table), segments)] + data_chunks
+
+
+def little_endian_bytes(data, typecode: str):
+    if typecode == 'B':
+        return data
+    if sys.byteorder != 'little':
+        data = array(typecode, data)
+        data.byteswap()
+    return memoryview(data).cast('B')
+
+
+# 前导和头：segments是按文件顺序排列的(段名, 类型码, 字节数)，各段从8字节对齐的位置开始
+def preamble(kind: str, projectname: str, rows: int, segments: list):
+    header = {'schemaVersion': 1.0, 'kind': kind, 'projectName': projectname,
+              'rows': rows, 'byteorder': 'little', 'columns': dict()}
+    offset = 0
+    for name, typecode, size in segments:
+        header['columns'][name] = {'type': typecode, 'offset': offset, 'length': size // struct.calcsize(typecode)}
+        offset += size + (-size) % ALIGNMENT
+    header_bytes = encode_header(header)
+    return PREAMBLE.pack(MAGIC, VERSION, len(header_bytes)) + header_bytes
+
+
+# 边读边写列式文件，内存和行数无关：每列攒够STREAM_ROWS行就追加到自己的临时文件，字符串字典的值也逐个追加。
+# 去重表超过STREAM_UNIQUE个值时清空重来，相邻的重复值仍然只存一份，只是远处重复的值可能再存一次，读出的记录不变。
+# 关闭时写头，再按文件布局依次拷贝各段；临时文件放在输出旁边
+STREAM_ROWS = 1 << 16
+STREAM_UNIQUE = 1 << 16
+
+
+class ColumnarWriter:
+    def __init__(self, path: str, kind: str, projectname: str = None):
+        self.path = path
+        self.kind = kind
+        self.projectname = projectname
+        self.rows = 0
+        self.directory = tempfile.mkdtemp(prefix='.columnar-', dir=os.path.dirname(os.path.abspath(path)))
+        self.columns = {name: array(code) for name, code, _ in SCHEMA[kind]}
+        self.pools = {pool: StreamingPool() for _, _, pool in SCHEMA[kind] if pool is not None}
+        # 各段按文件里的顺序：先是各列，再是每个字典的偏移和字节串
+        self.typecodes = {name: code for name, code, _ in SCHEMA[kind]}
+        for pool in self.pools:
+            self.typecodes.update({pool + '.offsets': 'q', pool + '.blob': 'B'})
+        self.files = {name: open(os.path.join(self.directory, name), 'wb') for name in self.typecodes}
+        self.sizes = dict.fromkeys(self.typecodes, 0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.close()
+        finally:
+            for file in self.files.values():
+                file.close()
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def append(self, record: dict):
+        for name, _, pool in SCHEMA[self.kind]:
+            value = record[name] if name in record or name not in ALIASES else record[ALIASES[name]]
+            self.columns[name].append(value if pool is None else self.pools[pool].intern(value))
+        self.rows += 1
+        if len(self.columns[SCHEMA[self.kind][0][0]]) >= STREAM_ROWS:
+            self.flush()
+
+    def write(self, name: str, data):
+        data = little_endian_bytes(data, self.typecodes[name])
+        self.files[name].write(data)
+        self.sizes[name] += len(data)
+
+    def flush(self):
+        for name, column in self.columns.items():
+            self.write(name, column)
+            self.columns[name] = array(column.typecode)
+        for name, pool in self.pools.items():
+            offsets, blob = pool.take()
+            self.write(name + '.offsets', offsets)
+            self.write(name + '.blob', blob)
+
+    def close(self):
+        self.flush()
+        segments = [(name, self.typecodes[name], size) for name, size in self.sizes.items()]
+        with open(self.path, 'wb') as target:
+            target.write(preamble(self.kind, self.projectname, self.rows, segments))
+            for name, _, size in segments:
+                self.files[name].close()
+                with open(os.path.join(self.directory, name), 'rb') as source:
+                    shutil.copyfileobj(source, target)
+                target.write(b'\x00' * ((-size) % ALIGNMENT))
+
+
+# ColumnarWriter用的字符串字典：偏移和字节串分批取走写到文件，只在内存里留最近的去重表
+class StreamingPool:
+    def __init__(self):
+        self.codes = dict()
+        self.count = 0
+        self.length = 0
+        self.offsets = array('q', [0])
+        self.blob = bytearray()
+
+    def intern(self, value):
+        if value is None:
+            return -1
+        code = self.codes.get(value)
+        if code is None:
+            if len(self.codes) >= STREAM_UNIQUE:
+                self.codes.clear()
+            code = self.codes[value] = self.count
+            self.count += 1
+            self.blob += value.encode('utf-8')
+            self.offsets.append(self.length + len(self.blob))
+        return code
+
+    def take(self):
+        offsets, blob = self.offsets, bytes(self.blob)
+        self.length += len(self.blob)
+        self.offsets = array('q')
+        self.blob = bytearray()
+        return offsets, blob
+
+
+def write_table(path: str, table: Table):
+    with open(path, 'wb') as file:
+        for chunk in table_chunks(table):
+            file.write(chunk)
+
+
+# 把表按文件布局写进一段可写内存(比如共享内存)，buffer至少要有table_chunks各段之和那么长
+def pack_table(chunks: list, buffer):
+    position = 0
+    for chunk in chunks:
+        buffer[position:position + len(chunk)] = chunk
+        position += len(chunk)
+    return position
+
+
+# 内存映射方式加载，整数列直接cast成memoryview
+def load_table(path: str):
+    with open(path, 'rb') as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    table = table_from_buffer(mapped, path)
+    table.mapped = mapped
+    return table
+
+
+# 在一段按文件布局存放的内存上构造表，不复制数据；调用方负责让buffer活得比表长
+def table_from_buffer(buffer, name: str):
+    magic, version, header_size = PREAMBLE.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError(f'{name} is not a columnar table')
+    if version != VERSION:
+        raise ValueError(f'{name} has unsupported columnar version {version}')
+    header = json.loads(bytes(buffer[PREAMBLE.size:PREAMBLE.size + header_size]))
+    base = PREAMBLE.size + header_size
+    view = memoryview(buffer)
+
+    def column(name):
+        info = header['columns'][name]
+        size = info['length'] * struct.calcsize(info['type'])
+        data = view[base + info['offset']:base + info['offset'] + size]
+        if info['type'] == 'B':
+            return data
+        if sys.byteorder != 'little':
+            swapped = array(info['type'], data)
+            swapped.byteswap()
+            return swapped
+        return data.cast(info['type'])
+
+    table = Table(header['kind'], header['projectName'])
+    table.columns = {name: column(name) for name, _, _ in SCHEMA[table.kind]}
+    table.pools = {pool: StringPool(column(pool + '.offsets'), column(pool + '.blob'))
+                   for pool in table.pools}
+    return table
+
+
+# 复制列式文件，只改写头里的项目名，各列原样拷贝
+def copy_table(source_path: str, target_path: str, projectname: str = None):
+    with open(source_path, 'rb') as source:
+        magic, version, header_size = PREAMBLE.unpack(source.read(PREAMBLE.size))
+        if magic != MAGIC:
+            raise ValueError(f'{source_path} is not a columnar table')
+        header = json.loads(source.read(header_size))
+        header['projectName'] = projectname
+        header_bytes = encode_header(header)
+        with open(target_path, 'wb') as target:
+            target.write(PREAMBLE.pack(MAGIC, version, len(header_bytes)))
+            target.write(header_bytes)
+            shutil.copyfileobj(source, target)
+
+
+def json_to_columnar(json_path: str, columnar_path: str, kind: str):
+    with ColumnarWriter(columnar_path, kind, record_io.read_field(json_path, 'projectName')) as writer:
+        for record in record_io.iter_section(json_path, kind):
+            writer.append(record)
+
+
+def columnar_to_json(columnar_path: str, json_path: str, fmt: str = None, compress: str = None):
+    table = load_table(columnar_path)
+    with record_io.DocumentWriter(json_path, fmt, compress) as writer:
+        writer.field('schemaVersion', 1.0)
+        writer.section(table.kind, iter(table))
+        writer.field('projectName', table.projectname)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("direction", choices=['to-columnar', 'to-json'], help="conversion direction")
+    parser.add_argument("input", type=str, help="please input the input file path")
+    parser.add_argument("output", type=str, help="please input the output file path")
+    parser.add_argument("-k", "--kind", type=str, choices=['entity', 'dependency'],
+                        help="table kind of a json input, inferred from the file name by default")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.direction == 'to-columnar':
+        kind = args.kind or ('dependency' if '_dependency' in args.input else 'entity')
+        json_to_columnar(args.input, args.output, kind)
+    else:
+        columnar_to_json(args.input, args.output)
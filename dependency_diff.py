@@ -1,10 +1,26 @@
 import argparse
-import json
+import heapq
+import sys
+import tempfile
+from array import array
+from bisect import bisect_left
+from collections import Counter
 from enum import Enum
+from itertools import chain, compress, repeat
+from operator import add, eq, itemgetter, lt, mul, not_, sub
+
+from columnar import Table, is_columnar, load_table, table_from_records
+from parallel_load import ParallelLoader
+from parse_cache import ParseCache, add_cache_arguments, cache_from_args
+from profiling import profile_mode, profile_path
+from record_io import COMPRESSIONS, FORMATS, DocumentWriter, iter_section
+from result_store import ResultStore, is_store
+from spill import SpillFiles, input_batches, partition_count
 
 
 class CompareResult(Enum):
     NotEQ = -1
+    MaybeEQ = 0
     Equal = 1
 
 
@@ -15,17 +31,42 @@ def parse_args():
     parser.add_argument("-rt", "--right_tool", type=str, required=True,
                         choices=['enre', 'understand', 'sourcetrail', 'depends', 'code2graph'],
                         help="choose the right tool you used, eg: understand, enre, depends...")
-    parser.add_argument("-e", "--entity", type=str, required=True, help="please input the entity file path")
+    parser.add_argument("-e", "--entity", type=str, required=True,
+                        help="please input the entity file path, or a result store (.db) holding the entity diff")
     parser.add_argument("-ld", "--left_dependency", type=str, required=True, help="please input the left dependency file path")
     parser.add_argument("-rd", "--right_dependency", type=str, required=True, help="please input the right dependency file path")
     parser.add_argument("-p", "--projectname", type=str, required=True, help="please input the project name")
-    parser.add_argument("-o", "--output", type=str, required=True, help="please input the output file path")
+    parser.add_argument("-o", "--output", type=str, required=True,
+                        help="please input the output file path, a .db path writes into the result store")
+    parser.add_argument("-t", "--typed", action="store_true",
+                        help="only match edges whose normalized dependency types agree")
+    parser.add_argument("-m", "--maybe", action="store_true",
+                        help="also map entities through maybe_eq pairs, edges matched only that way go to a maybe_eq section")
+    parser.add_argument("-f", "--format", type=str, choices=FORMATS,
+                        help="output record format, inferred from the output file extension by default")
+    parser.add_argument("-z", "--compress", type=str, choices=COMPRESSIONS,
+                        help="compress the output file, inferred from the output file extension by default")
+    parser.add_argument("--profile", type=str, nargs="?", const="full", choices=['full', 'time'],
+                        help="write per-phase time and memory with match counts next to the output file, 'time' skips the slow tracemalloc accounting")
+    parser.add_argument("--memory-budget", type=int, metavar="MB",
+                        help="join in hash partitions spilled to disk when the inputs would not fit in this much memory")
+    parser.add_argument("--spill-dir", type=str, help="directory for the partition files, the system temp directory by default")
+    add_cache_arguments(parser)
     args = parser.parse_args()
     return args.left_tool, args.right_tool, args.entity,  \
-           args.left_dependency, args.right_dependency, args.projectname, args.output
+           args.left_dependency, args.right_dependency, args.projectname, args.output, args.format, args.compress, \
+           args.typed, args.maybe, cache_from_args(args), profile_mode(args.profile), args.memory_budget, args.spill_dir
+
+
+# 依赖类型和数据集名大量重复，驻留后每个字符串只保留一份
+def intern_str(value):
+    return sys.intern(value) if isinstance(value, str) else value
 
 
 class Dependency:
+    __slots__ = ('dependencyType', 'dependencySrcID', 'dependencyDestID',
+                 'startLine', 'startColumn', 'endLine', 'endColumn', 'dataset')
+
     def __init__(self, dependencyType, dependencySrcID, dependencyDestID, startLine, startColumn, endLine, endColumn, dataset=None):
         self.dependencyType = dependencyType
         self.dependencySrcID = dependencySrcID
@@ -48,52 +89,435 @@ class Dependency:
             'dataset': self.dataset
         }
 
+    @staticmethod
+    def from_table(table: Table, i: int, dataset=None):
+        columns = table.columns
+        return Dependency(
+            table.pools['types'][columns['dependencyType'][i]],
+            columns['dependencySrcID'][i],
+            columns['dependencyDestID'][i],
+            columns['startLine'][i],
+            columns['startColumn'][i],
+            columns['endLine'][i],
+            columns['endColumn'][i],
+            intern_str(dataset)
+        )
+
+    # 按列批量构造多行，比逐行from_table少了每个字段的字典查找
+    @staticmethod
+    def batch_from_table(table: Table, rows: list, dataset=None):
+        columns = table.columns
+        return list(map(
+            Dependency,
+            map(table.pools['types'].__getitem__, map(columns['dependencyType'].__getitem__, rows)),
+            map(columns['dependencySrcID'].__getitem__, rows),
+            map(columns['dependencyDestID'].__getitem__, rows),
+            map(columns['startLine'].__getitem__, rows),
+            map(columns['startColumn'].__getitem__, rows),
+            map(columns['endLine'].__getitem__, rows),
+            map(columns['endColumn'].__getitem__, rows),
+            repeat(intern_str(dataset))
+        ))
+
     @staticmethod
     def construct(source, dataset=None):
         return Dependency(
-            source['dependencyType'],
+            intern_str(source['dependencyType']),
             source['dependencySrcID'],
-            source['dependencydestID'],
+            source['dependencyDestID'] if 'dependencyDestID' in source else source['dependencydestID'],
             source['startLine'],
             source['startColumn'],
             source['endLine'],
             source['endColumn'],
-            dataset
+            intern_str(dataset)
         )
 
 
+# 实体等价表，CSR形式：keys是排好序的左实体ID，左实体keys[i]对应的右实体是targets[offsets[i]:offsets[i + 1]]，
+# maybe[k]为1表示targets[k]来自maybe_eq。一个左实体可以对应多个右实体(重载方法、多个文件里重复的包)，
+# 全部保存在几个定长数组里，每对等价关系只占17个字节
+class EquivalenceMap:
+    __slots__ = ('keys', 'offsets', 'targets', 'maybe')
+
+    # pairs是(左ID, 右ID, 是否maybe)，重复的对只留一份，同一对既是eq又是maybe_eq时算eq
+    def __init__(self, pairs=()):
+        self.keys = array('q')
+        self.offsets = array('q', [0])
+        self.targets = array('q')
+        self.maybe = array('b')
+        previous = None
+        for src, dest, maybe in sorted_pairs(pairs):
+            if (src, dest) == previous:
+                continue
+            previous = (src, dest)
+            if not self.keys or self.keys[-1] != src:
+                self.keys.append(src)
+                self.offsets.append(self.offsets[-1])
+            self.targets.append(dest)
+            self.maybe.append(maybe)
+            self.offsets[-1] += 1
+
+    @staticmethod
+    def from_dict(eq_info: dict):
+        return EquivalenceMap((src, dest, 0) for src, dest in eq_info.items())
+
+    # 四个数组原样交出或接回，并行加载时经共享内存在进程间传递
+    def arrays(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @staticmethod
+    def from_arrays(arrays: dict):
+        equivalence = EquivalenceMap()
+        for name in EquivalenceMap.__slots__:
+            setattr(equivalence, name, arrays[name])
+        return equivalence
+
+    def __len__(self):
+        return len(self.targets)
+
+    def get(self, src):
+        i = bisect_left(self.keys, src)
+        if i == len(self.keys) or self.keys[i] != src:
+            return []
+        return list(self.targets[self.offsets[i]:self.offsets[i + 1]])
+
+    # 整列查找：返回每个ID在targets里的区间[lo, hi)，查不到时lo == hi == len(targets)，正好指向调用方在末尾放的哨兵
+    # 实体ID基本是从0开始连续编号的，ID范围不超过行数的几倍时直接按ID建start/stop两张定长表，查表在C里完成；
+    # 否则在keys上二分，查不到的位置改成指向start/count末尾多放的一项
+    def ranges(self, column):
+        keys = self.keys
+        miss = len(self.targets)
+        low = min(min(column, default=0), keys[0] if keys else 0)
+        high = max(max(column, default=0), keys[-1] if keys else 0)
+        if low >= 0 and high < DENSE_FACTOR * (len(column) + len(keys)) + DENSE_SLACK:
+            start = array('q', [miss]) * (high + 1)
+            stop = array('q', [miss]) * (high + 1)
+            for i, key in enumerate(keys):
+                start[key] = self.offsets[i]
+                stop[key] = self.offsets[i + 1]
+            return list(map(start.__getitem__, column)), list(map(stop.__getitem__, column))
+        positions = list(map(bisect_left, repeat(keys), column))
+        padded_keys = keys + array('q', [0])
+        # 命中时取positions本身，否则取len(keys)：p + (1 - found) * (len(keys) - p)
+        positions = list(map(add, positions, map(mul, map(not_, map(eq, map(padded_keys.__getitem__, positions), column)),
+                                                 map(sub, repeat(len(keys)), positions))))
+        start = self.offsets[:-1] + array('q', [miss])
+        counts = array('q', map(sub, self.offsets[1:], self.offsets[:-1])) + array('q', [0])
+        lo = list(map(start.__getitem__, positions))
+        return lo, list(map(add, lo, map(counts.__getitem__, positions)))
+
+
+# 按(左ID, 右ID, maybe)排序；ID都在[0, 2^32)内时打包成一个整数排序，省下每对一个元组
+def sorted_pairs(pairs):
+    packed = set()
+    wide = set()
+    for src, dest, maybe in pairs:
+        if 0 <= src < KEY_BASE and 0 <= dest < KEY_BASE:
+            packed.add(((src * KEY_BASE + dest) << 1) | maybe)
+        else:
+            wide.add((src, dest, maybe))
+    unpacked = (((value >> 1) // KEY_BASE, (value >> 1) % KEY_BASE, value & 1) for value in sorted(packed))
+    return heapq.merge(unpacked, sorted(wide)) if wide else unpacked
+
+
 # 处理器 集成Comparer和L_SET、R_SET，利用比较器对左右集合进行比较
+# 左右依赖都是列式表，边匹配是一次批量的哈希连接：左边的(src, dest)整列通过实体等价表映射到右边的ID，
+# 与右边的(src, dest)一起组成连接键，整列用集合求交找出能匹配上的键，
+# 只有落在交集里的边才回到Python里逐条配对并构造Dependency。typed为True时连接键再加上归一化的依赖类型
+# 等价表是多对多的：每条边先按两端各自的第一个对应实体整列生成键，
+# 两端之一有多个对应实体的边(通常很少)再逐条展开其余的组合。通过maybe_eq映射上的边放进maybe_eq_set
 class Handler:
-    def __init__(self, comparer, l_set: dict[int: Dependency], r_set: dict[int: Dependency], eq_info: dict):
+    def __init__(self, comparer, l_set: Table, r_set: Table, eq_info,
+                 l_tool: str = None, r_tool: str = None, typed: bool = False):
         self.comparer = comparer
         self.l_set = l_set
         self.r_set = r_set
-        self.eq_info = eq_info
+        self.eq_info = EquivalenceMap.from_dict(eq_info) if isinstance(eq_info, dict) else eq_info
+        self.l_tool = l_tool
+        self.r_tool = r_tool
+        self.typed = typed
+        self.type_codes = dict()
+        self.maybe_eq_set = []
+        self.confusion = Counter()
+        self.type_metrics = []
         pass
 
+    # 依赖类型按表里的类型字典归一化一次，再整列映射成小整数，末尾多放一项对应None(-1)
+    def type_column(self, table: Table, tool: str):
+        if not self.typed:
+            return repeat(0, len(table))
+        types = table.pools['types']
+        codes = [self.type_codes.setdefault(normalize_dependency_type(tool, types[code]), len(self.type_codes))
+                 for code in range(len(types))]
+        codes.append(self.type_codes.setdefault(normalize_dependency_type(tool, None), len(self.type_codes)))
+        return map(codes.__getitem__, table.columns['dependencyType'])
+
+    # 连接键：ID都在[0, 2^32)内时打包成一个整数 type * 2^64 + src * 2^32 + dest，否则用元组
+    @staticmethod
+    def join_keys(types, src, dest, packed: bool):
+        if not packed:
+            return list(zip(types, src, dest))
+        return list(map(add, map(add, map(mul, types, repeat(KEY_BASE * KEY_BASE)),
+                                 map(mul, src, repeat(KEY_BASE))), dest))
+
+    # 行级的连接结果：pairs是匹配上的(右行号, 左行号, 是否maybe)，按右边的行序，同一条右边的边对应的左边
+    # 按左边的行序；l_hit/r_hit标记每一行有没有匹配上
+    def join(self):
+        equivalence = self.eq_info
+        targets = equivalence.targets
+
+        l_src = self.l_set.columns['dependencySrcID']
+        l_dest = self.l_set.columns['dependencyDestID']
+        r_src = self.r_set.columns['dependencySrcID']
+        r_dest = self.r_set.columns['dependencyDestID']
+        packed = all(0 <= min(column, default=0) and max(column, default=0) < KEY_BASE
+                     for column in [r_src, r_dest, targets])
+        # 映射不到的实体记为MISSING，这样的键是负数(或含None的元组)，不会和右边的键相等
+        missing = MISSING if packed else None
+        src_lo, src_hi = equivalence.ranges(l_src)
+        dest_lo, dest_hi = equivalence.ranges(l_dest)
+        # 每条边先取两端各自的第一个对应实体，查不到的落在末尾的哨兵MISSING上
+        lookup = targets.tolist()
+        lookup.append(missing)
+        mapped_src = map(lookup.__getitem__, src_lo)
+        mapped_dest = map(lookup.__getitem__, dest_lo)
+        l_types = self.type_column(self.l_set, self.l_tool)
+
+        # 一端有多个对应实体的边，展开除(第一个, 第一个)以外的组合，extra_rows记下展开出的键属于哪条边
+        fanned = sorted(set(compress(range(len(l_src)), map(lt, repeat(1), map(sub, src_hi, src_lo)))).union(
+            compress(range(len(l_dest)), map(lt, repeat(1), map(sub, dest_hi, dest_lo)))))
+        extra_rows, extra_src, extra_dest, extra_slots = [], [], [], []
+        for row in fanned:
+            for a in range(src_lo[row], src_hi[row]):
+                for b in range(dest_lo[row], dest_hi[row]):
+                    if a != src_lo[row] or b != dest_lo[row]:
+                        extra_rows.append(row)
+                        extra_src.append(targets[a])
+                        extra_dest.append(targets[b])
+                        extra_slots.append((a, b))
+        if extra_rows:
+            l_types = list(l_types)
+        l_keys = self.join_keys(l_types, mapped_src, mapped_dest, packed)
+        extra_keys = self.join_keys(map(l_types.__getitem__, extra_rows) if extra_rows else (),
+                                    extra_src, extra_dest, packed)
+        r_keys = self.join_keys(self.type_column(self.r_set, self.r_tool), r_src, r_dest, packed)
+        common = set(l_keys).union(extra_keys).intersection(r_keys)
+
+        # 落在交集里的每一条左边的边都和右边同键的边配对，同一个src下同键的几条边(比如不分类型时的Call和Use)也都保留，
+        # 不会有边既不在eq也不在ne里
+        l_hit = list(map(common.__contains__, l_keys))
+        matched = list(compress(range(len(l_keys)), l_hit))
+        maybe = equivalence.maybe
+        left_index = dict()
+        if not extra_rows and 1 not in maybe:
+            for row in matched:
+                left_index.setdefault(l_keys[row], []).append((row, False))
+        else:
+            # 一条边的各个组合按边的顺序排列，第一个组合在前；同一条边得到同一个键的组合里有eq就算eq，全部经由maybe_eq的才算maybe
+            entries = [(row, l_keys[row], src_lo[row], dest_lo[row]) for row in matched]
+            entries += [(row, key, a, b) for row, key, (a, b) in zip(extra_rows, extra_keys, extra_slots)
+                        if key in common]
+            entries.sort(key=itemgetter(0))
+            flags = dict()
+            for row, key, a, b in entries:
+                l_hit[row] = True
+                flags[(row, key)] = flags.get((row, key), True) and bool(maybe[a] | maybe[b])
+            for (row, key), flag in flags.items():
+                left_index.setdefault(key, []).append((row, flag))
+        r_hit = list(map(common.__contains__, r_keys))
+        pairs = [(j, row, flag) for j in compress(range(len(r_keys)), r_hit) for row, flag in left_index[r_keys[j]]]
+        return pairs, l_hit, r_hit
+
+    # 匹配上的行构造成Dependency，每一行只构造一次：(右行号, 左行号, 左边, 右边, 是否maybe)
+    def matched(self, pairs: list):
+        l_rows = sorted({row for _, row, _ in pairs})
+        r_rows = list(dict.fromkeys(j for j, _, _ in pairs))
+        l_deps = dict(zip(l_rows, Dependency.batch_from_table(self.l_set, l_rows, self.l_tool)))
+        r_deps = dict(zip(r_rows, Dependency.batch_from_table(self.r_set, r_rows, self.r_tool)))
+        return [(j, row, l_deps[row], r_deps[j], flag) for j, row, flag in pairs]
+
+    # eq_set是匹配上的(左边, 右边)，按右边的行序；ne_set是只有一边有的边，先左后右，各自按行序
     def work(self):
-        eq_set = set()
-        ne_set = set()
-
-        eq = 0
-        eq_dict = dict()
-        for l_src in self.l_set.keys():
-            if l_src in self.eq_info.keys():
-                # 首先去匹配两个工具的src
-                dest1_2 = dict()
-                for l_dest_dep in self.l_set[l_src]:
-                    # 通过获得到src来找工具1的dest， 将工具1的dest映射到工具2的实体ID
-                    if l_dest_dep.dependencyDestID in self.eq_info.keys():
-                        dest1_2[self.eq_info[l_dest_dep.dependencyDestID]] = l_dest_dep
-                r_src = self.eq_info[l_src]
-                if r_src not in r_set.keys():
-                    continue
-                for r_dest_dep in self.r_set[r_src]:
-                    if r_dest_dep.dependencyDestID in dest1_2:
-                        eq_set.add((dest1_2[r_dest_dep.dependencyDestID], r_dest_dep))
+        eq_set = []
+        ne_set = []
+        self.maybe_eq_set = []
+        pairs, l_hit, r_hit = self.join()
+
+        # 同一遍里按归一化类型统计：confusion[(左类型, 右类型)]是匹配上的边对数，
+        # agreed记下和对面同类型的边匹配上的行，算每个类型的precision/recall用
+        l_normalize = self.normalizer(self.l_tool)
+        r_normalize = self.normalizer(self.r_tool)
+        confusion = Counter()
+        agreed_left = dict()
+        agreed_right = dict()
+        for j, row, l_dep, r_dep, flag in self.matched(pairs):
+            if flag:
+                self.maybe_eq_set.append((l_dep, r_dep))
+                continue
+            eq_set.append((l_dep, r_dep))
+            l_type = l_normalize(l_dep.dependencyType)
+            r_type = r_normalize(r_dep.dependencyType)
+            confusion[(l_type, r_type)] += 1
+            if l_type == r_type:
+                agreed_left[row] = l_type
+                agreed_right[j] = r_type
+
+        # 没有任何组合落在交集里的边就是只有一边有的边，也记进混淆矩阵的(类型, None)和(None, 类型)
+        left_only = list(compress(range(len(l_hit)), map(not_, l_hit)))
+        right_only = list(compress(range(len(r_hit)), map(not_, r_hit)))
+        ne_set.extend(Dependency.batch_from_table(self.l_set, left_only, self.l_tool))
+        ne_set.extend(Dependency.batch_from_table(self.r_set, right_only, self.r_tool))
+        for code, count in Counter(map(self.l_set.columns['dependencyType'].__getitem__, left_only)).items():
+            confusion[(l_normalize(self.l_set.pools['types'][code]), None)] += count
+        for code, count in Counter(map(self.r_set.columns['dependencyType'].__getitem__, right_only)).items():
+            confusion[(None, r_normalize(self.r_set.pools['types'][code]))] += count
+        self.confusion = confusion
+        self.type_metrics = dependency_metrics(
+            self.type_totals(self.l_set, l_normalize), self.type_totals(self.r_set, r_normalize),
+            Counter(agreed_left.values()), Counter(agreed_right.values()))
         return eq_set, ne_set
 
+    # 原始类型到归一化类型的映射，每种原始类型只归一化一次
+    @staticmethod
+    def normalizer(tool: str):
+        cache = dict()
+
+        def normalize(dependency_type):
+            if dependency_type not in cache:
+                cache[dependency_type] = normalize_dependency_type(tool, dependency_type)
+            return cache[dependency_type]
+        return normalize
 
+    # 按归一化类型统计整张表的边数，先在类型编码上计数，再按类型字典合并
+    @staticmethod
+    def type_totals(table: Table, normalize):
+        totals = Counter()
+        for code, count in Counter(table.columns['dependencyType']).items():
+            totals[normalize(table.pools['types'][code])] += count
+        return totals
+
+
+# --memory-budget：输入放不进内存时按grace hash join分区连接。右边的边按src分区，左边的边按src映射到的每个右实体分区，
+# 映射不到的边反正匹配不上，按自己的src放。连接键里带着映射后的src，能匹配上的一对一定在同一个分区里，
+# 分区里的表保持输入的行序，所以每个分区的结果顺序和整体连接一致，各分区的结果按右边的行号归并即可。一条左边的边可能进了几个分区，有没有匹配上、有没有和同类型的边
+# 匹配上都按行号记在标记数组里，最后再顺序读一遍两边的输入，找出只有一边有的边并统计各类型的边数，
+# 输出和整体连接逐字节相同。内存里同时只有一对分区、等价表和每条边一个字节的标记
+def partitioned_join(l_path: str, r_path: str, l_tool: str, r_tool: str, equivalence: EquivalenceMap, typed: bool,
+                     maybe: bool, partitions: int, spill_dir: str, output: str, fmt: str, compression: str, profiler):
+    with tempfile.TemporaryDirectory(prefix='dependency-', dir=spill_dir) as directory:
+        with profiler.phase('partition'):
+            l_spill = SpillFiles(directory, 'left', partitions)
+            r_spill = SpillFiles(directory, 'right', partitions)
+            l_rows = r_rows = 0
+            for l_rows, record in enumerate(iter_section(l_path, 'dependency'), 1):
+                src = record['dependencySrcID']
+                for partition in {target % partitions for target in equivalence.get(src)} or {src % partitions}:
+                    l_spill.write(partition, [l_rows - 1, record])
+            for r_rows, record in enumerate(iter_section(r_path, 'dependency'), 1):
+                r_spill.write(record['dependencySrcID'] % partitions, [r_rows - 1, record])
+
+        l_hit, l_agreed = bytearray(l_rows), bytearray(l_rows)
+        r_hit, r_agreed = bytearray(r_rows), bytearray(r_rows)
+        l_normalize = Handler.normalizer(l_tool)
+        r_normalize = Handler.normalizer(r_tool)
+        confusion = Counter()
+        results = SpillFiles(directory, 'result', partitions)
+        # 单独一个函数，一个分区的表在读下一个分区之前就释放
+        def join_partition(partition: int):
+            l_table, l_global = l_spill.table(partition, 'dependency')
+            r_table, r_global = r_spill.table(partition, 'dependency')
+            handler = Handler(None, l_table, r_table, equivalence, l_tool, r_tool, typed)
+            pairs, hits, r_hits = handler.join()
+            for row in compress(range(len(hits)), hits):
+                l_hit[l_global[row]] = 1
+            for j in compress(range(len(r_hits)), r_hits):
+                r_hit[r_global[j]] = 1
+            for j, row, l_dep, r_dep, flag in handler.matched(pairs):
+                results.write(partition, [r_global[j], flag, l_dep.into_dict(), r_dep.into_dict()])
+                if flag:
+                    continue
+                l_type = l_normalize(l_dep.dependencyType)
+                r_type = r_normalize(r_dep.dependencyType)
+                confusion[(l_type, r_type)] += 1
+                if l_type == r_type:
+                    l_agreed[l_global[row]] = 1
+                    r_agreed[r_global[j]] = 1
+
+        with profiler.phase('join'):
+            for partition in range(partitions):
+                join_partition(partition)
+
+        counts = Counter()
+
+        # 各分区的结果都按右边的行号排好了，归并以后就是整体连接的顺序
+        def merged(flag: int):
+            for _, each_flag, l_dep, r_dep in heapq.merge(*(results.read(partition) for partition in range(partitions)),
+                                                         key=itemgetter(0)):
+                if each_flag == flag:
+                    counts['maybe_eq' if flag else 'eq'] += 1
+                    yield l_dep, r_dep
+
+        l_totals, r_totals, l_agreed_totals, r_agreed_totals = Counter(), Counter(), Counter(), Counter()
+
+        # 只有一边有的边：整张输入分批读回，没匹配上的行按输入的顺序给出，顺带统计各类型的总数和同类型匹配上的数
+        def only(path: str, tool: str, hit: bytearray, agreed: bytearray, type_totals: Counter,
+                 agreed_totals: Counter, left: bool):
+            normalize = Handler.normalizer(tool)
+            for first, table in input_batches(path, 'dependency'):
+                types = [normalize(each) for each in map(table.pools['types'].__getitem__,
+                                                        range(-1, len(table.pools['types'])))]
+                codes = table.columns['dependencyType']
+                for i in range(len(table)):
+                    dependency_type = types[codes[i] + 1]
+                    type_totals[dependency_type] += 1
+                    if agreed[first + i]:
+                        agreed_totals[dependency_type] += 1
+                rows = [i for i in range(len(table)) if not hit[first + i]]
+                for row, dep in zip(rows, Dependency.batch_from_table(table, rows, tool)):
+                    dependency_type = types[codes[row] + 1]
+                    confusion[(dependency_type, None) if left else (None, dependency_type)] += 1
+                    counts['left_only' if left else 'right_only'] += 1
+                    yield dep.into_dict()
+
+        with profiler.phase('write'), DocumentWriter(output, fmt, compression) as writer:
+            writer.section('eq', merged(0))
+            if maybe:
+                writer.section('maybe_eq', merged(1))
+            writer.section('ne', chain(only(l_path, l_tool, l_hit, l_agreed, l_totals, l_agreed_totals, True),
+                                       only(r_path, r_tool, r_hit, r_agreed, r_totals, r_agreed_totals, False)))
+            # 只有一边有的边和各类型的总数在写ne的时候统计好了
+            writer.section('confusion', iter(confusion_rows(confusion)))
+            metrics = dependency_metrics(l_totals, r_totals, l_agreed_totals, r_agreed_totals)
+            writer.section('metrics', iter(metrics))
+    return counts, metrics
+
+
+# 每个归一化类型的一致程度，以右边的工具为参照：precision是左边该类型的边里和右边同类型的边匹配上的比例，
+# recall是右边该类型的边里被左边同类型的边匹配上的比例
+def dependency_metrics(l_totals: Counter, r_totals: Counter, l_agreed: Counter, r_agreed: Counter):
+    metrics = []
+    for dependency_type in sorted(set(l_totals) | set(r_totals), key=lambda each: (each is None, str(each))):
+        precision = l_agreed[dependency_type] / l_totals[dependency_type] if l_totals[dependency_type] else None
+        recall = r_agreed[dependency_type] / r_totals[dependency_type] if r_totals[dependency_type] else None
+        f1 = 2 * precision * recall / (precision + recall) if precision and recall else None
+        metrics.append({
+            'dependencyType': dependency_type,
+            'left': l_totals[dependency_type],
+            'right': r_totals[dependency_type],
+            'leftMatched': l_agreed[dependency_type],
+            'rightMatched': r_agreed[dependency_type],
+            'precision': round(precision, 4) if precision is not None else None,
+            'recall': round(recall, 4) if recall is not None else None,
+            'f1': round(f1, 4) if f1 is not None else None,
+        })
+    return metrics
+
+
+KEY_BASE = 1 << 32
+MISSING = -(1 << 80)
+# 等价表查找用直接寻址表的条件：最大ID < DENSE_FACTOR * 行数 + DENSE_SLACK
+DENSE_FACTOR = 4
+DENSE_SLACK = 1 << 16
 
 
 dependency_dict = {
@@ -111,23 +535,38 @@ dependency_dict = {
 }
 
 
-def get_dep_info(path: str, tool: str):
-    # 读取依赖信息
-    with open(path, 'r', encoding='utf-8') as json_file:
-        info = json.load(json_file)
-    dep_info = dict()
-    for dep in info['dependency']:
-        if dep['dependencySrcID'] not in dep_info.keys():
-            dep_list = list()
-        else:
-            dep_list = dep_info[dep['dependencySrcID']]
-        dep_list.append(Dependency.construct(dep, tool))
-        dep_info[dep['dependencySrcID']] = dep_list
-    return dep_info
+# 混淆矩阵按次数从多到少排列，次数相同时按类型名排，输出稳定
+def confusion_rows(confusion: Counter):
+    return [{'left': left, 'right': right, 'count': count}
+            for (left, right), count in sorted(confusion.items(),
+                                               key=lambda item: (-item[1], str(item[0][0]), str(item[0][1])))]
+
+
+# 归一化依赖类型，dependency_dict里没有的类型退回到大写的原始类型
+def normalize_dependency_type(tool: str, dependency_type: str):
+    normalized = dependency_dict.get(tool, dict()).get(dependency_type)
+    if normalized is None and dependency_type is not None:
+        return dependency_type.upper()
+    return normalized
+
+
+def get_dep_info(path: str, tool: str, cache: ParseCache = None):
+    # 读取依赖信息，按列保存，列式文件直接内存映射，JSON文件解析过一次之后从缓存映射
+    if is_columnar(path):
+        return load_table(path)
+    if cache is not None:
+        return cache.load_normalized(path, 'dependency')
+    return table_from_records('dependency', iter_section(path, 'dependency'))
 
 
-def get_dep(l_dep: str, l_tool:str, r_dep: str, r_tool:str):
-    return get_dep_info(l_dep, l_tool), get_dep_info(r_dep, r_tool)
+# 左右依赖在各自的子进程里解析，调用方可以传入自己的loader，和别的输入一起并行
+def get_dep(l_dep: str, l_tool:str, r_dep: str, r_tool:str, cache: ParseCache = None, loader: ParallelLoader = None):
+    if loader is None:
+        with ParallelLoader(2) as loader:
+            return get_dep(l_dep, l_tool, r_dep, r_tool, cache, loader)
+    left = loader.table(l_dep, 'dependency', cache)
+    right = loader.table(r_dep, 'dependency', cache)
+    return left.result(), right.result()
 
 
 class Dependency_Comparer:
@@ -136,20 +575,35 @@ class Dependency_Comparer:
 
 
 
-def get_entity_output_info(path: str, dataset1:str):
-    # 读取实体相似性分析结果
-    with open(path, 'r', encoding='utf-8') as json_file:
-        info = json.load(json_file)
-    info_dict = dict()
-    for entity_tuple in info['eq']:
-        src = dest = 0
-        for entity in entity_tuple:
-            if entity['dataset'] == dataset1:
-                src = entity['entityID']
-            else:
-                dest = entity['entityID']
-        info_dict[src] = dest
-    return info_dict
+def get_entity_output_info(path: str, dataset1:str, project: str = None, dataset2: str = None, maybe: bool = False):
+    # 读取实体相似性分析结果，保留所有相等的ID对；maybe为True时maybe_eq的对也放进去并打上标记
+    # 结果库里按(项目, 左工具, 右工具)走索引取ID对
+    if is_store(path):
+        with ResultStore(path, readonly=True) as store:
+            if store.has_entity_results(project, dataset1, dataset2):
+                return EquivalenceMap(store.equivalences(project, dataset1, dataset2, maybe))
+            if store.has_entity_results(project, dataset2, dataset1):
+                return EquivalenceMap((src, dest, flag) for dest, src, flag
+                                      in store.equivalences(project, dataset2, dataset1, maybe))
+        raise ValueError(f'{path}: no entity diff of {dataset1} and {dataset2} for project {project}')
+    return EquivalenceMap(entity_output_pairs(path, dataset1, ['eq', 'maybe_eq'] if maybe else ['eq']))
+
+
+# 在加载子进程里运行，等价表以数组形式传回
+def entity_output_arrays(path: str, dataset1:str, project: str = None, dataset2: str = None, maybe: bool = False):
+    return get_entity_output_info(path, dataset1, project, dataset2, maybe).arrays()
+
+
+def entity_output_pairs(path: str, dataset1: str, sections: list):
+    for flag, section in enumerate(sections):
+        for entity_tuple in iter_section(path, section):
+            src = dest = 0
+            for entity in entity_tuple:
+                if entity['dataset'] == dataset1:
+                    src = entity['entityID']
+                else:
+                    dest = entity['entityID']
+            yield src, dest, flag
 
 
 def dep_analyzer(dep_info1: dict, dep_info2: dict, eq_info: dict, maybe_eq_info: dict):
@@ -176,21 +630,69 @@ def dep_analyzer(dep_info1: dict, dep_info2: dict, eq_info: dict, maybe_eq_info:
 
 
 if __name__ == "__main__":
-    L_TOOL, R_TOOL, ENTITY, L_DEP, R_DEP, PROJECTNAME, OUTPUT = parse_args()
-    comparer = Dependency_Comparer()
-    l_set, r_set = get_dep(L_DEP, L_TOOL, R_DEP, R_TOOL)
-    eq_info = get_entity_output_info(ENTITY, L_TOOL)
-
-
-    handler = Handler(comparer, l_set, r_set, eq_info)
-
-    eq_set,  ne_set = handler.work()
-    with open(OUTPUT, 'w') as output:
-        result = {
-            'eq': [(each[0].into_dict(), each[1].into_dict()) for each in eq_set],
+    L_TOOL, R_TOOL, ENTITY, L_DEP, R_DEP, PROJECTNAME, OUTPUT, FORMAT, COMPRESS, TYPED, MAYBE, CACHE, PROFILER, \
+        MEMORY_BUDGET, SPILL_DIR = parse_args()
+    PARTITIONS = partition_count([L_DEP, R_DEP], MEMORY_BUDGET) if MEMORY_BUDGET else 1
+    if PARTITIONS > 1:
+        if is_store(OUTPUT):
+            sys.exit('--memory-budget writes a result document, not a result store')
+        with PROFILER.phase('load'):
+            eq_info = get_entity_output_info(ENTITY, L_TOOL, PROJECTNAME, R_TOOL, MAYBE)
+        print(f'partitions: {PARTITIONS}')
+        counts, type_metrics = partitioned_join(L_DEP, R_DEP, L_TOOL, R_TOOL, eq_info, TYPED, MAYBE, PARTITIONS,
+                                                SPILL_DIR, OUTPUT, FORMAT, COMPRESS, PROFILER)
+        summary = {
+            'eq': counts['eq'],
+            **({'maybe_eq': counts['maybe_eq']} if MAYBE else {}),
+            'left_only': counts['left_only'],
+            'right_only': counts['right_only'],
+        }
+    else:
+        comparer = Dependency_Comparer()
+        # 左右依赖和实体比较结果同时加载
+        with PROFILER.phase('load'), ParallelLoader(3) as loader:
+            entity_map = loader.arrays(entity_output_arrays, ENTITY, L_TOOL, PROJECTNAME, R_TOOL, MAYBE)
+            l_set, r_set = get_dep(L_DEP, L_TOOL, R_DEP, R_TOOL, CACHE, loader)
+            eq_info = EquivalenceMap.from_arrays(entity_map.result())
+
+
+        handler = Handler(comparer, l_set, r_set, eq_info, L_TOOL, R_TOOL, TYPED)
+
+        with PROFILER.phase('join'):
+            eq_set,  ne_set = handler.work()
+        maybe_eq_set = handler.maybe_eq_set
+        # 哈希连接不逐对调用比较器，按依赖类型对统计匹配上的边，只有一边有的边另一边记为None
+        if PROFILER.enabled:
+            for result, pairs in [(CompareResult.Equal, eq_set), (CompareResult.MaybeEQ, maybe_eq_set)]:
+                for l_dep, r_dep in pairs:
+                    PROFILER.tally(l_dep.dependencyType, r_dep.dependencyType, result.name)
+            for dep in ne_set:
+                types = (dep.dependencyType, None) if dep.dataset == L_TOOL else (None, dep.dependencyType)
+                PROFILER.tally(*types, CompareResult.NotEQ.name)
+        confusion = confusion_rows(handler.confusion)
+        type_metrics = handler.type_metrics
+        with PROFILER.phase('write'):
+            if is_store(OUTPUT):
+                with ResultStore(OUTPUT) as store:
+                    store.write_dependency_results(PROJECTNAME, L_TOOL, R_TOOL, eq_set, ne_set, maybe_eq_set)
+            else:
+                with DocumentWriter(OUTPUT, FORMAT, COMPRESS) as output:
+                    output.section('eq', ((each[0].into_dict(), each[1].into_dict()) for each in eq_set))
+                    if MAYBE:
+                        output.section('maybe_eq', ((each[0].into_dict(), each[1].into_dict()) for each in maybe_eq_set))
+                    output.section('ne', (each.into_dict() for each in ne_set))
+                    output.section('confusion', iter(confusion))
+                    output.section('metrics', iter(type_metrics))
+        summary = {
+            'eq': len(eq_set),
+            **({'maybe_eq': len(maybe_eq_set)} if MAYBE else {}),
+            'left_only': sum(1 for each in ne_set if each.dataset == L_TOOL),
+            'right_only': sum(1 for each in ne_set if each.dataset != L_TOOL),
         }
-        json.dump(result, output, indent=4)
-        # 打印部分数据
-    print({
-        'eq': len(eq_set),
-    })
\ No newline at end of file
+    # 打印部分数据
+    print(summary)
+    for each in type_metrics:
+        print(f"{str(each['dependencyType']):<12}{each['left']:>8}{each['right']:>8}"
+              f"{each['leftMatched']:>8}{each['rightMatched']:>8}  precision {each['precision']}  recall {each['recall']}")
+    if PROFILER.write(profile_path(OUTPUT), 'dependency_diff'):
+        print(f'profile: {profile_path(OUTPUT)}')
@@ -1,7 +1,23 @@
+import bisect
 import difflib
 import json
 import sys
+import tempfile
+import zlib
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
+from operator import attrgetter, itemgetter
+
+from columnar import is_columnar, load_table
+from interval_index import FileIntervals, overlap, same_file, span
+from minhash import MinHashLSH
+from parallel_load import ParallelLoader, available_cpus
+from parse_cache import DEFAULT_LIMIT_MB, ParseCache
+from profiling import Profiler, profile_mode, profile_path
+from record_io import DocumentWriter, iter_section, load_document
+from result_store import ResultStore, is_store
+from spill import SpillFiles, input_batches, partition_count
 
 
 # 数字越大EQ程度越深
@@ -11,7 +27,16 @@ class CompareResult(Enum):
     Equal = 3
 
 
+# 大量实体共享同样的类型名、文件路径和数据集名，驻留后每个字符串只保留一份
+def intern_str(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+# 用__slots__代替实例__dict__，每条记录只占固定的几个槽位
 class Entity:
+    __slots__ = ('entityID', 'entityName', 'entityType', 'entityFile',
+                 'startLine', 'startColumn', 'endLine', 'endColumn', 'dataset', 'features')
+
     def __init__(
         self,
         entityID: int,
@@ -33,6 +58,7 @@ class Entity:
         self.endLine = endLine
         self.endColumn = endColumn
         self.dataset = dataset
+        self.features = None
 
     def into_dict(self):
         return {
@@ -52,17 +78,36 @@ class Entity:
         return Entity(
             source['entityID'],
             source['entityName'],
-            source['entityType'],
-            source['entityFile'],
+            intern_str(source['entityType']),
+            intern_str(source['entityFile']),
             source['startLine'],
             source['startColumn'],
             source['endLine'],
             source['endColumn'],
-            dataset
+            intern_str(dataset)
+        )
+
+    # 直接从列式表的第i行构造，字符串来自表的驻留字典，不经过中间的dict
+    @staticmethod
+    def from_table(table, i: int, dataset=None):
+        columns = table.columns
+        return Entity(
+            columns['entityID'][i],
+            table.pools['names'][columns['entityName'][i]],
+            table.pools['types'][columns['entityType'][i]],
+            table.pools['files'][columns['entityFile'][i]],
+            columns['startLine'][i],
+            columns['startColumn'][i],
+            columns['endLine'][i],
+            columns['endColumn'][i],
+            intern_str(dataset)
         )
 
 
 class Dependency:
+    __slots__ = ('dependencyType', 'dependencySrcID', 'dependencyDestID',
+                 'startLine', 'startColumn', 'endLine', 'endColumn', 'dataset')
+
     def __init__(self, dependencyType, dependencySrcID, dependencyDestID, startLine, startColumn, endLine, endColumn, dataset=None):
         self.dependencyType = dependencyType
         self.dependencySrcID = dependencySrcID
@@ -71,6 +116,7 @@ class Dependency:
         self.startColumn = startColumn
         self.endLine = endLine
         self.endColumn = endColumn
+        self.dataset = dataset
 
     def into_dict(self):
         return {
@@ -87,17 +133,158 @@ class Dependency:
     @staticmethod
     def construct(source, dataset=None):
         return Dependency(
-            source['dependencyType'],
+            intern_str(source['dependencyType']),
             source['dependencySrcID'],
             source['dependencyDestID'],
             source['startLine'],
             source['startColumn'],
             source['endLine'],
             source['endColumn'],
-            dataset
+            intern_str(dataset)
+        )
+
+    @staticmethod
+    def from_table(table, i: int, dataset=None):
+        columns = table.columns
+        return Dependency(
+            table.pools['types'][columns['dependencyType'][i]],
+            columns['dependencySrcID'][i],
+            columns['dependencyDestID'][i],
+            columns['startLine'][i],
+            columns['startColumn'][i],
+            columns['endLine'][i],
+            columns['endColumn'][i],
+            intern_str(dataset)
         )
 
 
+# 读取一侧的实体或依赖，列式文件直接按列构造记录
+def load_set(path: str, compare_type: str, dataset: str, cache: ParseCache = None):
+    record_type = Entity if compare_type == 'entity' else Dependency
+    if is_columnar(path):
+        table = load_table(path)
+    elif cache is not None and cache.enabled:
+        table = cache.load_normalized(path, compare_type)
+    else:
+        return [record_type.construct(each, dataset) for each in iter_section(path, compare_type)]
+    return [record_type.from_table(table, i, dataset) for i in range(len(table))]
+
+
+# 多个输入在各自的子进程里解析成列式表，经共享内存交回后再按行构造记录；只有一个CPU时依次用load_set
+def load_sets(inputs: list, compare_type: str, cache: ParseCache = None):
+    if len(inputs) < 2 or available_cpus() < 2:
+        return [load_set(path, compare_type, dataset, cache) for path, dataset in inputs]
+    record_type = Entity if compare_type == 'entity' else Dependency
+    with ParallelLoader(len(inputs)) as loader:
+        loading = [(loader.table(path, compare_type, cache), dataset) for path, dataset in inputs]
+        tables = [(each.result(), dataset) for each, dataset in loading]
+    return [[record_type.from_table(table, i, dataset) for i in range(len(table))] for table, dataset in tables]
+
+
+# 实体特征：比较时反复用到、只取决于实体本身的值，每个实体只算一次，挂在实体的features上
+# 大写类型在比较开始前的features阶段统一算好，按类型名记忆(类型名是驻留的，种类很少)；
+# 去掉泛型的token、路径token、字符计数和位置范围只有个别比较器用到，第一次用到时再算
+class EntityFeatures:
+    __slots__ = ('upperType', 'genericFreeTokens', 'pathTokens', 'charCounts', 'span')
+
+    def __init__(self, entity):
+        self.upperType = upper_type(entity.entityType)
+        self.genericFreeTokens = None
+        self.pathTokens = None
+        self.charCounts = None
+        self.span = None
+
+
+_UPPER_TYPES = dict()
+
+
+def upper_type(entity_type: str):
+    upper = _UPPER_TYPES.get(entity_type)
+    if upper is None:
+        upper = _UPPER_TYPES[entity_type] = entity_type.upper()
+    return upper
+
+
+def features(entity: Entity):
+    if entity.features is None:
+        entity.features = EntityFeatures(entity)
+    return entity.features
+
+
+def extract_features(entities: list):
+    for entity in entities:
+        if entity.features is None:
+            entity.features = EntityFeatures(entity)
+
+
+def generic_free_key(entity: Entity):
+    entity_features = features(entity)
+    if entity_features.genericFreeTokens is None:
+        entity_features.genericFreeTokens = tuple(generic_free_tokens(entity.entityName))
+    return entity_features.genericFreeTokens
+
+
+def path_tokens(entity: Entity):
+    entity_features = features(entity)
+    if entity_features.pathTokens is None:
+        entity_features.pathTokens = tuple(entity.entityName.replace('\\', '/').split('/'))
+    return entity_features.pathTokens
+
+
+def char_counts(entity: Entity):
+    entity_features = features(entity)
+    if entity_features.charCounts is None:
+        counts = dict()
+        for each in entity.entityName:
+            counts[each] = counts.get(each, 0) + 1
+        entity_features.charCounts = counts
+    return entity_features.charCounts
+
+
+# 实体在文件里的范围(起点, 终点)，没有文件或者行号是-1(Format.Entity的默认值)时为()
+def entity_span(entity: Entity):
+    entity_features = features(entity)
+    if entity_features.span is None:
+        located = entity.entityFile and entity.startLine is not None and entity.startLine >= 0 \
+                  and entity.endLine is not None and entity.endLine >= 0
+        entity_features.span = span(entity.startLine, entity.startColumn, entity.endLine, entity.endColumn) \
+            if located else ()
+    return entity_features.span
+
+
+# 比较器的类型兼容规则：左右实体的大写类型各自归到一组类别(比如Understand的'Public Method'归到Depends的FUNCTION)，
+# 类别有交集的一对才需要比较名字。类别只取决于类型名，两种类型是否兼容只取决于类型对，都按类型记忆
+class TypeClasses:
+    def __init__(self, lhs_classes, rhs_classes):
+        self.lhs_classes = lhs_classes
+        self.rhs_classes = rhs_classes
+        self.lhs_memo = dict()
+        self.rhs_memo = dict()
+        self.pair_memo = dict()
+
+    def lhs(self, entity: Entity):
+        upper = features(entity).upperType
+        classes = self.lhs_memo.get(upper)
+        if classes is None:
+            classes = self.lhs_memo[upper] = tuple(self.lhs_classes(upper))
+        return classes
+
+    def rhs(self, entity: Entity):
+        upper = features(entity).upperType
+        classes = self.rhs_memo.get(upper)
+        if classes is None:
+            classes = self.rhs_memo[upper] = tuple(self.rhs_classes(upper))
+        return classes
+
+    def compatible(self, lhs: Entity, rhs: Entity):
+        key = (features(lhs).upperType, features(rhs).upperType)
+        compatible = self.pair_memo.get(key)
+        if compatible is None:
+            rhs_classes = self.rhs(rhs)
+            compatible = self.pair_memo[key] = any(each in rhs_classes for each in self.lhs(lhs))
+        return compatible
+
+
 # 抽象类：比较器
 # 其实相当于是比较函数，比较返回EQ程度
 # class Comparer:
@@ -105,44 +292,305 @@ class Dependency:
 #         pass
 
 
+# 分块索引：比较器通过lhs_block_keys/rhs_block_keys声明分块键(归一化的类型类别, 名字)
+# 只有分块键相同的实体才可能相等，所以对右集合建哈希索引，左集合逐个去探测即可
+class BlockIndex:
+    def __init__(self, comparer, r_set: list[Entity]):
+        self.comparer = comparer
+        self.blocks = dict()
+        for rhs in r_set:
+            for key in comparer.rhs_block_keys(rhs):
+                self.blocks.setdefault(key, []).append(rhs)
+
+    def candidates(self, lhs: Entity):
+        keys = self.comparer.lhs_block_keys(lhs)
+        if len(keys) == 1:
+            return self.blocks.get(keys[0], [])
+        # 左侧实体可能同时属于多个类别，合并候选时去重
+        candidates = dict()
+        for key in keys:
+            for rhs in self.blocks.get(key, []):
+                candidates[id(rhs)] = rhs
+        return list(candidates.values())
+
+
 # 处理器 集成Comparer和L_SET、R_SET，利用比较器对左右集合进行比较
 class Handler:
-    def __init__(self, comparer, l_set: list[Entity], r_set: list[Entity]):
+    def __init__(self, comparer, l_set: list[Entity], r_set: list[Entity], index=None, profiler: Profiler = None):
         self.comparer = comparer
         self.l_set = l_set
         self.r_set = r_set
+        self.index = index
+        self.profiler = profiler or Profiler(enabled=False)
         pass
 
-    def work(self):
-        contains = set()
-        eq_set = set()
-        maybe_eq_set = set()
-        ne_set = set()
+    # 调用方给了现成的索引就直接用，比较器自己提供索引就用它的，声明了分块键就走哈希索引，否则退回到两两比较
+    def build_index(self):
+        if self.index is not None:
+            return self.index
+        if hasattr(self.comparer, 'build_index'):
+            return self.comparer.build_index(self.r_set)
+        if hasattr(self.comparer, 'lhs_block_keys') and hasattr(self.comparer, 'rhs_block_keys'):
+            return BlockIndex(self.comparer, self.r_set)
+        return None
 
-        for lhs in self.l_set:
-            for rhs in self.r_set:
+    # 用比较器比较l_set中的实体和右集合，返回相等和可能相等的实体对
+    def match(self, l_set: list[Entity], index):
+        eq_pairs = []
+        maybe_eq_pairs = []
+        for lhs in l_set:
+            candidates = self.r_set if index is None else index.candidates(lhs)
+            for rhs in candidates:
                 cmp_result = self.comparer.compare(lhs, rhs)
                 if cmp_result == CompareResult.Equal:
-                    contains.add(lhs)
-                    contains.add(rhs)
-                    eq_set.add((lhs, rhs))
+                    eq_pairs.append((lhs, rhs))
                 elif cmp_result == CompareResult.MaybeEQ:
-                    contains.add(lhs)
-                    contains.add(rhs)
-                    maybe_eq_set.add((lhs, rhs))
+                    maybe_eq_pairs.append((lhs, rhs))
                 elif cmp_result == CompareResult.NotEQ:
                     # do nothing
                     pass
-        for lhs in self.l_set:
-            if lhs not in contains:
-                ne_set.add(lhs)
-        for rhs in self.r_set:
-            if rhs not in contains:
-                ne_set.add(rhs)
+        return eq_pairs, maybe_eq_pairs
+
+    # 按名字哈希把左集合切成分片，放到进程池里比较，子进程只返回实体在集合中的下标
+    def parallel_match(self, jobs: int):
+        shards = [[] for _ in range(jobs * SHARDS_PER_JOB)]
+        for i, lhs in enumerate(self.l_set):
+            shards[zlib.crc32(lhs.entityName.encode('utf-8')) % len(shards)].append((i, lhs))
+        eq_pairs = []
+        maybe_eq_pairs = []
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_shard_worker,
+                                 initargs=(self.comparer, self.r_set)) as executor:
+            for shard_eq, shard_maybe_eq, counts in executor.map(_work_shard, [shard for shard in shards if shard]):
+                eq_pairs.extend((self.l_set[i], self.r_set[j]) for i, j in shard_eq)
+                maybe_eq_pairs.extend((self.l_set[i], self.r_set[j]) for i, j in shard_maybe_eq)
+                # 开启--profile时子进程带回比较计数，合并到主进程的计数里
+                if counts:
+                    self.comparer.merge_counts(counts)
+        return eq_pairs, maybe_eq_pairs
+
+    def work(self, jobs: int = 1):
+        contains = set()
+        eq_set = set()
+        maybe_eq_set = set()
+        ne_set = set()
+
+        with self.profiler.phase('features'):
+            extract_features(self.l_set)
+            extract_features(self.r_set)
+        if jobs > 1:
+            with self.profiler.phase('match'):
+                eq_pairs, maybe_eq_pairs = self.parallel_match(jobs)
+        else:
+            with self.profiler.phase('index'):
+                index = self.build_index()
+            with self.profiler.phase('match'):
+                eq_pairs, maybe_eq_pairs = self.match(self.l_set, index)
+        with self.profiler.phase('collect'):
+            for lhs, rhs in eq_pairs:
+                contains.add(lhs)
+                contains.add(rhs)
+                eq_set.add((lhs, rhs))
+            for lhs, rhs in maybe_eq_pairs:
+                contains.add(lhs)
+                contains.add(rhs)
+                maybe_eq_set.add((lhs, rhs))
+            for lhs in self.l_set:
+                if lhs not in contains:
+                    ne_set.add(lhs)
+            for rhs in self.r_set:
+                if rhs not in contains:
+                    ne_set.add(rhs)
 
         return eq_set, maybe_eq_set, ne_set
 
 
+# 每个进程分到的分片数，分片多一些可以让各进程的负载更均匀
+SHARDS_PER_JOB = 4
+# 子进程内的状态：右集合和索引只在进程启动时构建一次
+_shard_state = dict()
+
+
+def _init_shard_worker(comparer, r_set: list[Entity]):
+    handler = Handler(comparer, [], r_set)
+    _shard_state['handler'] = handler
+    _shard_state['index'] = handler.build_index()
+    _shard_state['position'] = {id(rhs): j for j, rhs in enumerate(r_set)}
+
+
+def _work_shard(shard: list):
+    handler = _shard_state['handler']
+    position = _shard_state['position']
+    l_position = {id(lhs): i for i, lhs in shard}
+    eq_pairs, maybe_eq_pairs = handler.match([lhs for _, lhs in shard], _shard_state['index'])
+    counts = handler.comparer.take_counts() if hasattr(handler.comparer, 'take_counts') else None
+    return [(l_position[id(lhs)], position[id(rhs)]) for lhs, rhs in eq_pairs], \
+           [(l_position[id(lhs)], position[id(rhs)]) for lhs, rhs in maybe_eq_pairs], counts
+
+
+# --memory-budget=MB：实体放不进内存时分区比较。两边的实体按分块键里的名字哈希分到磁盘上的分区文件，
+# 一次只把一对分区读进内存比较；分块键不同的实体不可能相等，所以结果和整体比较相同。
+# 实体有没有匹配上按它在输入里的行号记在标记数组里，全部分区做完以后再顺序读一遍输入，没匹配上的就是ne。
+# 只支持声明了分块键的比较器，按相似度找候选的比较器没法按键分区
+class EntityPartitions:
+    def __init__(self, comparer, inputs: list, partitions: int, directory: str):
+        self.inputs = inputs
+        self.partitions = partitions
+        self.directory = directory
+        self.spills = []
+        self.rows = []
+        # 分块键落在几个分区里的实体，同一对可能在几个分区里都匹配上，写结果时去重
+        self.spread = []
+        self.histogram = dict()
+        for (path, dataset), side, block_keys in zip(inputs, ['left', 'right'],
+                                                     [comparer.lhs_block_keys, comparer.rhs_block_keys]):
+            spill = SpillFiles(directory, side, partitions)
+            spread = set()
+            rows = 0
+            for rows, record in enumerate(iter_section(path, 'entity'), 1):
+                entity = Entity.construct(record, dataset)
+                self.histogram[entity.entityType] = self.histogram.get(entity.entityType, 0) + 1
+                targets = {self.partition(name) for _, name in block_keys(entity)} or {self.partition(entity.entityName)}
+                if len(targets) > 1:
+                    spread.add(rows - 1)
+                for partition in targets:
+                    spill.write(partition, [rows - 1, record])
+            self.spills.append(spill)
+            self.rows.append(rows)
+            self.spread.append(spread)
+        self.matched = [bytearray(rows) for rows in self.rows]
+        self.results = SpillFiles(directory, 'result', 2)
+
+    def partition(self, name: str):
+        return zlib.crc32(name.encode('utf-8')) % self.partitions
+
+    # 一对一对分区在内存里比较，匹配上的对写进结果文件：0是eq，1是maybe_eq
+    def match(self, comparer, jobs: int = 1):
+        seen = set()
+        for partition in range(self.partitions):
+            self.match_partition(comparer, jobs, partition, seen)
+
+    # 单独一个函数，一个分区的实体在读下一个分区之前就释放
+    def match_partition(self, comparer, jobs: int, partition: int, seen: set):
+        sides = []
+        for spill, (_, dataset) in zip(self.spills, self.inputs):
+            table, rows = spill.table(partition, 'entity')
+            entities = [Entity.from_table(table, i, dataset) for i in range(len(table))]
+            sides.append((entities, {id(entity): row for entity, row in zip(entities, rows)}))
+        (l_set, l_rows), (r_set, r_rows) = sides
+        eq_set, maybe_eq_set, _ = Handler(comparer, l_set, r_set).work(jobs)
+        for section, pairs in enumerate([eq_set, maybe_eq_set]):
+            for lhs, rhs in pairs:
+                l_row = l_rows[id(lhs)]
+                r_row = r_rows[id(rhs)]
+                if l_row in self.spread[0] and r_row in self.spread[1]:
+                    if (l_row, r_row) in seen:
+                        continue
+                    seen.add((l_row, r_row))
+                self.matched[0][l_row] = 1
+                self.matched[1][r_row] = 1
+                self.results.write(section, [lhs.into_dict(), rhs.into_dict()])
+
+    def write(self, path: str, fmt: str = None, compression: str = None):
+        counts = {'eq': 0, 'maybe_eq': 0, 'ne': 0}
+
+        def results(section: int, name: str):
+            for pair in self.results.read(section):
+                counts[name] += 1
+                yield tuple(pair)
+
+        def unmatched():
+            for (input_path, dataset), matched in zip(self.inputs, self.matched):
+                for first, table in input_batches(input_path, 'entity'):
+                    for i in range(len(table)):
+                        if not matched[first + i]:
+                            counts['ne'] += 1
+                            yield Entity.from_table(table, i, dataset).into_dict()
+
+        with DocumentWriter(path, fmt, compression) as output:
+            output.section('eq', results(0, 'eq'))
+            output.section('maybe_eq', results(1, 'maybe_eq'))
+            output.section('ne', unmatched())
+        return counts
+
+
+# 实体的稳定键：除ID和数据集以外的全部字段。工具每次重跑ID都可能重新编号(understand的ID还会重复)，
+# 比较器又从不看ID，稳定键相同的两个实体和任何实体的比较结果都一样
+STABLE_FIELDS = ('entityType', 'entityName', 'entityFile', 'startLine', 'startColumn', 'endLine', 'endColumn')
+stable_key = attrgetter(*STABLE_FIELDS)
+# 结果文件里的记录是字典，取出同样顺序的元组
+record_key = itemgetter(*STABLE_FIELDS)
+
+
+# 上一次的实体比较结果文档，逐条产出(结果, 左边的记录, 右边的记录)，ne的记录只有一边。
+# 增量比较本来就在内存里做，整个文档一次读进来比逐个section流式读快得多
+def previous_results(path: str, l_tool: str):
+    document = load_document(path)
+    for result in ['eq', 'maybe_eq']:
+        for lhs, rhs in document.get(result, []):
+            yield result, lhs, rhs
+    for record in document.get('ne', []):
+        yield ('ne', record, None) if record['dataset'] == l_tool else ('ne', None, record)
+
+
+# --previous=上一次的输出：对新快照重跑同一对工具时只比较变化的实体。上一次的结果里有上一个快照的全部实体，
+# 两边的新实体按稳定键分成上一次就有的和新加的：上一次就有的两个实体之间沿用上一次的结果，
+# 新加的左实体和全部右实体比，上一次就有的左实体和新加的右实体比。结果和完整重跑相同，比较次数只和变化的实体数有关
+class IncrementalDiff:
+    def __init__(self, previous: str, l_tool: str):
+        self.known = [set(), set()]
+        # 上一个快照每个稳定键下的实体个数；一个实体可能出现在多个eq对里，按(ID, 稳定键)去重后再数
+        self.counts = [Counter(), Counter()]
+        seen = [set(), set()]
+        self.results = {'eq': set(), 'maybe_eq': set()}
+        for result, lhs, rhs in previous_results(previous, l_tool):
+            keys = tuple(None if record is None else record_key(record) for record in (lhs, rhs))
+            for known, counts, entities, record, key in zip(self.known, self.counts, seen, (lhs, rhs), keys):
+                if key is not None:
+                    known.add(key)
+                    if (record['entityID'], key) not in entities:
+                        entities.add((record['entityID'], key))
+                        counts[key] += 1
+            if result in self.results:
+                self.results[result].add(keys)
+        self.delta = dict()
+
+    def work(self, comparer, l_set: list[Entity], r_set: list[Entity], jobs: int = 1):
+        sides = []
+        for side, known, previous, entities in zip(['left', 'right'], self.known, self.counts, [l_set, r_set]):
+            keys = list(map(stable_key, entities))
+            kept = [entity for entity, key in zip(entities, keys) if key in known]
+            added = [entity for entity, key in zip(entities, keys) if key not in known]
+            by_key = dict()
+            for entity, key in zip(entities, keys):
+                if key in known:
+                    by_key.setdefault(key, []).append(entity)
+            # added和removed都按实体计数，稳定键相同的几个实体各算一个；
+            # 改了位置的实体按(类型, 名字, 文件)算作changed，同时也计在added和removed里
+            current = Counter(keys)
+            added_keys, removed_keys = current - previous, previous - current
+            moved = {key[:3] for key in removed_keys}
+            self.delta[side] = {'added': sum(added_keys.values()), 'removed': sum(removed_keys.values()),
+                                'changed': sum(count for key, count in added_keys.items() if key[:3] in moved)}
+            sides.append((kept, added, by_key))
+        (l_kept, l_added, l_keys), (r_kept, r_added, r_keys) = sides
+
+        pairs = dict()
+        for result, keys in self.results.items():
+            pairs[result] = [(lhs, rhs) for l_key, r_key in keys
+                             for lhs in l_keys.get(l_key, ()) for rhs in r_keys.get(r_key, ())]
+        for lhs_set, rhs_set in [(l_added, r_set), (l_kept, r_added)]:
+            if lhs_set and rhs_set:
+                eq_set, maybe_eq_set, _ = Handler(comparer, lhs_set, rhs_set).work(jobs)
+                pairs['eq'].extend(eq_set)
+                pairs['maybe_eq'].extend(maybe_eq_set)
+
+        contains = set()
+        for each in pairs['eq'] + pairs['maybe_eq']:
+            contains.update(each)
+        ne_set = [entity for entity in l_set + r_set if entity not in contains]
+        return pairs['eq'], pairs['maybe_eq'], ne_set
+
+
 # 解析命令行参数 原封不动的搬过来，虽然知道python有自己的解析库
 def parse_param(label):
     for arg in sys.argv:
@@ -153,11 +601,30 @@ def parse_param(label):
     return None
 
 
+def parse_flag(label):
+    return f'--{label}' in sys.argv
+
+
 # 调用difflib，查看两个字符串的相似度
 def string_equal_rate(str1: str, str2: str):
     return difflib.SequenceMatcher(None, str1, str2).quick_ratio()
 
 
+# 与string_equal_rate的结果完全相同：quick_ratio只看两边字符的多重集交集，两边的字符计数各自预先算好
+def entity_equal_rate(lhs: Entity, rhs: Entity):
+    l_counts = char_counts(lhs)
+    r_counts = char_counts(rhs)
+    if len(l_counts) > len(r_counts):
+        l_counts, r_counts = r_counts, l_counts
+    matches = 0
+    for each, count in l_counts.items():
+        other = r_counts.get(each)
+        if other is not None:
+            matches += count if count < other else other
+    length = len(lhs.entityName) + len(rhs.entityName)
+    return 2.0 * matches / length if length else 1.0
+
+
 # 判断str2是否是str1的子串
 # 如果str2包含多个数据，那么判断str2中是否存在str1的子串
 def string_contains(str1: str, *str2: str):
@@ -171,7 +638,9 @@ def string_contains(str1: str, *str2: str):
 # 非常简易，如果完全相等，就返回相等
 class Code2Graph_Depends_EntityComparer:
     def compare(self, lhs: Entity, rhs: Entity):
-        if lhs.entityType.upper() == 'FILE' and rhs.entityType.upper() == 'FILE':
+        l_type = features(lhs).upperType
+        r_type = features(rhs).upperType
+        if l_type == 'FILE' and r_type == 'FILE':
             # 获取每一级的路径
             sourcetrail_token_vector = [each for each in filter(
                 lambda x: x != '', lhs.entityName.split('.'))].reverse()
@@ -182,107 +651,158 @@ class Code2Graph_Depends_EntityComparer:
                 if i != j:
                     return CompareResult.NotEQ
             return CompareResult.Equal
-        elif lhs.entityType.upper() in ['ENUM', 'CLASS'] and rhs.entityType.upper() == 'TYPE':
+        elif l_type in ['ENUM', 'CLASS'] and r_type == 'TYPE':
             pass
-        elif lhs.entityType.upper() == 'METHOD' and rhs.entityType.upper() == 'FUNCTION':
+        elif l_type == 'METHOD' and r_type == 'FUNCTION':
             pass
-        elif lhs.entityType.upper() == 'VARIABLE' and rhs.entityType.upper() == 'VAR':
+        elif l_type == 'VARIABLE' and r_type == 'VAR':
             pass
         else:
             return CompareResult.NotEQ
 
 
 class Understand_Depends_EntityComparer:
+    def __init__(self):
+        self.types = TypeClasses(self.lhs_type_classes, self.rhs_type_classes)
+
     def compare(self, lhs: Entity, rhs: Entity):
-        if (
-            string_contains(lhs.entityType.upper(), 'PACKAGE')
-                and rhs.entityType.upper() == 'PACKAGE'
-            or string_contains(lhs.entityType.upper(), 'ENUM', 'CLASS')
-                and rhs.entityType.upper() == 'TYPE'
-            or string_contains(lhs.entityType.upper(), 'METHOD')
-                and rhs.entityType.upper() == 'FUNCTION'
-            or string_contains(lhs.entityType.upper(), 'VARIABLE')
-                and rhs.entityType.upper() == 'VAR'
-        ):
-            if lhs.entityName == rhs.entityName:
-                return CompareResult.Equal
-            else:
-                return CompareResult.NotEQ
-        else:
-            return CompareResult.NotEQ
+        if self.types.compatible(lhs, rhs) and lhs.entityName == rhs.entityName:
+            return CompareResult.Equal
+        return CompareResult.NotEQ
+
+    # 左侧类型按包含关系归到Depends的类型上
+    @staticmethod
+    def lhs_type_classes(entity_type: str):
+        classes = []
+        if string_contains(entity_type, 'PACKAGE'):
+            classes.append('PACKAGE')
+        if string_contains(entity_type, 'ENUM', 'CLASS'):
+            classes.append('TYPE')
+        if string_contains(entity_type, 'METHOD'):
+            classes.append('FUNCTION')
+        if string_contains(entity_type, 'VARIABLE'):
+            classes.append('VAR')
+        return classes
+
+    @staticmethod
+    def rhs_type_classes(entity_type: str):
+        return [entity_type] if entity_type in ['PACKAGE', 'TYPE', 'FUNCTION', 'VAR'] else []
+
+    # 分块键：类型类别加名字，只有名字完全相同才可能相等
+    def lhs_block_keys(self, lhs: Entity):
+        return [(each, lhs.entityName) for each in self.types.lhs(lhs)]
+
+    def rhs_block_keys(self, rhs: Entity):
+        return [(each, rhs.entityName) for each in self.types.rhs(rhs)]
 
 
 class ENRE_Depends_EntityComparer:
+    def __init__(self):
+        self.types = TypeClasses(self.lhs_type_classes, self.rhs_type_classes)
+
     def compare(self, lhs: Entity, rhs: Entity):
-        if (
-            lhs.entityType.upper() == 'PACKAGE'
-                and rhs.entityType.upper() == 'PACKAGE'
-            or lhs.entityType.upper() == 'FILE'
-                and rhs.entityType.upper() == 'FILE'
-            or string_contains(lhs.entityType.upper(), 'ANNOTATION')
-                and rhs.entityType.upper() == 'ANNOTATION'
-            or string_contains(lhs.entityType.upper(), 'ENUM', 'CLASS', 'INTERFACE')
-                and rhs.entityType.upper() == 'TYPE'
-            or lhs.entityType.upper() == 'VARIABLE'
-                and rhs.entityType.upper() == 'VAR'
-        ):
-            if lhs.entityName == rhs.entityName:
-                return CompareResult.Equal
-            else:
-                return CompareResult.NotEQ
+        if self.types.compatible(lhs, rhs) and lhs.entityName == rhs.entityName:
+            return CompareResult.Equal
         return CompareResult.NotEQ
 
+    @staticmethod
+    def lhs_type_classes(entity_type: str):
+        classes = []
+        if entity_type in ['PACKAGE', 'FILE']:
+            classes.append(entity_type)
+        if string_contains(entity_type, 'ANNOTATION'):
+            classes.append('ANNOTATION')
+        if string_contains(entity_type, 'ENUM', 'CLASS', 'INTERFACE'):
+            classes.append('TYPE')
+        if entity_type == 'VARIABLE':
+            classes.append('VAR')
+        return classes
+
+    @staticmethod
+    def rhs_type_classes(entity_type: str):
+        return [entity_type] if entity_type in ['PACKAGE', 'FILE', 'ANNOTATION', 'TYPE', 'VAR'] else []
+
+    def lhs_block_keys(self, lhs: Entity):
+        return [(each, lhs.entityName) for each in self.types.lhs(lhs)]
+
+    def rhs_block_keys(self, rhs: Entity):
+        return [(each, rhs.entityName) for each in self.types.rhs(rhs)]
+
 
 class ENRE_Understand_EntityComparer:
+    def __init__(self):
+        self.types = TypeClasses(self.type_classes, self.type_classes)
+
     def compare(self, lhs: Entity, rhs: Entity):
-        if (
-            lhs.entityType.upper().endswith('PACKAGE')
-                and rhs.entityType.upper().endswith('PACKAGE')
-            or lhs.entityType.upper().endswith('METHOD')
-                and rhs.entityType.upper().endswith('METHOD')
-            or lhs.entityType.upper().endswith('VARIABLE')
-                and rhs.entityType.upper().endswith('VARIABLE')
-            or lhs.entityType.upper().endswith('INTERFACE')
-                and rhs.entityType.upper().endswith('INTERFACE')
-            or lhs.entityType.upper().endswith('ENUM')
-                and rhs.entityType.upper().endswith('ENUM')
-            or lhs.entityType.upper().endswith('CLASS')
-                and rhs.entityType.upper().endswith('CLASS')
-        ):
+        if self.types.compatible(lhs, rhs):
             if lhs.entityName == rhs.entityName:
                 print(lhs.entityName)
                 return CompareResult.Equal
             else:
                 return CompareResult.NotEQ
         return CompareResult.NotEQ
+
+    # 两边都按类型后缀归类，后缀互不重叠，所以每个实体最多一个类别
+    @staticmethod
+    def type_classes(entity_type: str):
+        for suffix in ['PACKAGE', 'METHOD', 'VARIABLE', 'INTERFACE', 'ENUM', 'CLASS']:
+            if entity_type.endswith(suffix):
+                return [suffix]
+        return []
+
+    def lhs_block_keys(self, lhs: Entity):
+        return [(each, lhs.entityName) for each in self.types.lhs(lhs)]
+
+    def rhs_block_keys(self, rhs: Entity):
+        return [(each, rhs.entityName) for each in self.types.rhs(rhs)]
 '''
 python differ.py --ltype=enre --lhs=./halo/enre_halo_entity.json --rtype=understand --rhs=./halo/understand_halo_entity.json --compare=entity --output=./enre_understand_entity_output.json
 '''
 
 
+# 状态机：抛弃泛型参数，再按'.'切成关键字数组
+def generic_free_tokens(name: str):
+    state = 'scanning'
+    current = ''
+    for i, each in enumerate(name):
+        if each == '<':
+            state = 'dispose generic'
+        elif each == '>':
+            state = 'scanning'
+        elif state == 'scanning':
+            current += each
+    return [x for x in filter(lambda x: x != '', current.split('.'))]
+
+
+# quick_ratio不会超过 2 * min(len1, len2) / (len1 + len2)，长度差太多的一对不可能大于阈值
+def length_compatible(len1: int, len2: int, threshold: float):
+    return 2 * min(len1, len2) > threshold * (len1 + len2)
+
+
 class Sourcetrail_Depends_EntityComparer:
+    # lsh为True时METHOD的候选由MinHash LSH近似给出，否则比较所有长度可能达到阈值的FUNCTION
+    def __init__(self, lsh: bool = False):
+        self.lsh = lsh
+
     def compare(self, lhs: Entity, rhs: Entity):
-        # token vector是指关键字的数组，用于判断数据是否一致
-        sourcetrail_token_vector = None
-        depends_token_vector = None
+        # token vector是指关键字的数组，用于判断数据是否一致，每个实体的token向量只算一次
+        l_type = features(lhs).upperType
+        r_type = features(rhs).upperType
 
-        if lhs.entityType.upper == 'FILE' and rhs.entityType.upper == 'FILE':
+        if l_type == 'FILE' and r_type == 'FILE':
             # 获取每一级的路径
-            sourcetrail_token_vector = lhs.entityName.replace(
-                '\\', '/').split('/')
-            depends_token_vector = rhs.entityName.replace('\\', '/').split('/')
             # 对比结果 严格对比，有一点不一样就返回NotEQ
-            for i, j in zip(sourcetrail_token_vector, depends_token_vector):
+            for i, j in zip(path_tokens(lhs), path_tokens(rhs)):
                 if i != j:
                     return CompareResult.NotEQ
             return CompareResult.Equal
-        elif lhs.entityType.upper == 'PACKAGE' and rhs.entityType.upper == 'PACKAGE':
+        elif l_type == 'PACKAGE' and r_type == 'PACKAGE':
             if lhs.entityName[1:] == rhs.entityName:
                 return CompareResult.Equal
             else:
                 return CompareResult.NotEQ
-        elif lhs.entityType.upper == 'METHOD' and rhs.entityType.upper == 'FUNCTION':
-            eq_rate = string_equal_rate(lhs.entityName, rhs.entityName)
+        elif l_type == 'METHOD' and r_type == 'FUNCTION':
+            eq_rate = entity_equal_rate(lhs, rhs)
             if eq_rate >= 0.95:
                 return CompareResult.Equal
             elif 0.9 < eq_rate < 0.95:
@@ -290,46 +810,184 @@ class Sourcetrail_Depends_EntityComparer:
             else:
                 return CompareResult.NotEQ
             # return CompareResult.NotEQ
-        elif (
-            lhs.entityType.upper in ['INTERFACE', 'CLASS',
-                                     'PUBLIC CLASS', 'ENUM', 'ANNOTATION']
-            and rhs.entityType.upper == 'TYPE'
-        ):
-            sourcetrail_token_vector = []
-            depends_token_vector = []
-            # 状态机：抛弃泛型参数
-            state = 'scanning'
-            current = ''
-            for i, each in enumerate(lhs.entityName):
-                if each == '<':
-                    state = 'dispose generic'
-                elif each == '>':
-                    state = 'scanning'
-                elif state == 'scanning':
-                    current += each
-            sourcetrail_token_vector = [x for x in filter(
-                lambda x: x != '', current.split('.'))]
-            # 状态机：抛弃泛型参数
-            state = 'scanning'
-            current = ''
-            for i, each in enumerate(rhs.entityName):
-                if each == '<':
-                    state = 'dispose generic'
-                elif each == '>':
-                    state = 'scanning'
-                elif state == 'scanning':
-                    current += each
-            depends_token_vector = [x for x in filter(
-                lambda x: x != '', current.split('.'))]
-            # print(f'l: {sourcetrail_token_vector}, r: {depends_token_vector}')
-            if len(sourcetrail_token_vector) != len(depends_token_vector):
-                return CompareResult.NotEQ
-            for i, j in zip(sourcetrail_token_vector, depends_token_vector):
-                if i != j:
-                    return CompareResult.NotEQ
-            return CompareResult.Equal
+        elif l_type in ['INTERFACE', 'CLASS', 'PUBLIC CLASS', 'ENUM', 'ANNOTATION'] and r_type == 'TYPE':
+            # 去掉泛型后的token向量长度和每一项都相同才相等
+            if generic_free_key(lhs) == generic_free_key(rhs):
+                return CompareResult.Equal
+            return CompareResult.NotEQ
+        else:
+            return CompareResult.NotEQ
+
+    def build_index(self, r_set: list[Entity]):
+        return Sourcetrail_Depends_Index(r_set, self.lsh)
+
+
+# Sourcetrail和Depends的候选索引：包和类型按名字分块，文件按前缀比较所以只按类型分桶，
+# 方法先按长度筛掉不可能超过0.9的函数，开启lsh时再用MinHash LSH缩小候选
+class Sourcetrail_Depends_Index:
+    def __init__(self, r_set: list[Entity], lsh: bool = False):
+        self.blocks = dict()
+        self.files = []
+        functions = []
+        for rhs in r_set:
+            entity_type = features(rhs).upperType
+            if entity_type == 'FILE':
+                self.files.append(rhs)
+            elif entity_type == 'PACKAGE':
+                self.blocks.setdefault(('PACKAGE', rhs.entityName), []).append(rhs)
+            elif entity_type == 'TYPE':
+                self.blocks.setdefault(('TYPE', generic_free_key(rhs)), []).append(rhs)
+            elif entity_type == 'FUNCTION':
+                functions.append(rhs)
+        functions.sort(key=lambda x: len(x.entityName))
+        self.functions = functions
+        self.function_lengths = [len(x.entityName) for x in functions]
+        self.function_lsh = None
+        if lsh:
+            self.function_lsh = MinHashLSH()
+            for rhs in functions:
+                self.function_lsh.add(rhs.entityName, rhs)
+
+    def method_candidates(self, name: str):
+        length = len(name)
+        if self.function_lsh is not None:
+            candidates = self.function_lsh.query(name)
         else:
+            # 长度只可能落在 (0.9 / 1.1 * length, 1.1 / 0.9 * length) 之间，多取一点再精确判断
+            lo = bisect.bisect_left(self.function_lengths, length * 9 // 11)
+            hi = bisect.bisect_right(self.function_lengths, length * 11 // 9 + 1)
+            candidates = self.functions[lo:hi]
+        return [rhs for rhs in candidates if length_compatible(length, len(rhs.entityName), 0.9)]
+
+    def candidates(self, lhs: Entity):
+        entity_type = features(lhs).upperType
+        if entity_type == 'FILE':
+            return self.files
+        elif entity_type == 'PACKAGE':
+            return self.blocks.get(('PACKAGE', lhs.entityName[1:]), [])
+        elif entity_type == 'METHOD':
+            return self.method_candidates(lhs.entityName)
+        elif entity_type in ['INTERFACE', 'CLASS', 'PUBLIC CLASS', 'ENUM', 'ANNOTATION']:
+            return self.blocks.get(('TYPE', generic_free_key(lhs)), [])
+        return []
+
+
+# 用暴力比较的结果评估LSH在METHOD和FUNCTION之间的召回率
+def lsh_recall(l_set: list[Entity], r_set: list[Entity]):
+    comparer = Sourcetrail_Depends_EntityComparer()
+    exact = Sourcetrail_Depends_Index(r_set)
+    approximate = Sourcetrail_Depends_Index(r_set, lsh=True)
+    methods = [lhs for lhs in l_set if features(lhs).upperType == 'METHOD']
+    expected = 0
+    found = 0
+    candidates = 0
+    for lhs in methods:
+        matched = {id(rhs) for rhs in exact.method_candidates(lhs.entityName)
+                   if comparer.compare(lhs, rhs) != CompareResult.NotEQ}
+        approximate_candidates = approximate.method_candidates(lhs.entityName)
+        candidates += len(approximate_candidates)
+        expected += len(matched)
+        found += len(matched & {id(rhs) for rhs in approximate_candidates})
+    return {
+        'methods': len(methods),
+        'functions': len(exact.functions),
+        'avg_candidates': candidates / len(methods) if methods else 0,
+        'pairs': expected,
+        'found': found,
+        'recall': found / expected if expected else 1.0,
+    }
+
+
+# 按位置匹配：两边的实体都带着文件和行列范围时，在对方同一文件里找范围重叠、类型兼容的实体，
+# 改过名或者限定名写法不同也能对上；有一边没有位置时交给原来的比较器按名字比较
+class Location_EntityComparer:
+    def __init__(self, comparer):
+        self.comparer = comparer
+        self.intervals = None
+
+    # 左侧的文件在右侧找不到时和没有位置一样，按原比较器比较名字，与Location_Index找候选的规则一致
+    def compare(self, lhs: Entity, rhs: Entity):
+        l_span = entity_span(lhs)
+        r_span = entity_span(rhs)
+        if l_span and r_span and self.located(lhs):
+            if self.compatible(lhs, rhs) and overlap(l_span, r_span) > 0 and self.same_file(lhs, rhs):
+                return CompareResult.Equal
             return CompareResult.NotEQ
+        return self.comparer.compare(lhs, rhs)
+
+    # 没建索引时不知道右侧有哪些文件，只要两边都有位置就按位置比较
+    def located(self, lhs: Entity):
+        return self.intervals is None or self.intervals.file(lhs.entityFile) is not None
+
+    # 建过索引以后按索引对齐路径的结果判断(两边的根目录可以完全不同)，否则要求一边是另一边的后缀
+    def same_file(self, lhs: Entity, rhs: Entity):
+        if self.intervals is not None:
+            return self.intervals.file(lhs.entityFile) is self.intervals.file(rhs.entityFile)
+        return same_file(lhs.entityFile, rhs.entityFile)
+
+    # 原比较器声明了类型类别就按类别判断，否则要求大写类型相同
+    def compatible(self, lhs: Entity, rhs: Entity):
+        types = getattr(self.comparer, 'types', None)
+        if types is not None:
+            return types.compatible(lhs, rhs)
+        return features(lhs).upperType == features(rhs).upperType
+
+    def build_index(self, r_set: list[Entity]):
+        index = Location_Index(self, r_set)
+        self.intervals = index.intervals
+        return index
+
+
+# 右集合里有位置的实体按文件建范围索引，左侧有位置的实体只取重叠最多(交集/并集最大)的类型兼容实体作候选，
+# 再加上右侧没有位置、要按名字比较的实体；左侧没有位置或者文件对不上时用原比较器的索引
+class Location_Index:
+    def __init__(self, comparer: Location_EntityComparer, r_set: list[Entity]):
+        self.comparer = comparer
+        self.intervals = FileIntervals([(rhs.entityFile,) + entity_span(rhs) + (rhs,)
+                                        for rhs in r_set if entity_span(rhs)])
+        self.r_set = r_set
+        self.fallback = Handler(comparer.comparer, [], r_set).build_index()
+
+    def name_candidates(self, lhs: Entity):
+        return self.r_set if self.fallback is None else self.fallback.candidates(lhs)
+
+    def candidates(self, lhs: Entity):
+        l_span = entity_span(lhs)
+        intervals = self.intervals.file(lhs.entityFile) if l_span else None
+        if intervals is None:
+            return self.name_candidates(lhs)
+        best = []
+        best_overlap = 0.0
+        for _, rhs in intervals.overlapping(*l_span):
+            if not self.comparer.compatible(lhs, rhs):
+                continue
+            rate = overlap(l_span, entity_span(rhs))
+            if rate > best_overlap:
+                best, best_overlap = [rhs], rate
+            elif rate == best_overlap:
+                best.append(rhs)
+        return best + [rhs for rhs in self.name_candidates(lhs) if not entity_span(rhs)]
+
+
+# 比较器注册表：(左工具, 右工具) -> 比较器类，N路比较需要按工具对查找比较器
+COMPARERS = {
+    ('code2graph', 'depends'): Code2Graph_Depends_EntityComparer,
+    ('sourcetrail', 'depends'): Sourcetrail_Depends_EntityComparer,
+    ('understand', 'depends'): Understand_Depends_EntityComparer,
+    ('enre', 'depends'): ENRE_Depends_EntityComparer,
+    ('enre', 'understand'): ENRE_Understand_EntityComparer,
+}
+
+
+def get_comparer(l_type: str, r_type: str, compare_type: str = 'entity', lsh: bool = False, location: bool = False):
+    comparer_type = COMPARERS.get((l_type, r_type)) if compare_type == 'entity' else None
+    if comparer_type is None:
+        return None
+    if comparer_type is Sourcetrail_Depends_EntityComparer:
+        comparer = comparer_type(lsh=lsh)
+    else:
+        comparer = comparer_type()
+    return Location_EntityComparer(comparer) if location else comparer
 
 
 class Dependency_EntityComparer:
@@ -344,65 +1002,97 @@ def main():
     R_TYPE = parse_param('rtype')
     COMPARE_TYPE = parse_param('compare')
     OUTPUT_FILE = parse_param('output')
+    JOBS = int(parse_param('jobs') or 1)
+    # 输出是.db时写进结果库，结果按项目区分
+    STORE = is_store(OUTPUT_FILE)
+    PROJECT = parse_param('project')
+    if STORE and PROJECT is None:
+        sys.exit('--project= is required when --output is a result store')
+    CACHE = ParseCache(parse_param('cache-dir'), int(parse_param('cache-limit') or DEFAULT_LIMIT_MB),
+                       not parse_flag('no-cache'))
+    if parse_flag('clear-cache'):
+        CACHE.clear()
+    PROFILER = profile_mode(parse_param('profile') or parse_flag('profile'))
 
     # 为生成handler做准备
-    comparer = None
-    # 为每种情况做一个处理，当然解耦合的情况就是搞一个对象映射，启动的时候对这个映射进行注册
-    # 然后用依赖注入来做，但是这里具体的需求不需要解耦合
-    if L_TYPE == 'code2graph' and R_TYPE == 'depends' and COMPARE_TYPE == 'entity':
-        comparer = Code2Graph_Depends_EntityComparer()
-    elif L_TYPE == 'sourcetrail' and R_TYPE == 'depends' and COMPARE_TYPE == 'entity':
-        comparer = Sourcetrail_Depends_EntityComparer()
-    elif L_TYPE == 'understand' and R_TYPE == 'depends' and COMPARE_TYPE == 'entity':
-        comparer = Understand_Depends_EntityComparer()
-    elif L_TYPE == 'enre' and R_TYPE == 'depends' and COMPARE_TYPE == 'entity':
-        comparer = ENRE_Depends_EntityComparer()
-    elif L_TYPE == 'enre' and R_TYPE == 'understand' and COMPARE_TYPE == 'entity':
-        comparer = ENRE_Understand_EntityComparer()
+    comparer = get_comparer(L_TYPE, R_TYPE, COMPARE_TYPE, lsh=parse_flag('lsh'), location=parse_flag('location'))
+
+    MEMORY_BUDGET = parse_param('memory-budget')
+    PARTITIONS = partition_count([L_INPUT, R_INPUT], int(MEMORY_BUDGET)) \
+        if MEMORY_BUDGET and COMPARE_TYPE == 'entity' else 1
+    PREVIOUS = parse_param('previous')
+    if PREVIOUS:
+        if COMPARE_TYPE != 'entity' or PARTITIONS > 1:
+            sys.exit('--previous= updates an in-memory entity diff, it cannot be combined with --memory-budget=')
+        # 按重叠程度取最好的候选，一个实体的结果取决于其它实体，没法只比较变化的部分
+        if isinstance(comparer, Location_EntityComparer):
+            sys.exit('--previous= cannot be combined with --location')
+        # 结果库按(工具, ID)存实体，ID重复的实体(understand)只剩一条，分不清上一次的结果属于哪个实体
+        if is_store(PREVIOUS):
+            sys.exit('--previous= reads a result document, not a result store')
+    if PARTITIONS > 1:
+        if STORE:
+            sys.exit('--memory-budget= writes a result document, not a result store')
+        if comparer is None or hasattr(comparer, 'build_index') or not hasattr(comparer, 'lhs_block_keys'):
+            sys.exit(f'--memory-budget= needs a comparer with block keys, {L_TYPE} vs {R_TYPE} has none')
+        with tempfile.TemporaryDirectory(prefix='differ-', dir=parse_param('spill-dir')) as directory:
+            with PROFILER.phase('partition'):
+                partitions = EntityPartitions(comparer, [(L_INPUT, L_TYPE), (R_INPUT, R_TYPE)], PARTITIONS, directory)
+            print(f'partitions: {PARTITIONS}')
+            print(f'map: {partitions.histogram}')
+            with PROFILER.phase('match'):
+                partitions.match(PROFILER.counting(comparer), JOBS)
+            with PROFILER.phase('write'):
+                counts = partitions.write(OUTPUT_FILE, parse_param('format'), parse_param('compress'))
+        if PROFILER.write(profile_path(OUTPUT_FILE), 'differ'):
+            print(f'profile: {profile_path(OUTPUT_FILE)}')
+        print(counts)
+        return
 
     lset = []
     rset = []
-    with open(L_INPUT) as f:
-        input = json.load(f)
-        if COMPARE_TYPE == 'dependency':
-            lset = [Dependency.construct(each, L_TYPE)
-                    for each in input[COMPARE_TYPE]]
-        elif COMPARE_TYPE == 'entity':
-            lset = [Entity.construct(each, L_TYPE)
-                    for each in input[COMPARE_TYPE]]
-    with open(R_INPUT) as f:
-        input = json.load(f)
-        if COMPARE_TYPE == 'dependency':
-            rset = [Dependency.construct(each, R_TYPE)
-                    for each in input[COMPARE_TYPE]]
-        elif COMPARE_TYPE == 'entity':
-            rset = [Entity.construct(each, R_TYPE)
-                    for each in input[COMPARE_TYPE]]
-
-    map = dict()
-    for i in lset:
-        if i.entityType in map:
-            map[i.entityType] = map[i.entityType] + 1
-        else:
-            map[i.entityType] = 1
-    for i in rset:
-        if i.entityType in map:
-            map[i.entityType] = map[i.entityType] + 1
-        else:
-            map[i.entityType] = 1
+    if COMPARE_TYPE in ['entity', 'dependency']:
+        with PROFILER.phase('load'):
+            lset, rset = load_sets([(L_INPUT, L_TYPE), (R_INPUT, R_TYPE)], COMPARE_TYPE, CACHE)
+
+    with PROFILER.phase('histogram'):
+        map = dict()
+        for i in lset:
+            if i.entityType in map:
+                map[i.entityType] = map[i.entityType] + 1
+            else:
+                map[i.entityType] = 1
+        for i in rset:
+            if i.entityType in map:
+                map[i.entityType] = map[i.entityType] + 1
+            else:
+                map[i.entityType] = 1
     print(f'map: {map}')
-    # 生成Handler对象
-    handler = Handler(comparer, lset, rset)
-    # 获得结果
-    eq_set, maybe_eq_set, ne_set = handler.work()
+    if parse_flag('lsh-recall') and isinstance(comparer, Sourcetrail_Depends_EntityComparer):
+        print(f'lsh recall: {lsh_recall(lset, rset)}')
+    if PREVIOUS:
+        with PROFILER.phase('previous'):
+            incremental = IncrementalDiff(PREVIOUS, L_TYPE)
+        with PROFILER.phase('match'):
+            eq_set, maybe_eq_set, ne_set = incremental.work(PROFILER.counting(comparer), lset, rset, JOBS)
+        print(f'delta: {incremental.delta}')
+    else:
+        # 生成Handler对象，开启--profile时比较器换成计数代理
+        handler = Handler(PROFILER.counting(comparer), lset, rset, profiler=PROFILER)
+        # 获得结果
+        eq_set, maybe_eq_set, ne_set = handler.work(JOBS)
     # 输出结果
-    with open(OUTPUT_FILE, 'w') as output:
-        result = {
-            'eq': [(each[0].into_dict(), each[1].into_dict()) for each in eq_set],
-            'maybe_eq': [(each[0].into_dict(), each[1].into_dict()) for each in maybe_eq_set],
-            'ne': [each.into_dict() for each in ne_set],
-        }
-        json.dump(result, output, indent=4)
+    with PROFILER.phase('write'):
+        if STORE:
+            with ResultStore(OUTPUT_FILE) as store:
+                store.write_entity_results(PROJECT, L_TYPE, R_TYPE, eq_set, maybe_eq_set, ne_set)
+        else:
+            with DocumentWriter(OUTPUT_FILE, parse_param('format'), parse_param('compress')) as output:
+                output.section('eq', ((each[0].into_dict(), each[1].into_dict()) for each in eq_set))
+                output.section('maybe_eq', ((each[0].into_dict(), each[1].into_dict()) for each in maybe_eq_set))
+                output.section('ne', (each.into_dict() for each in ne_set))
+    if PROFILER.write(profile_path(OUTPUT_FILE), 'differ'):
+        print(f'profile: {profile_path(OUTPUT_FILE)}')
     # 打印部分数据
     print({
         'eq': len(eq_set),
@@ -0,0 +1,113 @@
+import bisect
+import posixpath
+
+
+# 行列位置编码成一个整数：行号乘一个足够大的宽度再加列号，跨行的范围也能直接比较先后和算重叠
+LINE_WIDTH = 1 << 20
+
+
+# 列是-1时起点取行首，终点取行尾
+def span(start_line: int, start_column: int, end_line: int, end_column: int):
+    return start_line * LINE_WIDTH + max(start_column, 0), \
+           end_line * LINE_WIDTH + (end_column if end_column >= 0 else LINE_WIDTH - 1)
+
+
+# 两个范围的重叠程度：交集长度 / 并集长度，不重叠为0
+def overlap(lhs: tuple, rhs: tuple):
+    common = min(lhs[1], rhs[1]) - max(lhs[0], rhs[0]) + 1
+    if common <= 0:
+        return 0.0
+    return common / (max(lhs[1], rhs[1]) - min(lhs[0], rhs[0]) + 1)
+
+
+_NORMALIZED_PATHS = dict()
+
+
+# 文件路径归一化：统一成'/'分隔，去掉盘符、'.'和'..'；实体共享驻留的路径字符串，按原字符串记忆
+def normalized_path(path: str):
+    normalized = _NORMALIZED_PATHS.get(path)
+    if normalized is None:
+        normalized = path.replace('\\', '/')
+        if len(normalized) > 1 and normalized[1] == ':':
+            normalized = normalized[2:]
+        normalized = _NORMALIZED_PATHS[path] = posixpath.normpath(normalized).lstrip('/')
+    return normalized
+
+
+# 各工具的根目录可能不同，一边是另一边按'/'对齐的后缀就算同一个文件
+def same_file(lhs: str, rhs: str):
+    lhs = normalized_path(lhs)
+    rhs = normalized_path(rhs)
+    return lhs == rhs or lhs.endswith('/' + rhs) or rhs.endswith('/' + lhs)
+
+
+# 一个文件里的范围，按起点排序；在起点数组上建一棵隐式线段树，节点存子树里最大的终点，
+# 找和[start, end]重叠的范围时只看起点不超过end的前缀，并且只下探最大终点不小于start的子树，O(log n + k)
+class IntervalIndex:
+    def __init__(self, intervals: list):
+        intervals.sort(key=lambda each: (each[0], each[1]))
+        self.starts = [start for start, _, _ in intervals]
+        self.ends = [end for _, end, _ in intervals]
+        self.items = [item for _, _, item in intervals]
+        size = 1
+        while size < len(intervals):
+            size *= 2
+        self.size = size
+        self.max_ends = [-1] * (2 * size)
+        self.max_ends[size:size + len(intervals)] = self.ends
+        for node in range(size - 1, 0, -1):
+            self.max_ends[node] = max(self.max_ends[2 * node], self.max_ends[2 * node + 1])
+
+    def __len__(self):
+        return len(self.items)
+
+    # 和[start, end]重叠的(下标, 条目)，按起点排序
+    def overlapping(self, start: int, end: int):
+        limit = bisect.bisect_right(self.starts, end)
+        found = []
+        stack = [(1, 0, self.size)]
+        while stack:
+            node, low, width = stack.pop()
+            if low >= limit or self.max_ends[node] < start:
+                continue
+            if node >= self.size:
+                found.append(node - self.size)
+            else:
+                width //= 2
+                stack.append((2 * node + 1, low + width, width))
+                stack.append((2 * node, low, width))
+        return [(i, self.items[i]) for i in found]
+
+
+# 按文件分开的范围索引。对方的路径先精确查找，找不到时取最长的、只属于一个文件的路径后缀
+class FileIntervals:
+    def __init__(self, located: list):
+        files = dict()
+        for path, start, end, item in located:
+            files.setdefault(normalized_path(path), []).append((start, end, item))
+        self.files = {path: IntervalIndex(intervals) for path, intervals in files.items()}
+        # 路径后缀 -> 文件，几个文件共有的后缀记为None
+        self.suffixes = dict()
+        for path in self.files:
+            tokens = path.split('/')
+            for i in range(len(tokens)):
+                suffix = '/'.join(tokens[i:])
+                self.suffixes[suffix] = path if self.suffixes.get(suffix, path) == path else None
+        self.resolved = dict()
+
+    def file(self, path: str):
+        if path not in self.resolved:
+            self.resolved[path] = self.resolve(normalized_path(path))
+        return self.resolved[path]
+
+    def resolve(self, path: str):
+        if path in self.files:
+            return self.files[path]
+        tokens = path.split('/')
+        for i in range(len(tokens)):
+            suffix = '/'.join(tokens[i:])
+            if suffix in self.suffixes:
+                match = self.suffixes[suffix]
+                # 更长的后缀已经有歧义，更短的只会更多
+                return self.files[match] if match is not None else None
+        return None
@@ -0,0 +1,57 @@
+import zlib
+import random
+
+
+# 梅森素数，MinHash的随机排列取 (a * x + b) mod PRIME
+PRIME = (1 << 61) - 1
+
+
+# 字符n-gram集合，名字比n还短时把整个名字当成一个gram
+def shingles(text: str, n: int):
+    if len(text) <= n:
+        return {text}
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+# MinHash + LSH分带索引：签名切成bands段，每段rows个值，任意一段完全相同就成为候选
+# 两个集合Jaccard相似度为s时，成为候选的概率是 1 - (1 - s^rows)^bands
+class MinHashLSH:
+    def __init__(self, ngram: int = 3, bands: int = 16, rows: int = 4, seed: int = 1):
+        self.ngram = ngram
+        self.bands = bands
+        self.rows = rows
+        generator = random.Random(seed)
+        self.permutations = [(generator.randrange(1, PRIME), generator.randrange(0, PRIME))
+                             for _ in range(bands * rows)]
+        self.buckets = [dict() for _ in range(bands)]
+        self.items = []
+        self.permuted = dict()
+
+    # 一个gram在所有排列下的值只算一次：名字之间共用大部分gram(包名、类名)，逐个名字重算排列是主要开销
+    def gram_hashes(self, gram: str):
+        hashes = self.permuted.get(gram)
+        if hashes is None:
+            h = zlib.crc32(gram.encode('utf-8'))
+            hashes = self.permuted[gram] = tuple([(a * h + b) % PRIME for a, b in self.permutations])
+        return hashes
+
+    # 签名的每一位是各gram在这个排列下的最小值，按列取min
+    def signature(self, text: str):
+        return list(map(min, zip(*map(self.gram_hashes, shingles(text, self.ngram)))))
+
+    def band_keys(self, text: str):
+        signature = self.signature(text)
+        return [tuple(signature[i * self.rows:(i + 1) * self.rows]) for i in range(self.bands)]
+
+    def add(self, text: str, item):
+        position = len(self.items)
+        self.items.append(item)
+        for band, key in zip(self.buckets, self.band_keys(text)):
+            band.setdefault(key, []).append(position)
+
+    # 返回与text可能相似的条目，按加入索引的顺序排列
+    def query(self, text: str):
+        positions = set()
+        for band, key in zip(self.buckets, self.band_keys(text)):
+            positions.update(band.get(key, ()))
+        return [self.items[i] for i in sorted(positions)]
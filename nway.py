@@ -0,0 +1,173 @@
+import argparse
+import itertools
+
+import dependency_diff
+from differ import COMPARERS, Entity, Handler, get_comparer
+from parallel_load import ParallelLoader
+from parse_cache import add_cache_arguments, cache_from_args
+from record_io import COMPRESSIONS, FORMATS, DocumentWriter, output_path
+
+
+TOOLS = ['code2graph', 'sourcetrail', 'understand', 'enre', 'depends']
+
+
+def parse_tool_paths(parser, values):
+    paths = dict()
+    for value in values or []:
+        tool, _, path = value.partition('=')
+        if tool not in TOOLS or not path:
+            parser.error(f'expected TOOL=PATH with TOOL in {TOOLS}, got {value!r}')
+        paths[tool] = path
+    return paths
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-e", "--entity", type=str, action="append", required=True,
+                        help="normalized entity file of one tool as TOOL=PATH, repeat for every tool")
+    parser.add_argument("-d", "--dependency", type=str, action="append",
+                        help="normalized dependency file of one tool as TOOL=PATH, pairs with both files also get a dependency diff")
+    parser.add_argument("-p", "--projectname", type=str, required=True, help="please input the project name")
+    parser.add_argument("-o", "--output", type=str, required=True, help="please input the output directory")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="worker processes for each entity comparison")
+    parser.add_argument("--lsh", action="store_true", help="use MinHash LSH candidates for sourcetrail vs depends")
+    parser.add_argument("-t", "--typed", action="store_true",
+                        help="only match edges whose normalized dependency types agree")
+    parser.add_argument("-f", "--format", type=str, default="json", choices=FORMATS, help="output record format")
+    parser.add_argument("-z", "--compress", type=str, default="none", choices=COMPRESSIONS,
+                        help="compress the output files")
+    add_cache_arguments(parser)
+    args = parser.parse_args()
+    return parse_tool_paths(parser, args.entity), parse_tool_paths(parser, args.dependency), args.projectname, args.output, \
+           args.jobs, args.lsh, args.typed, args.format, args.compress, cache_from_args(args)
+
+
+# 每个工具一份名字索引，以它为右侧的所有比较共用，不再为每一对工具各建一次
+class NameIndex:
+    def __init__(self, entities: list):
+        self.names = dict()
+        for entity in entities:
+            self.names.setdefault(entity.entityName, []).append(entity)
+
+    def get(self, name: str):
+        return self.names.get(name, [])
+
+
+# 把共享的名字索引当作某个比较器的分块索引用：分块键的第二项是实体名，
+# 先按名字取出右侧实体，再只保留分块键也相同的，结果与differ.BlockIndex一致
+class SharedBlockIndex:
+    def __init__(self, comparer, names: NameIndex):
+        self.comparer = comparer
+        self.names = names
+
+    def candidates(self, lhs):
+        candidates = dict()
+        for key in self.comparer.lhs_block_keys(lhs):
+            for rhs in self.names.get(key[1]):
+                if key in self.comparer.rhs_block_keys(rhs):
+                    candidates[id(rhs)] = rhs
+        return list(candidates.values())
+
+
+def shared_index(comparer, names: NameIndex):
+    if hasattr(comparer, 'build_index'):
+        return None
+    if hasattr(comparer, 'lhs_block_keys') and hasattr(comparer, 'rhs_block_keys'):
+        return SharedBlockIndex(comparer, names)
+    return None
+
+
+# 并查集：把所有工具对的相等结果连起来，一个连通块就是各工具眼中的同一个实体
+class UnionFind:
+    def __init__(self):
+        self.parent = dict()
+
+    def find(self, item):
+        self.parent.setdefault(item, item)
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, a, b):
+        self.parent[self.find(a)] = self.find(b)
+
+
+# 一致性表：每个跨工具的连通块一行，列出每个工具里对应的实体ID；
+# summary按工具组合统计实体数，没有和任何工具对上的实体算作只有自己一个工具
+def agreement(entity_sets: dict, eq_results: dict):
+    groups = UnionFind()
+    for tool, entities in entity_sets.items():
+        for entity in entities:
+            groups.find((tool, entity.entityID))
+    for eq_set in eq_results.values():
+        for lhs, rhs in eq_set:
+            groups.union((lhs.dataset, lhs.entityID), (rhs.dataset, rhs.entityID))
+    components = dict()
+    for tool, entity_id in list(groups.parent):
+        components.setdefault(groups.find((tool, entity_id)), dict()).setdefault(tool, set()).add(entity_id)
+    rows = []
+    summary = dict()
+    for members in components.values():
+        tools = [tool for tool in entity_sets if tool in members]
+        combination = '+'.join(tools)
+        summary[combination] = summary.get(combination, 0) + 1
+        if len(tools) > 1:
+            row = {tool: sorted(members.get(tool, ())) for tool in entity_sets}
+            row['tools'] = len(tools)
+            rows.append(row)
+    rows.sort(key=lambda row: -row['tools'])
+    return rows, dict(sorted(summary.items(), key=lambda item: (-item[0].count('+'), item[0])))
+
+
+if __name__ == "__main__":
+    ENTITIES, DEPENDENCIES, PROJECTNAME, OUTPUT, JOBS, LSH, TYPED, FORMAT, COMPRESS, CACHE = parse_args()
+    # 每个工具的实体和依赖只读一次，所有文件同时在子进程里解析
+    with ParallelLoader(len(ENTITIES) + len(DEPENDENCIES)) as loader:
+        entity_loading = {tool: loader.table(ENTITIES[tool], 'entity', CACHE) for tool in TOOLS if tool in ENTITIES}
+        dependency_loading = {tool: loader.table(DEPENDENCIES[tool], 'dependency', CACHE)
+                              for tool in TOOLS if tool in DEPENDENCIES}
+        entity_tables = {tool: each.result() for tool, each in entity_loading.items()}
+        dependency_tables = {tool: each.result() for tool, each in dependency_loading.items()}
+    entity_sets = {tool: [Entity.from_table(table, i, tool) for i in range(len(table))]
+                   for tool, table in entity_tables.items()}
+    name_indexes = {tool: NameIndex(entities) for tool, entities in entity_sets.items()}
+
+    eq_results = dict()
+    for l_tool, r_tool in itertools.permutations(entity_sets, 2):
+        if (l_tool, r_tool) not in COMPARERS:
+            continue
+        comparer = get_comparer(l_tool, r_tool, lsh=LSH)
+        handler = Handler(comparer, entity_sets[l_tool], entity_sets[r_tool],
+                          shared_index(comparer, name_indexes[r_tool]))
+        eq_set, maybe_eq_set, ne_set = handler.work(JOBS)
+        eq_results[(l_tool, r_tool)] = eq_set
+        with DocumentWriter(output_path(f'{OUTPUT}/{l_tool}_{r_tool}_entity_output.json', FORMAT, COMPRESS),
+                            FORMAT, COMPRESS) as output:
+            output.section('eq', ((each[0].into_dict(), each[1].into_dict()) for each in eq_set))
+            output.section('maybe_eq', ((each[0].into_dict(), each[1].into_dict()) for each in maybe_eq_set))
+            output.section('ne', (each.into_dict() for each in ne_set))
+        result = {'eq': len(eq_set), 'maybe_eq': len(maybe_eq_set), 'ne': len(ne_set)}
+
+        if l_tool in dependency_tables and r_tool in dependency_tables:
+            eq_info = dependency_diff.EquivalenceMap((lhs.entityID, rhs.entityID, 0) for lhs, rhs in eq_set)
+            dependency_handler = dependency_diff.Handler(dependency_diff.Dependency_Comparer(),
+                                                         dependency_tables[l_tool], dependency_tables[r_tool],
+                                                         eq_info, l_tool, r_tool, TYPED)
+            dependency_eq_set, _ = dependency_handler.work()
+            with DocumentWriter(output_path(f'{OUTPUT}/{l_tool}_{r_tool}_dependency_output.json', FORMAT, COMPRESS),
+                                FORMAT, COMPRESS) as output:
+                output.section('eq', ((each[0].into_dict(), each[1].into_dict()) for each in dependency_eq_set))
+            result['dependency_eq'] = len(dependency_eq_set)
+        print(f'{l_tool} vs {r_tool}: {result}')
+
+    rows, summary = agreement(entity_sets, eq_results)
+    with DocumentWriter(output_path(f'{OUTPUT}/{PROJECTNAME}_agreement.json', FORMAT, COMPRESS),
+                        FORMAT, COMPRESS) as output:
+        output.field('projectName', PROJECTNAME)
+        output.field('tools', list(entity_sets))
+        output.field('summary', summary)
+        output.section('agreement', iter(rows))
+    print(f'agreement: {summary}')
@@ -0,0 +1,147 @@
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+from columnar import is_columnar, load_table, pack_table, table_chunks, table_from_buffer, table_from_records
+from record_io import iter_section
+
+
+# 并行加载：每个需要解析的输入交给一个子进程，解析好的表按列式文件的布局写进一块共享内存，
+# 子进程只传回共享内存的名字，主进程直接在这块内存上构造Table，列不经过pickle也不再复制，
+# 总的加载时间接近最大的那个文件。列式输入本来就是内存映射，直接在主进程里打开；
+# 开了解析缓存时主进程先查缓存，命中就映射缓存文件，没命中才交给子进程解析，子进程写入缓存后仍经共享内存传回，
+# 不传缓存文件的路径，因为其他进程随时可能把这个条目淘汰掉
+# 子进程创建的共享内存要等主进程接上以后才能关(Windows上最后一个句柄关掉内存就没了)，先留在这里，子进程退出时释放
+_handed_off = []
+
+
+# 一个加载中的输入，result()等子进程做完并在主进程里接上结果
+class Loading:
+    def __init__(self, future=None, value=None, attach=None):
+        self.future = future
+        self.value = value
+        self.attach = attach
+
+    def result(self):
+        if self.future is not None:
+            self.value = self.attach(self.future.result())
+            self.future = None
+        return self.value
+
+
+# 只有一个可用CPU时子进程帮不上忙，直接在本进程里依次加载
+class ParallelLoader:
+    def __init__(self, workers: int = None):
+        self.workers = min(workers or available_cpus(), available_cpus())
+        self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # 进程池在第一个需要子进程的输入出现时才创建；POSIX上先启动资源跟踪进程，子进程共用它，主进程删掉共享内存后不会被当成泄漏。
+    # Windows上没有资源跟踪进程(ensure_running要传文件描述符，只能在POSIX上用)，共享内存没有名字可删，
+    # 最后一个句柄关掉时系统自动释放：子进程的句柄留在_handed_off里到进程池关闭，主进程的句柄随Table关闭
+    def submit(self, function, *args):
+        if self.executor is None:
+            if os.name == 'posix':
+                resource_tracker.ensure_running()
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self.executor.submit(function, *args)
+
+    # 归一化的实体表或依赖表
+    def table(self, path: str, kind: str, cache=None):
+        if is_columnar(path):
+            return Loading(value=load_table(path))
+        if self.workers <= 1:
+            return Loading(value=parse_table(path, kind, cache))
+        if cache is not None and cache.enabled:
+            table = cache.get(cache.normalized_key(path, kind), kind)
+            if table is not None:
+                return Loading(value=table)
+        return Loading(self.submit(_parse_table, path, kind, cache), attach=attach_table)
+
+    # 在子进程里运行返回{名字: array}的函数，数组经共享内存传回，主进程拿到的是array
+    def arrays(self, function, *args):
+        if self.workers <= 1:
+            return Loading(value=function(*args))
+        return Loading(self.submit(_run_arrays, function, args), attach=attach_arrays)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+def available_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return max(1, len(os.sched_getaffinity(0)))
+    return os.cpu_count() or 1
+
+
+def parse_table(path: str, kind: str, cache):
+    if cache is not None and cache.enabled:
+        return cache.load_normalized(path, kind)
+    return table_from_records(kind, iter_section(path, kind))
+
+
+def _parse_table(path: str, kind: str, cache):
+    return share(table_chunks(parse_table(path, kind, cache)))
+
+
+def _run_arrays(function, args):
+    arrays = function(*args)
+    layout = []
+    chunks = []
+    for name, data in arrays.items():
+        layout.append((name, data.typecode, len(data)))
+        chunks.append(memoryview(data).cast('B'))
+    return share(chunks), layout
+
+
+def share(chunks: list):
+    memory = shared_memory.SharedMemory(create=True, size=max(1, sum(len(chunk) for chunk in chunks)))
+    pack_table(chunks, memory.buf)
+    _handed_off.append(memory)
+    return memory.name
+
+
+# 表的列是这块内存上的memoryview，解释器退出时列可能比它晚释放，这时关不掉也无妨，进程结束时映射自然解除
+class SharedBlock(shared_memory.SharedMemory):
+    def close(self):
+        try:
+            super().close()
+        except BufferError:
+            pass
+
+
+# POSIX上接上之后名字马上就可以删掉，映射在关闭之前一直有效
+def attach(name: str):
+    memory = SharedBlock(name=name)
+    memory.unlink()
+    return memory
+
+
+def attach_table(name: str):
+    memory = attach(name)
+    table = table_from_buffer(memory.buf, name)
+    table.mapped = memory
+    return table
+
+
+def attach_arrays(handoff):
+    name, layout = handoff
+    memory = attach(name)
+    arrays = dict()
+    position = 0
+    for key, typecode, length in layout:
+        data = array(typecode)
+        size = length * data.itemsize
+        data.frombytes(memory.buf[position:position + size])
+        arrays[key] = data
+        position += size
+    memory.close()
+    return arrays
@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+
+import columnar
+import record_io
+
+
+# 解析结果的磁盘缓存：键是输入文件内容的哈希、工具名和转换器版本，值是列式表
+# 命中时直接内存映射缓存里的列式文件，超过容量上限时按最近使用时间淘汰
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache', 'static-tool-analysis')
+DEFAULT_LIMIT_MB = 2048
+HASH_CHUNK = 1 << 20
+DIGEST_INDEX = 'digests.json'
+# 归一化JSON到列式表的转换方式变化时加一，旧缓存自然失效
+NORMALIZED_VERSION = 1
+
+
+def file_digest(path: str):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ParseCache:
+    def __init__(self, directory: str = None, limit_mb: int = DEFAULT_LIMIT_MB, enabled: bool = True):
+        self.directory = directory or os.environ.get('STA_CACHE_DIR') or DEFAULT_DIRECTORY
+        self.limit = limit_mb * 1024 * 1024
+        self.enabled = enabled
+        self.digests = None
+
+    def read_digests(self):
+        try:
+            with open(os.path.join(self.directory, DIGEST_INDEX), 'r', encoding='utf-8') as index:
+                return json.load(index)
+        except (OSError, ValueError):
+            return dict()
+
+    # 文件大小和修改时间都没变时复用上次算出的哈希，避免每次都把大文件读一遍
+    def digest(self, path: str):
+        if self.digests is None:
+            self.digests = self.read_digests()
+        stat = os.stat(path)
+        absolute = os.path.abspath(path)
+        known = self.digests.get(absolute)
+        if known is not None and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            return known[2]
+        digest = file_digest(path)
+        # 其他进程可能同时在写索引，写回前重新读一遍合并，不覆盖掉它们刚记下的哈希
+        self.digests = self.read_digests()
+        self.digests[absolute] = [stat.st_size, stat.st_mtime_ns, digest]
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = os.path.join(self.directory, DIGEST_INDEX + f'.{os.getpid()}.tmp')
+        with open(temporary, 'w', encoding='utf-8') as index:
+            json.dump(self.digests, index)
+        os.replace(temporary, os.path.join(self.directory, DIGEST_INDEX))
+        return digest
+
+    def key(self, tool: str, version, *paths: str):
+        digest = hashlib.sha256(f'{tool}\0{version}\0{columnar.VERSION}'.encode('utf-8'))
+        for path in paths:
+            digest.update(b'\0' + (self.digest(path).encode('ascii') if path and os.path.isfile(path) else b'-'))
+        return digest.hexdigest()
+
+    def entry(self, key: str, name: str):
+        return os.path.join(self.directory, f'{key}-{name}.columnar')
+
+    def get(self, key: str, name: str):
+        if not self.enabled:
+            return None
+        path = self.entry(key, name)
+        try:
+            table = columnar.load_table(path)
+        except (OSError, ValueError):
+            return None
+        # 映射之后文件被别的进程淘汰也不影响已经映射的表
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return table
+
+    def put(self, key: str, name: str, table):
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.entry(key, name)
+        temporary = path + f'.{os.getpid()}.tmp'
+        columnar.write_table(temporary, table)
+        os.replace(temporary, path)
+        self.evict()
+
+    # 取出缓存，没有时用load解析并写入缓存
+    def load(self, key: str, name: str, load):
+        table = self.get(key, name)
+        if table is None:
+            table = load()
+            self.put(key, name, table)
+        return table
+
+    # 归一化后的JSON文件解析成列式表，differ和dependency_diff共用
+    def load_normalized(self, path: str, kind: str):
+        return self.load(self.normalized_key(path, kind), kind,
+                         lambda: columnar.table_from_records(kind, record_io.iter_section(path, kind)))
+
+    def normalized_key(self, path: str, kind: str):
+        return self.key('normalized-' + kind, NORMALIZED_VERSION, path)
+
+    def entries(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                if name.endswith('.columnar')]
+
+    # 多个进程可能同时淘汰，列出之后才消失的条目直接跳过
+    def evict(self):
+        entries = []
+        for path in self.entries():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.limit:
+                break
+            total -= size
+            remove(path)
+
+    def clear(self):
+        for path in self.entries():
+            remove(path)
+        remove(os.path.join(self.directory, DIGEST_INDEX))
+        self.digests = None
+
+
+def remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def add_cache_arguments(parser):
+    parser.add_argument("--no-cache", action="store_true", help="bypass the parse cache")
+    parser.add_argument("--clear-cache", action="store_true", help="empty the parse cache before running")
+    parser.add_argument("--cache-dir", type=str, default=None,
+                        help=f"parse cache directory, $STA_CACHE_DIR or {DEFAULT_DIRECTORY} by default")
+    parser.add_argument("--cache-limit", type=int, default=DEFAULT_LIMIT_MB,
+                        help="evict least recently used cache entries above this many MB")
+
+
+def cache_from_args(args):
+    cache = ParseCache(args.cache_dir, args.cache_limit, not args.no_cache)
+    if args.clear_cache:
+        cache.clear()
+    return cache
@@ -0,0 +1,191 @@
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from record_io import strip_compression
+
+
+# 分阶段统计墙钟时间、CPU时间和Python分配的峰值内存，阶段可以嵌套，名字用'/'连接
+# 内层阶段开始时会重置tracemalloc的峰值，所以外层阶段在这之前先把自己目前的峰值记下来
+# tracemalloc会让分配密集的阶段慢几倍，memory为False时只记阶段结束时进程的RSS高水位
+class Profiler:
+    def __init__(self, enabled: bool = True, memory: bool = True):
+        self.enabled = enabled
+        self.memory = enabled and memory
+        self.phases = []
+        self.stack = []
+        self.comparers = []
+        self.tallies = dict()
+        self.started = time.perf_counter()
+        self.cpu_started = time.process_time()
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def phase(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        if self.stack:
+            parent = self.stack[-1]
+            parent['peak'] = max(parent['peak'], self.traced_peak())
+        if self.memory:
+            tracemalloc.reset_peak()
+        frame = {'name': '/'.join([each['name'] for each in self.stack] + [name]), 'peak': 0,
+                 'wall': time.perf_counter(), 'cpu': time.process_time()}
+        self.stack.append(frame)
+        try:
+            yield
+        finally:
+            self.stack.pop()
+            peak = max(frame['peak'], self.traced_peak())
+            if self.stack:
+                self.stack[-1]['peak'] = max(self.stack[-1]['peak'], peak)
+            record = {
+                'phase': frame['name'],
+                'wall_seconds': round(time.perf_counter() - frame['wall'], 6),
+                'cpu_seconds': round(time.process_time() - frame['cpu'], 6),
+            }
+            if self.memory:
+                record['peak_mb'] = round(peak / (1 << 20), 3)
+            record['peak_rss_mb'] = peak_rss_mb()
+            self.phases.append(record)
+
+    def traced_peak(self):
+        return tracemalloc.get_traced_memory()[1] if self.memory else 0
+
+    # 用计数代理包装比较器，没开启时原样返回
+    def counting(self, comparer):
+        if not self.enabled or comparer is None:
+            return comparer
+        counter = CountingComparer(comparer)
+        self.comparers.append(counter)
+        return counter
+
+    # 不经过比较器的结果(比如依赖的哈希连接)直接按类型对计数
+    def tally(self, lhs_type, rhs_type, outcome: str, count: int = 1):
+        if self.enabled:
+            add_count(self.tallies, lhs_type, rhs_type, outcome, count)
+
+    def report(self, tool: str):
+        counts = dict()
+        for source in [self.tallies] + [each.counts for each in self.comparers]:
+            merge_counts(counts, source)
+        comparisons = [dict(lhs_type=lhs_type, rhs_type=rhs_type, **outcomes)
+                       for (lhs_type, rhs_type), outcomes in counts.items()]
+        comparisons.sort(key=lambda each: (-each.get('calls', 0), str(each['lhs_type']), str(each['rhs_type'])))
+        return {
+            'tool': tool,
+            'argv': sys.argv,
+            'wall_seconds': round(time.perf_counter() - self.started, 6),
+            'cpu_seconds': round(time.process_time() - self.cpu_started, 6),
+            'peak_mb': round(max([each['peak_mb'] for each in self.phases], default=0), 3) if self.memory else None,
+            'peak_rss_mb': peak_rss_mb(),
+            'phases': self.phases,
+            'comparisons': comparisons,
+        }
+
+    def write(self, path: str, tool: str):
+        if not self.enabled:
+            return None
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.report(tool), file, indent=4)
+        return path
+
+
+def add_count(counts: dict, lhs_type, rhs_type, outcome: str, count: int = 1):
+    outcomes = counts.setdefault((lhs_type, rhs_type), dict())
+    outcomes['calls'] = outcomes.get('calls', 0) + count
+    outcomes[outcome] = outcomes.get(outcome, 0) + count
+
+
+# calls是各结果之和，合并时按结果重新累加
+def merge_counts(counts: dict, other: dict):
+    for (lhs_type, rhs_type), outcomes in other.items():
+        for outcome, count in outcomes.items():
+            if outcome != 'calls':
+                add_count(counts, lhs_type, rhs_type, outcome, count)
+
+
+# 比较器的计数代理：按(左类型, 右类型)统计调用次数和Equal/MaybeEQ/NotEQ，其余属性都转给原比较器
+# 并行时代理随比较器一起发到子进程，子进程把各自的计数取走(take_counts)带回主进程合并
+class CountingComparer:
+    def __init__(self, comparer):
+        self.comparer = comparer
+        self.counts = dict()
+
+    def compare(self, lhs, rhs):
+        result = self.comparer.compare(lhs, rhs)
+        outcome = result.name if result is not None else 'None'
+        add_count(self.counts, lhs.entityType, rhs.entityType, outcome)
+        return result
+
+    def take_counts(self):
+        counts = self.counts
+        self.counts = dict()
+        return counts
+
+    def merge_counts(self, counts: dict):
+        merge_counts(self.counts, counts)
+
+    def __getattr__(self, name):
+        if name == 'comparer':
+            raise AttributeError(name)
+        return getattr(self.comparer, name)
+
+
+# 进程到目前为止的最大常驻内存(字节)，取不到时返回None；ru_maxrss在Linux上是KB，在macOS上是字节
+# resource只有Unix上有，Windows上用GetProcessMemoryInfo的PeakWorkingSetSize
+def peak_rss():
+    if sys.platform == 'win32':
+        return windows_peak_rss()
+    import resource
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+def peak_rss_mb():
+    usage = peak_rss()
+    return None if usage is None else round(usage / (1 << 20), 1)
+
+
+def windows_peak_rss():
+    import ctypes
+    from ctypes import wintypes
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + \
+                   [(name, ctypes.c_size_t) for name in
+                    ['PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage',
+                     'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage']]
+
+    try:
+        kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+        kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+        kernel32.K32GetProcessMemoryInfo.argtypes = [wintypes.HANDLE, ctypes.POINTER(ProcessMemoryCounters),
+                                                     wintypes.DWORD]
+        kernel32.K32GetProcessMemoryInfo.restype = wintypes.BOOL
+    except (OSError, AttributeError):
+        return None
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    if not kernel32.K32GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+        return None
+    return counters.PeakWorkingSetSize
+
+
+# --profile记录全部，--profile=time不开tracemalloc
+def profile_mode(value):
+    if value not in (None, False, True, 'full', 'time'):
+        raise ValueError(f'unknown profile mode {value!r}, expected full or time')
+    return Profiler(enabled=value not in (None, False), memory=value in (True, 'full'))
+
+
+# 报告和输出放在同一个目录，文件名去掉扩展名和压缩后缀再加.profile.json
+def profile_path(output: str):
+    if os.path.isdir(output):
+        return os.path.join(output, 'profile.json')
+    return os.path.splitext(strip_compression(output))[0] + '.profile.json'
@@ -0,0 +1,194 @@
+import gzip
+import json
+import lzma
+
+import columnar
+from stream_json import iter_array_file, read_field_file
+
+
+# json: 与原来json.dump(..., indent=4)相同; compact: 去掉缩进和空格; jsonl: 每行一条记录
+FORMATS = ['json', 'compact', 'jsonl']
+COMPRESSIONS = ['none', 'gzip', 'xz']
+COMPRESSION_SUFFIX = {'gzip': '.gz', 'xz': '.xz'}
+MAGIC = {b'\x1f\x8b': 'gzip', b'\xfd7zXZ\x00': 'xz'}
+# jsonl开头声明数组和字段的行都很短，第一行超过这个长度的一定是JSON文档
+SNIFF_LIMIT = 1 << 16
+
+
+def open_text(path: str, mode: str = 'r', compress: str = None):
+    if compress is None and 'r' in mode:
+        compress = sniff_compression(path)
+    if compress == 'gzip':
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    if compress == 'xz':
+        return lzma.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def sniff_compression(path: str):
+    with open(path, 'rb') as file:
+        head = file.read(6)
+    for magic, compress in MAGIC.items():
+        if head.startswith(magic):
+            return compress
+    return 'none'
+
+
+def strip_compression(path: str):
+    for suffix in COMPRESSION_SUFFIX.values():
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+
+# 输出格式和压缩方式没有指定时按扩展名推断
+def infer_format(path: str):
+    return 'jsonl' if strip_compression(path).endswith('.jsonl') else 'json'
+
+
+# 读的时候按内容判断布局，不看扩展名：jsonl的第一行是只有一个成员的对象，声明一个数组或者一个标量字段，
+# 后面还有别的行；json缩进格式的第一行只有'{'，compact整个文档在一行里
+def sniff_format(path: str):
+    with open_text(path) as file:
+        line = file.readline(SNIFF_LIMIT)
+        if not line.endswith('\n') or not file.read(1):
+            return 'json'
+    try:
+        head = json.loads(line)
+    except ValueError:
+        return 'json'
+    if isinstance(head, dict) and len(head) == 1:
+        value = next(iter(head.values()))
+        if value == [] or not isinstance(value, (list, dict)):
+            return 'jsonl'
+    return 'json'
+
+
+def infer_compression(path: str):
+    for compress, suffix in COMPRESSION_SUFFIX.items():
+        if path.endswith(suffix):
+            return compress
+    return 'none'
+
+
+# 把以.json结尾的路径换成格式和压缩方式对应的扩展名，列式二进制文件不压缩
+def output_path(json_path: str, fmt: str = 'json', compress: str = 'none'):
+    if fmt == 'columnar':
+        return json_path[:-len('.json')] + '.columnar' if json_path.endswith('.json') else json_path
+    if fmt == 'jsonl' and json_path.endswith('.json'):
+        json_path += 'l'
+    return json_path + COMPRESSION_SUFFIX.get(compress, '')
+
+
+# 增量写出一个JSON文档：标量字段用field，记录数组用section逐条写出
+class DocumentWriter:
+    def __init__(self, path: str, fmt: str = None, compress: str = None):
+        self.fmt = fmt or infer_format(path)
+        self.file = open_text(path, 'w', compress or infer_compression(path))
+        self.members = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def dumps(self, value, indent: str = ''):
+        if self.fmt == 'json':
+            return json.dumps(value, indent=4).replace('\n', '\n' + indent)
+        return json.dumps(value, separators=(',', ':'))
+
+    def begin_member(self, key: str):
+        if self.fmt == 'json':
+            self.file.write('{\n    ' if self.members == 0 else ',\n    ')
+            self.file.write(json.dumps(key) + ': ')
+        elif self.fmt == 'compact':
+            self.file.write('{' if self.members == 0 else ',')
+            self.file.write(json.dumps(key) + ':')
+        self.members += 1
+
+    def field(self, key: str, value):
+        if self.fmt == 'jsonl':
+            self.file.write(self.dumps({key: value}) + '\n')
+            return
+        self.begin_member(key)
+        self.file.write(self.dumps(value, '    '))
+
+    def section(self, key: str, records):
+        if self.fmt == 'jsonl':
+            # 先写一行声明这个数组，空数组也能被读出来
+            self.file.write(self.dumps({key: []}) + '\n')
+            for record in records:
+                self.file.write(self.dumps([key, record]) + '\n')
+            return
+        self.begin_member(key)
+        self.file.write('[')
+        empty = True
+        for record in records:
+            if self.fmt == 'json':
+                self.file.write('\n        ' if empty else ',\n        ')
+                self.file.write(self.dumps(record, '        '))
+            else:
+                self.file.write(self.dumps(record) if empty else ',' + self.dumps(record))
+            empty = False
+        if self.fmt == 'json' and not empty:
+            self.file.write('\n    ')
+        self.file.write(']')
+
+    def close(self):
+        if self.fmt == 'json':
+            self.file.write('{}' if self.members == 0 else '\n}')
+        elif self.fmt == 'compact':
+            self.file.write('{}' if self.members == 0 else '}')
+        self.file.close()
+
+
+# 逐条读取文档中key对应的数组，json/compact/jsonl、压缩文件以及列式二进制文件都可以
+def iter_section(path: str, key: str):
+    if columnar.is_columnar(path):
+        table = columnar.load_table(path)
+        if table.kind == key:
+            yield from table
+        return
+    with open_text(path) as file:
+        if sniff_format(path) == 'jsonl':
+            for line in file:
+                record = json.loads(line)
+                if isinstance(record, list) and record[0] == key:
+                    yield record[1]
+        else:
+            yield from iter_array_file(file, key)
+
+
+# 读取一个标量字段，不会把前面的记录数组整个读进内存
+def read_field(path: str, key: str, default=None):
+    if columnar.is_columnar(path):
+        table = columnar.load_table(path)
+        return {'schemaVersion': 1.0, 'projectName': table.projectname}.get(key, default)
+    with open_text(path) as file:
+        if sniff_format(path) != 'jsonl':
+            return read_field_file(file, key, default)
+        for line in file:
+            record = json.loads(line)
+            if isinstance(record, dict) and key in record:
+                return record[key]
+        return default
+
+
+# 读取整个文档，结果与json.load相同
+def load_document(path: str):
+    if columnar.is_columnar(path):
+        table = columnar.load_table(path)
+        return {'schemaVersion': 1.0, table.kind: list(table), 'projectName': table.projectname}
+    with open_text(path) as file:
+        if sniff_format(path) != 'jsonl':
+            return json.load(file)
+        document = dict()
+        for line in file:
+            record = json.loads(line)
+            if isinstance(record, list):
+                document[record[0]].append(record[1])
+            else:
+                for key, value in record.items():
+                    document[key] = [] if isinstance(value, list) else value
+        return document
@@ -0,0 +1,246 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+
+
+# 表结构变化时加一，旧库打开时报错而不是读出错位的列
+SCHEMA_VERSION = 2
+STORE_SUFFIXES = ('.db', '.sqlite', '.sqlite3')
+SQLITE_MAGIC = b'SQLite format 3\x00'
+ENTITY_FIELDS = ['entityID', 'entityName', 'entityType', 'entityFile',
+                 'startLine', 'startColumn', 'endLine', 'endColumn']
+DEPENDENCY_FIELDS = ['dependencyType', 'dependencySrcID', 'dependencyDestID',
+                     'startLine', 'startColumn', 'endLine', 'endColumn']
+
+# 实体按每次比较(项目, 左工具, 右工具)各存一份，用自增的row标识：Understand等工具会重复使用实体ID，
+# 按ID存会把同ID的实体合并掉。比较结果存两边实体的row，连接时按row找回原来的实体；
+# 同时保留两边的ID，依赖比较取等价关系时不用连接实体表。ne只有一边有值
+# 依赖没有ID，结果行里直接带上两边的依赖字段
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS entity (
+    row INTEGER PRIMARY KEY,
+    project TEXT NOT NULL, l_tool TEXT NOT NULL, r_tool TEXT NOT NULL, tool TEXT NOT NULL,
+    {', '.join(f'{field}' for field in ENTITY_FIELDS)}
+);
+CREATE INDEX IF NOT EXISTS entity_id ON entity (project, l_tool, r_tool, tool, entityID);
+CREATE INDEX IF NOT EXISTS entity_type ON entity (project, tool, entityType);
+CREATE INDEX IF NOT EXISTS entity_file ON entity (project, tool, entityFile);
+CREATE TABLE IF NOT EXISTS entity_result (
+    project TEXT NOT NULL, l_tool TEXT NOT NULL, r_tool TEXT NOT NULL, result TEXT NOT NULL,
+    l_id INTEGER, r_id INTEGER, l_row INTEGER, r_row INTEGER
+);
+CREATE INDEX IF NOT EXISTS entity_result_left ON entity_result (project, l_tool, r_tool, result, l_id);
+CREATE INDEX IF NOT EXISTS entity_result_right ON entity_result (project, l_tool, r_tool, r_id);
+CREATE TABLE IF NOT EXISTS dependency_result (
+    project TEXT NOT NULL, l_tool TEXT NOT NULL, r_tool TEXT NOT NULL, result TEXT NOT NULL,
+    {', '.join(f'l_{field}' for field in DEPENDENCY_FIELDS)},
+    {', '.join(f'r_{field}' for field in DEPENDENCY_FIELDS)}
+);
+CREATE INDEX IF NOT EXISTS dependency_result_left
+    ON dependency_result (project, l_tool, r_tool, l_dependencySrcID, l_dependencyDestID);
+CREATE INDEX IF NOT EXISTS dependency_result_right
+    ON dependency_result (project, l_tool, r_tool, r_dependencySrcID, r_dependencyDestID);
+CREATE INDEX IF NOT EXISTS dependency_result_type
+    ON dependency_result (project, l_tool, r_tool, l_dependencyType, r_dependencyType);
+"""
+
+
+# 已存在的文件看SQLite文件头，还没创建的输出看扩展名
+def is_store(path: str):
+    if path is None:
+        return False
+    if os.path.isfile(path):
+        with open(path, 'rb') as file:
+            return file.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+    return path.endswith(STORE_SUFFIXES)
+
+
+def fields(record, names: list):
+    return [getattr(record, name) for name in names] if record is not None else [None] * len(names)
+
+
+# 比较结果库：同一个(项目, 左工具, 右工具)重写时先删掉旧结果，整次写入在一个事务里
+class ResultStore:
+    def __init__(self, path: str, readonly: bool = False):
+        if readonly:
+            self.connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        else:
+            self.connection = sqlite3.connect(path)
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        if version == 0 and not readonly:
+            self.connection.executescript(SCHEMA)
+            self.connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        elif version != SCHEMA_VERSION:
+            self.connection.close()
+            raise ValueError(f'{path}: result store schema {version}, expected {SCHEMA_VERSION}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    # 同一个实体对象(比如一对多的eq里重复出现的左实体)只存一行，ID相同的不同实体各存一行；
+    # 删除旧结果后事务已持有写锁，row从当前最大值往后连续分配
+    def write_entity_results(self, project: str, l_tool: str, r_tool: str, eq_set, maybe_eq_set, ne_set):
+        pair = (project, l_tool, r_tool)
+        with self.connection:
+            for table in ['entity_result', 'entity']:
+                self.connection.execute(f'DELETE FROM {table} WHERE project = ? AND l_tool = ? AND r_tool = ?', pair)
+            start = self.connection.execute('SELECT COALESCE(MAX(row), 0) FROM entity').fetchone()[0] + 1
+            rows = dict()
+            entities = []
+
+            def row(tool: str, entity):
+                if id(entity) not in rows:
+                    rows[id(entity)] = start + len(entities)
+                    entities.append((tool, entity))
+                return rows[id(entity)]
+
+            results = [pair + (result, lhs.entityID, rhs.entityID, row(l_tool, lhs), row(r_tool, rhs))
+                       for result, pairs in [('eq', eq_set), ('maybe_eq', maybe_eq_set)] for lhs, rhs in pairs]
+            results += [pair + ('ne',) + ((entity.entityID, None, row(l_tool, entity), None)
+                                          if entity.dataset == l_tool else
+                                          (None, entity.entityID, None, row(r_tool, entity)))
+                        for entity in ne_set]
+            self.connection.executemany(
+                f'INSERT INTO entity VALUES (?, ?, ?, ?, ?, {", ".join("?" * len(ENTITY_FIELDS))})',
+                ([start + i] + list(pair) + [tool] + fields(entity, ENTITY_FIELDS)
+                 for i, (tool, entity) in enumerate(entities)))
+            self.connection.executemany('INSERT INTO entity_result VALUES (?, ?, ?, ?, ?, ?, ?, ?)', results)
+
+    def write_dependency_results(self, project: str, l_tool: str, r_tool: str, eq_set, ne_set=(), maybe_eq_set=()):
+        pair = (project, l_tool, r_tool)
+        with self.connection:
+            self.connection.execute('DELETE FROM dependency_result WHERE project = ? AND l_tool = ? AND r_tool = ?',
+                                    pair)
+            rows = [pair + (result,) + tuple(fields(lhs, DEPENDENCY_FIELDS) + fields(rhs, DEPENDENCY_FIELDS))
+                    for result, pairs in [('eq', eq_set), ('maybe_eq', maybe_eq_set)] for lhs, rhs in pairs]
+            rows += [pair + ('ne',) + tuple(fields(dep if dep.dataset == l_tool else None, DEPENDENCY_FIELDS) +
+                                            fields(dep if dep.dataset != l_tool else None, DEPENDENCY_FIELDS))
+                     for dep in ne_set]
+            self.connection.executemany(
+                f'INSERT INTO dependency_result VALUES (?, ?, ?, ?, {", ".join("?" * 2 * len(DEPENDENCY_FIELDS))})',
+                rows)
+
+    # 依赖比较用的等价关系：(左ID, 右ID, 是否maybe)，走entity_result_left索引，不用读整个实体比较结果
+    def equivalences(self, project: str, l_tool: str, r_tool: str, maybe: bool = False):
+        results = "('eq', 'maybe_eq')" if maybe else "('eq')"
+        return self.connection.execute(
+            f"SELECT l_id, r_id, result = 'maybe_eq' FROM entity_result "
+            f"WHERE project = ? AND l_tool = ? AND r_tool = ? AND result IN {results}",
+            (project, l_tool, r_tool))
+
+    def has_entity_results(self, project: str, l_tool: str, r_tool: str):
+        return self.connection.execute(
+            'SELECT 1 FROM entity_result WHERE project = ? AND l_tool = ? AND r_tool = ? LIMIT 1',
+            (project, l_tool, r_tool)).fetchone() is not None
+
+    # 按结果、类型、文件筛选实体比较结果，逐行产出和JSON输出一样的字典，类型和文件任意一边符合即可
+    def entity_results(self, project: str, l_tool: str, r_tool: str, result: str = None,
+                       entity_type: str = None, entity_file: str = None, limit: int = None):
+        columns = ', '.join(f'{side}.{field}' for side in ['l', 'r'] for field in ENTITY_FIELDS)
+        query = [f'SELECT m.result, {columns} FROM entity_result m',
+                 'LEFT JOIN entity l ON l.row = m.l_row',
+                 'LEFT JOIN entity r ON r.row = m.r_row',
+                 'WHERE m.project = ? AND m.l_tool = ? AND m.r_tool = ?']
+        params = [project, l_tool, r_tool]
+        if result is not None:
+            query.append('AND m.result = ?')
+            params.append(result)
+        if entity_type is not None:
+            query.append('AND (l.entityType = ? OR r.entityType = ?)')
+            params += [entity_type, entity_type]
+        if entity_file is not None:
+            query.append("AND (l.entityFile LIKE '%' || ? || '%' OR r.entityFile LIKE '%' || ? || '%')")
+            params += [entity_file, entity_file]
+        # 按写入顺序返回，和JSON输出里eq、maybe_eq、ne的顺序一致
+        query.append('ORDER BY m.rowid')
+        if limit is not None:
+            query.append('LIMIT ?')
+            params.append(limit)
+        width = len(ENTITY_FIELDS)
+        for row in self.connection.execute(' '.join(query), params):
+            sides = [(tool, row[1 + i * width:1 + (i + 1) * width]) for i, tool in enumerate([l_tool, r_tool])]
+            records = [dict(zip(ENTITY_FIELDS, values), dataset=tool) for tool, values in sides if values[0] is not None]
+            yield {'result': row[0], 'entities': records}
+
+    def dependency_results(self, project: str, l_tool: str, r_tool: str, result: str = None,
+                           dependency_type: str = None, entity_id: int = None, limit: int = None):
+        query = ['SELECT * FROM dependency_result WHERE project = ? AND l_tool = ? AND r_tool = ?']
+        params = [project, l_tool, r_tool]
+        if result is not None:
+            query.append('AND result = ?')
+            params.append(result)
+        if dependency_type is not None:
+            query.append('AND (l_dependencyType = ? OR r_dependencyType = ?)')
+            params += [dependency_type, dependency_type]
+        if entity_id is not None:
+            query.append('AND (l_dependencySrcID = ? OR l_dependencyDestID = ?)')
+            params += [entity_id, entity_id]
+        if limit is not None:
+            query.append('LIMIT ?')
+            params.append(limit)
+        width = len(DEPENDENCY_FIELDS)
+        for row in self.connection.execute(' '.join(query), params):
+            sides = [(tool, row[4 + i * width:4 + (i + 1) * width]) for i, tool in enumerate([l_tool, r_tool])]
+            records = [dict(zip(DEPENDENCY_FIELDS, values), dataset=tool) for tool, values in sides
+                       if values[0] is not None or values[1] is not None]
+            yield {'result': row[3], 'dependencies': records}
+
+    def summary(self):
+        counts = []
+        for table in ['entity_result', 'dependency_result']:
+            for project, l_tool, r_tool, result, count in self.connection.execute(
+                    f'SELECT project, l_tool, r_tool, result, COUNT(*) FROM {table} '
+                    f'GROUP BY project, l_tool, r_tool, result ORDER BY project, l_tool, r_tool, result'):
+                counts.append({'table': table, 'project': project, 'l_tool': l_tool, 'r_tool': r_tool,
+                               'result': result, 'count': count})
+        return counts
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+    summary = commands.add_parser('summary', help="count results per project, tool pair and result")
+    summary.add_argument('store', type=str)
+    for name, help in [('entities', "query entity diff results"), ('dependencies', "query dependency diff results")]:
+        command = commands.add_parser(name, help=help)
+        command.add_argument('store', type=str)
+        command.add_argument("-p", "--projectname", type=str, required=True)
+        command.add_argument("-lt", "--left_tool", type=str, required=True)
+        command.add_argument("-rt", "--right_tool", type=str, required=True)
+        command.add_argument("-r", "--result", type=str, choices=['eq', 'maybe_eq', 'ne'])
+        command.add_argument("--type", type=str, help="entity or dependency type of either side")
+        command.add_argument("-n", "--limit", type=int)
+    commands.choices['entities'].add_argument("--file", type=str, help="substring of the entity file of either side")
+    commands.choices['dependencies'].add_argument("--entity", type=int, help="left entity ID at either end of the edge")
+    sql = commands.add_parser('sql', help="run a read-only SQL query")
+    sql.add_argument('store', type=str)
+    sql.add_argument('query', type=str)
+    return parser.parse_args()
+
+
+# 结果逐行输出成JSON Lines，不在内存里攒整个结果集
+if __name__ == "__main__":
+    args = parse_args()
+    with ResultStore(args.store, readonly=True) as store:
+        if args.command == 'summary':
+            rows = store.summary()
+        elif args.command == 'entities':
+            rows = store.entity_results(args.projectname, args.left_tool, args.right_tool, args.result,
+                                        args.type, args.file, args.limit)
+        elif args.command == 'dependencies':
+            rows = store.dependency_results(args.projectname, args.left_tool, args.right_tool, args.result,
+                                            args.type, args.entity, args.limit)
+        else:
+            cursor = store.connection.execute(args.query)
+            names = [column[0] for column in cursor.description or []]
+            rows = (dict(zip(names, row)) for row in cursor)
+        for row in rows:
+            sys.stdout.write(json.dumps(row) + '\n')
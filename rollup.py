@@ -0,0 +1,299 @@
+import argparse
+import os
+from array import array
+from collections import Counter
+from itertools import accumulate, chain, repeat
+
+import dependency_diff
+from differ import generic_free_tokens
+from parallel_load import ParallelLoader
+from parse_cache import add_cache_arguments, cache_from_args
+from profiling import profile_mode, profile_path
+from record_io import COMPRESSIONS, FORMATS, DocumentWriter
+
+
+# 按类、文件、包三种粒度比较两个工具的依赖图：每个工具的依赖图是带类型通道的稀疏邻接矩阵A(CSR)，
+# 由实体名得到包含矩阵P(实体 -> 所属的类/文件/包)，卷起来的图是 P^T A P，再按粒度对两边的边集合求交
+# P每行至多一个非零元，P^T A P就是把每条边的两端换成所属的节点，再把落在同一(源, 目标, 通道)上的边权相加
+LEVELS = ['class', 'file', 'package']
+TOOLS = ['enre', 'understand', 'sourcetrail', 'depends', 'code2graph']
+# 类型里含这些词的是成员(变量、参数、枚举常量)，不算类
+MEMBER_WORDS = ['VARIABLE', 'PARAMETER', 'MEMBER', 'CONSTANT', 'ENUMERATOR', 'FIELD']
+CLASS_WORDS = ['CLASS', 'INTERFACE', 'ENUM', 'ANNOTATION']
+METHOD_WORDS = ['METHOD', 'FUNCTION', 'CONSTRUCTOR']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-lt", "--left_tool", type=str, required=True, choices=TOOLS,
+                        help="choose the left tool you used, eg: understand, enre, depends...")
+    parser.add_argument("-rt", "--right_tool", type=str, required=True, choices=TOOLS,
+                        help="choose the right tool you used, eg: understand, enre, depends...")
+    parser.add_argument("-le", "--left_entity", type=str, required=True, help="please input the left entity file path")
+    parser.add_argument("-ld", "--left_dependency", type=str, required=True, help="please input the left dependency file path")
+    parser.add_argument("-re", "--right_entity", type=str, required=True, help="please input the right entity file path")
+    parser.add_argument("-rd", "--right_dependency", type=str, required=True, help="please input the right dependency file path")
+    parser.add_argument("-p", "--projectname", type=str, required=True, help="please input the project name")
+    parser.add_argument("-o", "--output", type=str, required=True, help="please input the output file path")
+    parser.add_argument("-l", "--levels", type=str, nargs='+', default=LEVELS, choices=LEVELS,
+                        help="granularities to compare, all of them by default")
+    parser.add_argument("-t", "--typed", action="store_true",
+                        help="keep one channel per normalized dependency type instead of merging them")
+    parser.add_argument("-f", "--format", type=str, choices=FORMATS,
+                        help="output record format, inferred from the output file extension by default")
+    parser.add_argument("-z", "--compress", type=str, choices=COMPRESSIONS,
+                        help="compress the output file, inferred from the output file extension by default")
+    parser.add_argument("--profile", type=str, nargs="?", const="full", choices=['full', 'time'],
+                        help="write per-phase time and memory next to the output file, 'time' skips the slow tracemalloc accounting")
+    add_cache_arguments(parser)
+    args = parser.parse_args()
+    return args.left_tool, args.right_tool, args.left_entity, args.left_dependency, args.right_entity, \
+           args.right_dependency, args.projectname, args.output, args.levels, args.typed, args.format, args.compress, \
+           cache_from_args(args), profile_mode(args.profile)
+
+
+# 按大写类型里的关键字把实体归为包、文件、类、方法，其余(成员)返回None
+def entity_kind(entity_type: str):
+    upper = (entity_type or '').upper()
+    if 'PACKAGE' in upper:
+        return 'package'
+    if upper.endswith('FILE'):
+        return 'file'
+    if any(word in upper for word in MEMBER_WORDS):
+        return None
+    if upper == 'TYPE' or any(word in upper for word in CLASS_WORDS):
+        return 'class'
+    if any(word in upper for word in METHOD_WORDS):
+        return 'method'
+    return None
+
+
+# 各工具的全限定名写法不同：Sourcetrail带前导'.'和泛型参数，统一成不带泛型的点分名
+def qualified_name(name: str):
+    if name is None:
+        return ''
+    if '<' in name:
+        return '.'.join(generic_free_tokens(name))
+    return name.lstrip('.')
+
+
+# 以路径命名的文件实体(Depends、Sourcetrail)，取路径去掉扩展名后最长的、是类名的点分后缀
+def class_suffix(path: str, classes: dict):
+    tokens = os.path.splitext(path.replace('\\', '/'))[0].split('/')
+    return next((suffix for suffix in ('.'.join(tokens[i:]) for i in range(len(tokens))) if suffix in classes), None)
+
+
+# 一个实体在三种粒度上所属的节点：类是最近的外层类(类自己算自己)，文件是最外层的类(Java里一个顶层类型一个文件)，
+# 包是最近的外层包；工具没有报告包实体时用顶层类的前缀代替。classes是类名 -> 节点名
+def place(name: str, kind, classes: dict, packages: set):
+    if kind == 'package':
+        return None, None, name
+    if kind == 'file' and ('/' in name or '\\' in name):
+        name = class_suffix(name, classes)
+        if name is None:
+            return None, None, None
+    prefixes = list(accumulate(name.split('.'), lambda a, b: a + '.' + b))
+    end = len(prefixes) if kind in ('class', 'file') else len(prefixes) - 1
+    class_key = file_key = package_key = None
+    for prefix in reversed(prefixes[:end]):
+        if prefix in classes:
+            file_key = classes[prefix]
+            class_key = class_key or file_key
+        elif prefix in packages:
+            package_key = prefix
+            break
+    if kind == 'file':
+        class_key, file_key = None, file_key or name
+    if package_key is None and file_key is not None:
+        package_key = file_key.rpartition('.')[0] or None
+    return class_key, file_key, package_key
+
+
+# 类名 -> 节点名。工具没报告的类(Understand的实体文件里常常没有顶层类)从方法的外层名补上；
+# ENRE把枚举和注解记成X.X，节点名取X，和其它工具对上
+def class_keys(rows: list, packages: set):
+    classes = dict()
+    for _, name, kind in rows:
+        if kind == 'method' and '(' not in name:
+            owner = name.rpartition('.')[0]
+            if owner and owner not in packages:
+                classes[owner] = owner
+    for _, name, kind in rows:
+        if kind == 'class':
+            head, _, last = name.rpartition('.')
+            classes[name] = head if head.rpartition('.')[2] == last else name
+    return classes
+
+
+# 一个工具的包含矩阵，每种粒度一个：实体ID -> 所属节点在两边共用的词表里的编号，对不上任何节点的实体不在里面
+def containment(table, vocabularies: dict, levels: list):
+    names = table.pools['names']
+    types = table.pools['types']
+    kinds = [entity_kind(types[code]) for code in range(len(types))]
+    kinds.append(None)
+    rows = [(entity_id, qualified_name(names[name]) if name >= 0 else '', kinds[kind])
+            for entity_id, name, kind in zip(table.columns['entityID'], table.columns['entityName'],
+                                             table.columns['entityType'])]
+    packages = {name for _, name, kind in rows if kind == 'package'}
+    classes = class_keys(rows, packages)
+    parents = {level: dict() for level in levels}
+    for entity_id, name, kind in rows:
+        for level, key in zip(LEVELS, place(name, kind, classes, packages)):
+            if key is not None and level in parents:
+                vocabulary = vocabularies[level]
+                parents[level][entity_id] = vocabulary.setdefault(key, len(vocabulary))
+    return parents
+
+
+# 稀疏邻接矩阵，CSR形式：源节点sources[i]的出边是targets/channels/weights的[offsets[i], offsets[i + 1])，
+# 按(源, 目标, 通道)排序。通道是依赖类型，不分类型时只有通道0；权重是合并进这条边的原始边数
+class SparseGraph:
+    __slots__ = ('sources', 'offsets', 'targets', 'channels', 'weights', 'dropped', 'internal')
+
+    # counts是{(源, 目标, 通道): 权重}
+    def __init__(self, counts: dict = None):
+        self.sources = array('q')
+        self.offsets = array('q', [0])
+        self.targets = array('q')
+        self.channels = array('q')
+        self.weights = array('q')
+        self.dropped = 0
+        self.internal = 0
+        for (src, dest, channel), weight in sorted((counts or dict()).items()):
+            if not self.sources or self.sources[-1] != src:
+                self.sources.append(src)
+                self.offsets.append(self.offsets[-1])
+            self.targets.append(dest)
+            self.channels.append(channel)
+            self.weights.append(weight)
+            self.offsets[-1] += 1
+
+    # 实体级的图：依赖表的每一行是一条权重为1的边，重复的边合并
+    @staticmethod
+    def from_table(table, channel_of):
+        columns = table.columns
+        return SparseGraph(Counter(zip(columns['dependencySrcID'], columns['dependencyDestID'],
+                                       map(channel_of, columns['dependencyType']))))
+
+    def __len__(self):
+        return len(self.targets)
+
+    # 每条边的源节点，按CSR展开
+    def edge_sources(self):
+        return chain.from_iterable(map(repeat, self.sources, map(int.__sub__, self.offsets[1:], self.offsets[:-1])))
+
+    # P^T A P：两端换成parent里的节点后相加；有一端不在parent里的边记进dropped，两端落在同一节点的记进internal
+    def rollup(self, parent: dict):
+        counts = dict()
+        dropped = internal = 0
+        for src, dest, channel, weight in zip(map(parent.get, self.edge_sources()), map(parent.get, self.targets),
+                                              self.channels, self.weights):
+            if src is None or dest is None:
+                dropped += weight
+            elif src == dest:
+                internal += weight
+            else:
+                key = (src, dest, channel)
+                counts[key] = counts.get(key, 0) + weight
+        graph = SparseGraph(counts)
+        graph.dropped = dropped
+        graph.internal = internal
+        return graph
+
+    def edge_weights(self):
+        return dict(zip(zip(self.edge_sources(), self.targets, self.channels), self.weights))
+
+
+# 一种粒度上两边的比较：边按(源, 目标, 通道)整体求交集和差集，precision以右边为参照
+def compare(level: str, left: SparseGraph, right: SparseGraph, channel_names: list):
+    l_edges = left.edge_weights()
+    r_edges = right.edge_weights()
+    both = l_edges.keys() & r_edges.keys()
+    precision = round(len(both) / len(l_edges), 4) if l_edges else None
+    recall = round(len(both) / len(r_edges), 4) if r_edges else None
+    summary = {
+        'level': level,
+        'left': len(l_edges),
+        'right': len(r_edges),
+        'both': len(both),
+        'leftOnly': len(l_edges) - len(both),
+        'rightOnly': len(r_edges) - len(both),
+        'precision': precision,
+        'recall': recall,
+        'f1': round(2 * precision * recall / (precision + recall), 4) if precision and recall else None,
+        'leftUnplaced': left.dropped,
+        'rightUnplaced': right.dropped,
+        'leftInternal': left.internal,
+        'rightInternal': right.internal,
+    }
+    if len(channel_names) > 1:
+        agreed = Counter(channel_names[channel] for _, _, channel in both)
+        summary['metrics'] = dependency_diff.dependency_metrics(
+            Counter(channel_names[channel] for _, _, channel in l_edges),
+            Counter(channel_names[channel] for _, _, channel in r_edges), agreed, agreed)
+    return summary, l_edges, r_edges
+
+
+# 两边所有的边，按节点名和类型排序，left/right是两边各自合并进来的原始边数，没有的一边为0
+def edge_records(l_edges: dict, r_edges: dict, node_names: list, channel_names: list):
+    keys = sorted(l_edges.keys() | r_edges.keys(),
+                  key=lambda key: (node_names[key[0]], node_names[key[1]], str(channel_names[key[2]])))
+    for key in keys:
+        yield {'source': node_names[key[0]], 'target': node_names[key[1]], 'dependencyType': channel_names[key[2]],
+               'left': l_edges.get(key, 0), 'right': r_edges.get(key, 0)}
+
+
+# 依赖类型编码 -> 通道：不分类型时都是0，否则按归一化类型在两边共用的通道表里编号
+def channel_mapper(table, tool: str, typed: bool, channels: dict):
+    if not typed:
+        return lambda code: 0
+    types = table.pools['types']
+    codes = [channels.setdefault(dependency_diff.normalize_dependency_type(tool, types[code]), len(channels))
+             for code in range(len(types))]
+    codes.append(channels.setdefault(dependency_diff.normalize_dependency_type(tool, None), len(channels)))
+    return codes.__getitem__
+
+
+if __name__ == "__main__":
+    L_TOOL, R_TOOL, L_ENTITY, L_DEP, R_ENTITY, R_DEP, PROJECTNAME, OUTPUT, LEVEL_NAMES, TYPED, FORMAT, COMPRESS, \
+        CACHE, PROFILER = parse_args()
+    with PROFILER.phase('load'), ParallelLoader(4) as loader:
+        loading = [loader.table(L_ENTITY, 'entity', CACHE), loader.table(L_DEP, 'dependency', CACHE),
+                   loader.table(R_ENTITY, 'entity', CACHE), loader.table(R_DEP, 'dependency', CACHE)]
+        l_entities, l_deps, r_entities, r_deps = [each.result() for each in loading]
+    levels = [level for level in LEVELS if level in LEVEL_NAMES]
+
+    with PROFILER.phase('containment'):
+        vocabularies = {level: dict() for level in levels}
+        l_parents = containment(l_entities, vocabularies, levels)
+        r_parents = containment(r_entities, vocabularies, levels)
+    with PROFILER.phase('adjacency'):
+        channels = dict() if TYPED else {None: 0}
+        l_graph = SparseGraph.from_table(l_deps, channel_mapper(l_deps, L_TOOL, TYPED, channels))
+        r_graph = SparseGraph.from_table(r_deps, channel_mapper(r_deps, R_TOOL, TYPED, channels))
+        channel_names = sorted(channels, key=channels.get)
+
+    results = []
+    with PROFILER.phase('rollup'):
+        for level in levels:
+            results.append((level, l_graph.rollup(l_parents[level]), r_graph.rollup(r_parents[level])))
+    with PROFILER.phase('compare'):
+        compared = [compare(level, left, right, channel_names) for level, left, right in results]
+    with PROFILER.phase('write'):
+        with DocumentWriter(OUTPUT, FORMAT, COMPRESS) as output:
+            output.field('projectName', PROJECTNAME)
+            output.field('left', L_TOOL)
+            output.field('right', R_TOOL)
+            output.field('levels', [summary for summary, _, _ in compared])
+            for level, (summary, l_edges, r_edges) in zip(levels, compared):
+                node_names = sorted(vocabularies[level], key=vocabularies[level].get)
+                output.section(level, edge_records(l_edges, r_edges, node_names, channel_names))
+
+    print(f"{'level':<10}{'left':>8}{'right':>8}{'both':>8}{'precision':>11}{'recall':>9}{'f1':>8}"
+          f"{'unplaced':>16}{'internal':>16}")
+    for summary, _, _ in compared:
+        print(f"{summary['level']:<10}{summary['left']:>8}{summary['right']:>8}{summary['both']:>8}"
+              f"{str(summary['precision']):>11}{str(summary['recall']):>9}{str(summary['f1']):>8}"
+              f"{summary['leftUnplaced']:>8}/{summary['rightUnplaced']:<7}{summary['leftInternal']:>8}/{summary['rightInternal']:<7}")
+    if PROFILER.write(profile_path(OUTPUT), 'rollup'):
+        print(f'profile: {profile_path(OUTPUT)}')
@@ -0,0 +1,317 @@
+import argparse
+import json
+import os
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import dependency_diff
+from differ import COMPARERS, Handler, get_comparer, load_set
+from nway import TOOLS, NameIndex, parse_tool_paths, shared_index
+from parse_cache import add_cache_arguments, cache_from_args
+
+
+# 常驻服务：每个工具的归一化实体表和依赖表只加载一次，名字索引、实体比较结果、实体等价表和依赖比较结果都留在内存里，
+# 查询只是几次字典查找。每次请求先stat用到的文件，大小或修改时间变了就重新加载这一张表，由它算出来的结果跟着失效
+DEFAULT_PORT = 8765
+DEFAULT_LIMIT = 100
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-e", "--entity", type=str, action="append", required=True,
+                        help="normalized entity file of one tool as TOOL=PATH, repeat for every tool")
+    parser.add_argument("-d", "--dependency", type=str, action="append",
+                        help="normalized dependency file of one tool as TOOL=PATH")
+    parser.add_argument("-p", "--projectname", type=str, required=True, help="please input the project name")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="address to listen on, localhost by default")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="port to listen on")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="worker processes for each entity comparison")
+    parser.add_argument("--lsh", action="store_true", help="use MinHash LSH candidates for sourcetrail vs depends")
+    parser.add_argument("--warm", action="store_true",
+                        help="load every table and run every entity and dependency diff before serving")
+    add_cache_arguments(parser)
+    args = parser.parse_args()
+    return parse_tool_paths(parser, args.entity), parse_tool_paths(parser, args.dependency), args.projectname, \
+           args.host, args.port, args.jobs, args.lsh, args.warm, cache_from_args(args)
+
+
+# 一个输入文件和从它加载出的内容，version在每次重新加载后加一；
+# 请求在多个线程里处理，检查和重新加载都在项目的锁里做，同一张表不会被两个请求同时加载
+class Resident:
+    def __init__(self, path: str, load, lock):
+        self.path = path
+        self.load = load
+        self.lock = lock
+        self.stamp = None
+        self.value = None
+        self.version = 0
+        self.loaded = None
+
+    def get(self):
+        with self.lock:
+            stat = os.stat(self.path)
+            stamp = (stat.st_size, stat.st_mtime_ns)
+            if stamp != self.stamp:
+                self.value = self.load(self.path)
+                self.stamp = stamp
+                self.version += 1
+                self.loaded = time.time()
+            return self.value
+
+
+# 一个工具的实体：原始列表(比较用)、按ID的字典(查找用)和名字索引(所有以它为右侧的比较共用)
+class EntityTable:
+    def __init__(self, entities: list):
+        self.entities = entities
+        self.by_id = {entity.entityID: entity for entity in entities}
+        self.names = NameIndex(entities)
+
+
+class Project:
+    def __init__(self, name: str, entities: dict, dependencies: dict, jobs: int = 1, lsh: bool = False, cache=None):
+        self.name = name
+        self.jobs = jobs
+        self.lsh = lsh
+        # 加载和比较都在锁里做，同一份结果不会被两个请求同时计算
+        self.lock = threading.RLock()
+        self.entities = {tool: Resident(path, lambda path, tool=tool: EntityTable(load_set(path, 'entity', tool, cache)),
+                                        self.lock)
+                         for tool, path in entities.items()}
+        self.dependencies = {tool: Resident(path, lambda path, tool=tool: dependency_diff.get_dep_info(path, tool, cache),
+                                            self.lock)
+                             for tool, path in dependencies.items()}
+        self.derived = dict()
+
+    def resident(self, kind: str, tool: str):
+        residents = self.entities if kind == 'entity' else self.dependencies
+        if tool not in residents:
+            raise LookupError(f'no {kind} file for {tool!r}, loaded: {sorted(residents)}')
+        return residents[tool]
+
+    def entity_table(self, tool: str):
+        return self.resident('entity', tool).get()
+
+    def dependency_table(self, tool: str):
+        return self.resident('dependency', tool).get()
+
+    # 派生结果按输入表的版本缓存，任何一张输入表重新加载过就重新计算
+    def cached(self, key: tuple, inputs: list, compute):
+        for each in inputs:
+            each.get()
+        versions = tuple(each.version for each in inputs)
+        hit = self.derived.get(key)
+        if hit is not None and hit[0] == versions:
+            return hit[1]
+        value = compute()
+        self.derived[key] = (versions, value)
+        return value
+
+    # 实体比较结果按实体ID排好序，分页取出时顺序稳定
+    def entity_diff(self, l_tool: str, r_tool: str):
+        if (l_tool, r_tool) not in COMPARERS:
+            raise ValueError(f'no entity comparer for {l_tool} vs {r_tool}')
+
+        def compute():
+            lhs, rhs = self.entity_table(l_tool), self.entity_table(r_tool)
+            comparer = get_comparer(l_tool, r_tool, lsh=self.lsh)
+            handler = Handler(comparer, lhs.entities, rhs.entities, shared_index(comparer, rhs.names))
+            eq_set, maybe_eq_set, ne_set = handler.work(self.jobs)
+
+            def pair_key(pair):
+                return pair[0].entityID, pair[1].entityID
+
+            return {'eq': sorted(eq_set, key=pair_key), 'maybe_eq': sorted(maybe_eq_set, key=pair_key),
+                    'ne': sorted(ne_set, key=lambda each: (each.dataset != l_tool, each.entityID))}
+
+        with self.lock:
+            return self.cached(('entity_diff', l_tool, r_tool),
+                               [self.resident('entity', l_tool), self.resident('entity', r_tool)], compute)
+
+    # src工具的实体ID -> [(dest工具的实体, 'eq'或'maybe_eq')]，只有反方向的比较器时把结果反过来
+    def mapping(self, src: str, dest: str):
+        if (src, dest) in COMPARERS:
+            l_tool, r_tool, inverted = src, dest, False
+        elif (dest, src) in COMPARERS:
+            l_tool, r_tool, inverted = dest, src, True
+        else:
+            raise ValueError(f'no entity comparer between {src} and {dest}')
+
+        def compute():
+            result = dict()
+            diff = self.entity_diff(l_tool, r_tool)
+            for flag in ['eq', 'maybe_eq']:
+                for lhs, rhs in diff[flag]:
+                    if inverted:
+                        lhs, rhs = rhs, lhs
+                    result.setdefault(lhs.entityID, []).append((rhs, flag))
+            return result
+
+        with self.lock:
+            return self.cached(('mapping', src, dest), [self.resident('entity', src), self.resident('entity', dest)],
+                               compute)
+
+    def equivalence(self, l_tool: str, r_tool: str, maybe: bool):
+        def compute():
+            return dependency_diff.EquivalenceMap((src, rhs.entityID, int(flag == 'maybe_eq'))
+                                                  for src, targets in self.mapping(l_tool, r_tool).items()
+                                                  for rhs, flag in targets if maybe or flag == 'eq')
+
+        with self.lock:
+            return self.cached(('equivalence', l_tool, r_tool, maybe),
+                               [self.resident('entity', l_tool), self.resident('entity', r_tool)], compute)
+
+    def dependency_diff(self, l_tool: str, r_tool: str, typed: bool, maybe: bool):
+        def compute():
+            handler = dependency_diff.Handler(dependency_diff.Dependency_Comparer(),
+                                              self.dependency_table(l_tool), self.dependency_table(r_tool),
+                                              self.equivalence(l_tool, r_tool, maybe), l_tool, r_tool, typed)
+            eq_set, ne_set = handler.work()
+            return {'eq': eq_set, 'maybe_eq': handler.maybe_eq_set, 'ne': ne_set,
+                    'left_only': sum(1 for each in ne_set if each.dataset == l_tool),
+                    'confusion': dependency_diff.confusion_rows(handler.confusion), 'metrics': handler.type_metrics}
+
+        with self.lock:
+            return self.cached(('dependency_diff', l_tool, r_tool, typed, maybe),
+                               [self.resident(kind, tool) for kind in ['entity', 'dependency'] for tool in [l_tool, r_tool]],
+                               compute)
+
+    def pairs(self):
+        return [pair for pair in COMPARERS if pair[0] in self.entities and pair[1] in self.entities]
+
+    def warm(self):
+        for l_tool, r_tool in self.pairs():
+            self.entity_diff(l_tool, r_tool)
+            if l_tool in self.dependencies and r_tool in self.dependencies:
+                self.dependency_diff(l_tool, r_tool, False, False)
+
+    def status(self):
+        files = []
+        with self.lock:
+            for kind, residents in [('entity', self.entities), ('dependency', self.dependencies)]:
+                for tool, resident in residents.items():
+                    files.append({'tool': tool, 'kind': kind, 'path': resident.path, 'version': resident.version,
+                                  'loaded': resident.loaded, 'rows': None if resident.value is None else
+                                  len(resident.value.entities if kind == 'entity' else resident.value)})
+            cached = [list(key) for key in self.derived]
+        return {'project': self.name, 'files': files, 'pairs': self.pairs(), 'cached': cached}
+
+
+def page(records: list, query: dict):
+    offset = integer(query, 'offset', 0)
+    limit = integer(query, 'limit', DEFAULT_LIMIT)
+    return records[offset:offset + limit]
+
+
+def as_dict(record):
+    if isinstance(record, tuple):
+        return [each.into_dict() for each in record]
+    return record.into_dict()
+
+
+def require(query: dict, name: str):
+    if name not in query:
+        raise ValueError(f'missing query parameter {name!r}')
+    return query[name]
+
+
+def integer(query: dict, name: str, default=None):
+    value = require(query, name) if default is None else query.get(name, default)
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'query parameter {name!r} must be an integer, got {value!r}')
+
+
+def truthy(value):
+    return value not in (None, '', '0', 'false', 'no')
+
+
+# GET /status                                              已加载的表和缓存的结果
+# GET /entity?tool=enre&id=8367                            一个实体
+# GET /map?from=enre&to=understand&id=8367                 一个实体在另一个工具里对应的实体
+# GET /entity-diff?left=enre&right=understand              实体比较的计数，section=eq|maybe_eq|ne时分页返回记录
+# GET /dependency-diff?left=enre&right=understand          依赖比较的计数、混淆矩阵和按类型的指标，可加typed=1、maybe=1、section
+def route(project: Project, path: str, query: dict):
+    if path == '/status':
+        return project.status()
+    if path == '/entity':
+        tool = require(query, 'tool')
+        entity = project.entity_table(tool).by_id.get(integer(query, 'id'))
+        if entity is None:
+            raise LookupError(f"no {tool} entity {query['id']}")
+        return entity.into_dict()
+    if path == '/map':
+        src, dest = require(query, 'from'), require(query, 'to')
+        source = project.entity_table(src).by_id.get(integer(query, 'id'))
+        if source is None:
+            raise LookupError(f"no {src} entity {query['id']}")
+        targets = project.mapping(src, dest).get(source.entityID, [])
+        return {'entity': source.into_dict(),
+                'eq': [each.into_dict() for each, flag in targets if flag == 'eq'],
+                'maybe_eq': [each.into_dict() for each, flag in targets if flag == 'maybe_eq']}
+    if path == '/entity-diff':
+        result = project.entity_diff(require(query, 'left'), require(query, 'right'))
+        body = {section: len(result[section]) for section in ['eq', 'maybe_eq', 'ne']}
+    elif path == '/dependency-diff':
+        result = project.dependency_diff(require(query, 'left'), require(query, 'right'), truthy(query.get('typed')),
+                                         truthy(query.get('maybe')))
+        body = {'eq': len(result['eq']), 'maybe_eq': len(result['maybe_eq']), 'left_only': result['left_only'],
+                'right_only': len(result['ne']) - result['left_only'], 'confusion': result['confusion'], 'metrics': result['metrics']}
+    else:
+        raise LookupError(f'unknown path {path}')
+    section = query.get('section')
+    if section is not None:
+        if section not in ['eq', 'maybe_eq', 'ne']:
+            raise ValueError(f'unknown section {section!r}, expected eq, maybe_eq or ne')
+        body[section + '_records'] = [as_dict(each) for each in page(result[section], query)]
+    return body
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    project = None
+
+    def do_GET(self):
+        start = time.perf_counter()
+        url = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            body = route(self.project, url.path, query)
+            status = 200
+        except LookupError as error:
+            body, status = {'error': str(error)}, 404
+        except (ValueError, OSError) as error:
+            body, status = {'error': str(error)}, 400
+        # 其他异常是服务本身的问题，返回500和错误信息，堆栈写到日志里，不能让连接没有响应就断掉
+        except Exception as error:
+            self.log_error('%s', traceback.format_exc())
+            body, status = {'error': f'{type(error).__name__}: {error}'}, 500
+        if isinstance(body, dict):
+            body['milliseconds'] = round((time.perf_counter() - start) * 1000, 3)
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+if __name__ == "__main__":
+    ENTITIES, DEPENDENCIES, PROJECTNAME, HOST, PORT, JOBS, LSH, WARM, CACHE = parse_args()
+    PROJECT = Project(PROJECTNAME, ENTITIES, DEPENDENCIES, JOBS, LSH, CACHE)
+    if WARM:
+        START = time.perf_counter()
+        PROJECT.warm()
+        print(f'warmed {len(PROJECT.derived)} results in {time.perf_counter() - START:.2f}s', flush=True)
+    RequestHandler.project = PROJECT
+    SERVER = ThreadingHTTPServer((HOST, PORT), RequestHandler)
+    print(f'serving {PROJECTNAME} ({", ".join(tool for tool in TOOLS if tool in ENTITIES)}) '
+          f'on http://{HOST}:{SERVER.server_address[1]}', flush=True)
+    try:
+        SERVER.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        SERVER.server_close()
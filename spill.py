@@ -0,0 +1,77 @@
+import json
+import math
+import os
+from array import array
+
+from columnar import table_from_records
+from record_io import iter_section
+
+
+# 超出内存时的分区比较用的磁盘分区文件
+# 输入读进内存后大约是文件大小的两倍(halo上实体比较的峰值是输入的1.3倍，依赖连接是1.7倍)，按这个估计分区数
+INFLATION = 2
+# 各分区的记录先攒在内存里，攒够这么多字符一起追加到文件，分区再多也不会同时打开很多文件
+SPILL_BUFFER = 8 << 20
+# 顺序读输入时每批建表的记录数
+BATCH_SIZE = 1 << 14
+
+
+def partition_count(paths: list, budget_mb: int):
+    size = sum(os.path.getsize(path) for path in paths)
+    return max(1, math.ceil(size * INFLATION / (budget_mb << 20)))
+
+
+# 一组分区文件，每条记录是一行JSON，按写入的顺序读回
+class SpillFiles:
+    def __init__(self, directory: str, name: str, partitions: int):
+        self.paths = [os.path.join(directory, f'{name}.{i}.jsonl') for i in range(partitions)]
+        self.buffers = [[] for _ in range(partitions)]
+        self.buffered = 0
+        for path in self.paths:
+            open(path, 'w').close()
+
+    def write(self, partition: int, record):
+        line = json.dumps(record, ensure_ascii=False)
+        self.buffers[partition].append(line)
+        self.buffered += len(line)
+        if self.buffered >= SPILL_BUFFER:
+            self.flush()
+
+    def flush(self):
+        for path, buffer in zip(self.paths, self.buffers):
+            if buffer:
+                with open(path, 'a', encoding='utf-8') as file:
+                    file.write('\n'.join(buffer))
+                    file.write('\n')
+                buffer.clear()
+        self.buffered = 0
+
+    def read(self, partition: int):
+        self.flush()
+        with open(self.paths[partition], encoding='utf-8') as file:
+            for line in file:
+                yield json.loads(line)
+
+    # 记录是[输入里的行号, 记录]时，把一个分区读回成表，附带各行在输入里的行号，表保持写入的顺序
+    def table(self, partition: int, kind: str):
+        rows = array('q')
+
+        def records():
+            for row, record in self.read(partition):
+                rows.append(row)
+                yield record
+        return table_from_records(kind, records()), rows
+
+
+# 顺序读一遍输入，每次只把一批记录建成表：(这一批第一行的行号, 表)
+def input_batches(path: str, kind: str, size: int = BATCH_SIZE):
+    batch = []
+    first = 0
+    for record in iter_section(path, kind):
+        batch.append(record)
+        if len(batch) == size:
+            yield first, table_from_records(kind, batch)
+            first += len(batch)
+            batch = []
+    if batch:
+        yield first, table_from_records(kind, batch)
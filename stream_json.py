@@ -0,0 +1,155 @@
+import json
+import re
+
+
+CHUNK_SIZE = 1 << 16
+WHITESPACE = ' \t\n\r'
+# 跳过不需要的值时只关心括号和字符串的边界
+STRUCTURE = re.compile(r'["\[\]{}]')
+STRING_END = re.compile(r'["\\]')
+
+
+# 增量读取JSON文本：缓冲区只保留还没有解析的部分
+class JsonStream:
+    def __init__(self, file):
+        self.file = file
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self, size: int = CHUNK_SIZE):
+        if self.eof:
+            return False
+        chunk = self.file.read(size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f'expected {char!r} at offset {self.pos}, got {self.peek()!r}')
+        self.pos += 1
+
+    # 解析一个完整的值，数字可能被块边界截断，所以值后面至少要再看到一个字符
+    def decode(self):
+        self.peek()
+        size = CHUNK_SIZE
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            size *= 2
+            self.fill(size)
+
+    # 顶层对象之后只能是空白，否则多半是把jsonl文件当成了JSON文档
+    def finish(self):
+        if self.peek() != '':
+            raise ValueError(f'unexpected content after the JSON document at offset {self.pos}')
+
+    # 不解析直接跳过一个值，大数组也不会整体读进内存
+    def skip(self):
+        char = self.peek()
+        if char not in '[{"':
+            self.decode()
+            return
+        depth = 0
+        while True:
+            match = STRUCTURE.search(self.buf, self.pos)
+            if match is None:
+                self.pos = len(self.buf)
+                if not self.fill():
+                    raise ValueError('unexpected end of JSON input')
+                continue
+            self.pos = match.end()
+            char = match.group()
+            if char == '"':
+                self.skip_string()
+            elif char in '[{':
+                depth += 1
+            else:
+                depth -= 1
+            if depth == 0:
+                return
+
+    def skip_string(self):
+        while True:
+            match = STRING_END.search(self.buf, self.pos)
+            if match is None or match.end() == len(self.buf) and match.group() == '\\':
+                self.pos = len(self.buf) if match is None else match.start()
+                if not self.fill():
+                    raise ValueError('unterminated string in JSON input')
+                continue
+            if match.group() == '\\':
+                self.pos = match.end() + 1
+            else:
+                self.pos = match.end()
+                return
+
+
+# 逐个产出顶层对象中key对应数组的元素，其他字段只跳过不解析
+def iter_array(path: str, key: str):
+    with open(path, 'r', encoding='utf-8') as json_file:
+        yield from iter_array_file(json_file, key)
+
+
+# 数组读完以后继续跳过其余字段直到文档结束，确认后面没有多余的内容
+def iter_array_file(json_file, key: str):
+    stream = JsonStream(json_file)
+    stream.expect('{')
+    if stream.peek() != '}':
+        while True:
+            name = stream.decode()
+            stream.expect(':')
+            if name == key:
+                stream.expect('[')
+                if stream.peek() != ']':
+                    while True:
+                        yield stream.decode()
+                        if stream.peek() == ']':
+                            break
+                        stream.expect(',')
+                stream.expect(']')
+            else:
+                stream.skip()
+            if stream.peek() == '}':
+                break
+            stream.expect(',')
+    stream.expect('}')
+    stream.finish()
+
+
+# 读取顶层对象中key对应的值，前面的大数组只跳过不解析；找到就返回，找不到时读到文档结束
+def read_field_file(json_file, key: str, default=None):
+    stream = JsonStream(json_file)
+    stream.expect('{')
+    if stream.peek() != '}':
+        while True:
+            name = stream.decode()
+            stream.expect(':')
+            if name == key:
+                return stream.decode()
+            stream.skip()
+            if stream.peek() == '}':
+                break
+            stream.expect(',')
+    stream.expect('}')
+    stream.finish()
+    return default
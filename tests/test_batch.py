@@ -0,0 +1,27 @@
+import sqlite3
+from contextlib import closing
+
+import pytest
+
+from batch import check_manifest
+
+
+def manifest(files: dict):
+    return {'projects': {'halo': {'tools': {'sourcetrail': files}, 'pairs': []}}}
+
+
+# node.csv导出的sourcetrail没有edge.csv时清单就报错，不能把node.csv当成-d传给Format
+def test_sourcetrail_csv_export_needs_a_dependency_file(tmp_path):
+    (tmp_path / 'node.csv').write_text('id,type,serialized_name\n')
+    with pytest.raises(ValueError, match='halo/sourcetrail: expected entity and dependency files'):
+        check_manifest(manifest({'entity': 'node.csv'}), str(tmp_path))
+    projects = check_manifest(manifest({'entity': 'node.csv', 'dependency': 'edge.csv'}), str(tmp_path))
+    assert projects['halo']['tools']['sourcetrail']['dependency'] == str(tmp_path / 'edge.csv')
+
+
+def test_sourcetrail_database_needs_only_the_entity_file(tmp_path):
+    with closing(sqlite3.connect(tmp_path / 'halo.srctrldb')) as connection:
+        connection.execute('CREATE TABLE node (id INTEGER, type INTEGER, serialized_name TEXT)')
+        connection.commit()
+    projects = check_manifest(manifest({'entity': 'halo.srctrldb'}), str(tmp_path))
+    assert projects['halo']['tools']['sourcetrail'] == {'entity': str(tmp_path / 'halo.srctrldb')}
@@ -0,0 +1,35 @@
+import columnar
+from columnar import ColumnarWriter, load_table, table_from_records, write_table
+
+
+def entities(count: int):
+    return [{'entityID': i, 'entityName': f'a.B.m{i % 7}', 'entityType': 'Method' if i % 3 else None,
+             'entityFile': f'a/B{i % 2}.java', 'startLine': i, 'startColumn': 0, 'endLine': i + 1, 'endColumn': 4}
+            for i in range(count)]
+
+
+def write_streamed(path, records: list, kind: str = 'entity'):
+    with ColumnarWriter(str(path), kind, 'p') as writer:
+        for record in records:
+            writer.append(record)
+    return str(path)
+
+
+# 去重表没有清空过时，流式写出的文件和整表写出的逐字节相同
+def test_streamed_table_matches_the_in_memory_layout(tmp_path):
+    records = entities(50)
+    write_table(str(tmp_path / 'table.columnar'), table_from_records('entity', records, 'p'))
+    write_streamed(tmp_path / 'streamed.columnar', records)
+    assert (tmp_path / 'streamed.columnar').read_bytes() == (tmp_path / 'table.columnar').read_bytes()
+
+
+# 分很多批写、去重表反复清空，读回的记录不变，临时文件都删掉
+def test_streamed_table_reads_back_across_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(columnar, 'STREAM_ROWS', 4)
+    monkeypatch.setattr(columnar, 'STREAM_UNIQUE', 3)
+    records = entities(50)
+    table = load_table(write_streamed(tmp_path / 'streamed.columnar', records))
+    assert list(table) == records
+    assert table.projectname == 'p'
+    table.close()
+    assert [each.name for each in tmp_path.iterdir()] == ['streamed.columnar']
@@ -0,0 +1,35 @@
+from columnar import table_from_records
+from dependency_diff import Handler
+
+
+def dependency(dependency_type: str, src: int, dest: int, line: int = 1):
+    return {'dependencyType': dependency_type, 'dependencySrcID': src, 'dependencyDestID': dest,
+            'startLine': line, 'startColumn': 0, 'endLine': line, 'endColumn': 0}
+
+
+def join(left: list, right: list, equivalence: dict, typed: bool = False):
+    handler = Handler(None, table_from_records('dependency', left), table_from_records('dependency', right),
+                      equivalence, 'left', 'right', typed)
+    eq_set, ne_set = handler.work()
+    metrics = {each['dependencyType']: each for each in handler.type_metrics}
+    return [(lhs.dependencyType, rhs.dependencyType) for lhs, rhs in eq_set], \
+           [dep.dependencyType for dep in ne_set], metrics
+
+
+# 不分类型时Call和Use的连接键相同，两条都要和右边的Call配对，不能有一条边既不在eq也不在ne里
+def test_untyped_edges_sharing_a_key_are_all_matched():
+    eq_set, ne_set, metrics = join([dependency('Call', 1, 2), dependency('Use', 1, 2, 2)],
+                                   [dependency('Call', 10, 20)], {1: 10, 2: 20})
+    assert eq_set == [('Call', 'Call'), ('Use', 'Call')]
+    assert ne_set == []
+    assert metrics['CALL']['leftMatched'] == 1
+    assert metrics['CALL']['rightMatched'] == 1
+
+
+def test_typed_edges_only_match_their_own_type():
+    eq_set, ne_set, metrics = join([dependency('Call', 1, 2), dependency('Use', 1, 2, 2)],
+                                   [dependency('Call', 10, 20)], {1: 10, 2: 20}, typed=True)
+    assert eq_set == [('Call', 'Call')]
+    assert ne_set == ['Use']
+    assert metrics['CALL']['leftMatched'] == 1
+    assert metrics['USE']['left'] == 1 and metrics['USE']['leftMatched'] == 0
@@ -0,0 +1,59 @@
+import json
+
+from differ import Entity, Handler, IncrementalDiff, get_comparer
+
+
+def entity(entity_id: int, name: str, entity_type: str, path: str, start: int, end: int, dataset: str):
+    return Entity(entity_id, name, entity_type, path, start, 0, end, 80, dataset)
+
+
+def matched(l_set: list, r_set: list):
+    eq_set, maybe_eq_set, ne_set = Handler(get_comparer('enre', 'understand', location=True), l_set, r_set).work()
+    return sorted((lhs.entityID, rhs.entityID) for lhs, rhs in eq_set), sorted(each.entityID for each in ne_set)
+
+
+# 两边的根目录不同，文件按路径后缀对齐；重叠最多的实体相等，名字改了也一样
+def test_location_matches_overlapping_entities_in_the_same_file():
+    l_set = [entity(1, 'a.Bar', 'Class', 'src/a/Bar.java', 3, 40, 'enre'),
+             entity(2, 'a.Bar.run', 'Method', 'src/a/Bar.java', 10, 20, 'enre')]
+    r_set = [entity(11, 'a.Bar', 'Public Class', 'D:\\project\\src\\a\\Bar.java', 3, 40, 'understand'),
+             entity(12, 'a.Bar.start', 'Public Method', 'D:\\project\\src\\a\\Bar.java', 10, 20, 'understand'),
+             entity(13, 'a.Bar.run', 'Public Method', 'D:\\project\\src\\a\\Bar.java', 25, 30, 'understand')]
+    eq_set, ne_set = matched(l_set, r_set)
+    assert eq_set == [(1, 11), (2, 12)]
+    assert ne_set == [13]
+
+
+# 左侧的文件在右侧找不到时退回按名字比较
+def test_location_falls_back_to_names_when_the_file_is_not_found():
+    l_set = [entity(1, 'a.Bar', 'Class', 'elsewhere/x/Bar.java', 3, 40, 'enre')]
+    r_set = [entity(11, 'a.Bar', 'Public Class', 'D:\\project\\src\\a\\Bar2.java', 5, 50, 'understand'),
+             entity(12, 'a.Baz', 'Public Class', 'D:\\project\\src\\a\\Bar2.java', 3, 40, 'understand')]
+    eq_set, ne_set = matched(l_set, r_set)
+    assert eq_set == [(1, 11)]
+    assert ne_set == [12]
+
+
+def previous_document(path, eq_set, ne_set):
+    path.write_text(json.dumps({'eq': [[lhs.into_dict(), rhs.into_dict()] for lhs, rhs in eq_set],
+                                'maybe_eq': [], 'ne': [each.into_dict() for each in ne_set]}))
+    return str(path)
+
+
+# 两个重载没有位置信息，稳定键相同；两个都改名时added和removed都是2，结果和完整重跑一样
+def test_incremental_delta_counts_entities_sharing_a_key(tmp_path):
+    comparer = get_comparer('enre', 'understand')
+    l_old = [entity(1, 'a.Bar.run', 'Method', None, -1, -1, 'enre'),
+             entity(2, 'a.Bar.run', 'Method', None, -1, -1, 'enre')]
+    r_set = [entity(11, 'a.Bar.run', 'Public Method', None, -1, -1, 'understand'),
+             entity(12, 'a.Bar.start', 'Public Method', None, -1, -1, 'understand')]
+    eq_set, _, ne_set = Handler(comparer, l_old, r_set).work()
+    previous = previous_document(tmp_path / 'previous.json', eq_set, ne_set)
+    l_new = [entity(3, 'a.Bar.start', 'Method', None, -1, -1, 'enre'),
+             entity(4, 'a.Bar.start', 'Method', None, -1, -1, 'enre')]
+    incremental = IncrementalDiff(previous, 'enre')
+    eq_set, _, ne_set = incremental.work(comparer, l_new, r_set)
+    assert incremental.delta['left'] == {'added': 2, 'removed': 2, 'changed': 0}
+    assert incremental.delta['right'] == {'added': 0, 'removed': 0, 'changed': 0}
+    assert sorted((lhs.entityID, rhs.entityID) for lhs, rhs in eq_set) == [(3, 12), (4, 12)]
+    assert [each.entityID for each in ne_set] == [11]
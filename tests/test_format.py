@@ -0,0 +1,66 @@
+import csv
+import sqlite3
+from contextlib import closing
+
+from Format import converter_inputs, sourcetrail_format
+from record_io import iter_section
+
+# Sourcetrail导出的节点和边，类型在.srctrldb里是整数，在手工导出的csv里是字符串
+NODES = [(1, 262144, '/\tmD:/halo/src/run/halo/app/cache/lock/CacheLock.java\ts\tp'),
+         (2, 32, '.\tmrun\ts\tp\tnhalo\ts\tp\tnapp\ts\tp\tncache\ts\tp\tnlock\ts\tp'),
+         (3, 131072, '.\tmrun\ts\tp\tnhalo\ts\tp\tnapp\ts\tp\tncache\ts\tp\tnlock\ts\tp\tnCacheLock\ts\tp'),
+         (4, 8192, '.\tmrun\ts\tp\tnhalo\ts\tp\tnapp\ts\tp\tncache\ts\tp\tnlock\ts\tp\tnCacheLock\ts\tp\tnexpired\tslong\tp'),
+         (5, 3, '.\tmjava\ts\tp\tnlang\ts\tp')]
+EDGES = [(10, 1, 3, 2), (11, 1, 4, 3), (12, 8, 4, 3), (13, 128, 3, 5)]
+
+
+def write_csv(path, header: list, rows: list):
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        writer.writerows(rows)
+    return str(path)
+
+
+def write_sqlite(path):
+    with closing(sqlite3.connect(path)) as connection:
+        connection.execute('CREATE TABLE node (id INTEGER, type INTEGER, serialized_name TEXT)')
+        connection.execute('CREATE TABLE edge (id INTEGER, type INTEGER, source_node_id INTEGER, target_node_id INTEGER)')
+        connection.executemany('INSERT INTO node VALUES (?, ?, ?)', NODES)
+        connection.executemany('INSERT INTO edge VALUES (?, ?, ?, ?)', EDGES)
+        connection.commit()
+    return str(path)
+
+
+def converted(output, kind: str):
+    return list(iter_section(f'{output}/sourcetrail_p_{kind}.json', kind))
+
+
+# .srctrldb和csv两条路径的输出要完全一样，包括未知类型和名字的解码
+def test_sourcetrail_database_matches_csv_export(tmp_path):
+    node_csv = write_csv(tmp_path / 'node.csv', ['id', 'type', 'serialized_name'], NODES)
+    edge_csv = write_csv(tmp_path / 'edge.csv', ['id', 'type', 'source_node_id', 'target_node_id'], EDGES)
+    database = write_sqlite(tmp_path / 'halo.srctrldb')
+    (tmp_path / 'csv').mkdir()
+    (tmp_path / 'sqlite').mkdir()
+    sourcetrail_format(node_csv, edge_csv, 'p', str(tmp_path / 'csv'))
+    sourcetrail_format(database, None, 'p', str(tmp_path / 'sqlite'))
+    for kind in ['entity', 'dependency']:
+        assert converted(tmp_path / 'sqlite', kind) == converted(tmp_path / 'csv', kind)
+    entities = converted(tmp_path / 'sqlite', 'entity')
+    assert [each['entityType'] for each in entities] == ['file', 'package', 'class', 'method', None]
+    assert entities[2]['entityName'] == '.run.halo.app.cache.lock.CacheLock'
+    assert [each['dependencyType'] for each in converted(tmp_path / 'sqlite', 'dependency')] == \
+           ['scope resolve', 'scope resolve', 'call', None]
+
+
+# 解析缓存的键只看转换器实际读取的文件，code2graph和.srctrldb的-d随便给什么都不影响
+def test_converter_inputs_are_only_the_files_read(tmp_path):
+    database = write_sqlite(tmp_path / 'halo.srctrldb')
+    node_csv = write_csv(tmp_path / 'node.csv', ['id', 'type', 'serialized_name'], NODES)
+    assert converter_inputs('enre', 'enre.json', 'unused') == ['enre.json']
+    assert converter_inputs('code2graph', 'graph.dot', 'unused') == ['graph.dot']
+    assert converter_inputs('understand', 'entity.json', 'dependency.json') == ['dependency.json']
+    assert converter_inputs('depends', 'depends.txt', 'depends.json') == ['depends.txt', 'depends.json']
+    assert converter_inputs('sourcetrail', database, 'unused') == [database]
+    assert converter_inputs('sourcetrail', node_csv, 'edge.csv') == [node_csv, 'edge.csv']
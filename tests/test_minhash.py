@@ -0,0 +1,18 @@
+import zlib
+
+from minhash import PRIME, MinHashLSH, shingles
+
+
+# 缓存gram的排列值后，签名和逐个排列直接计算的一样
+def test_cached_signature_matches_the_permutations():
+    index = MinHashLSH()
+    for text in ['', 'a', 'run', 'run.halo.app.service.PostService.getById', 'aaaaaa']:
+        hashes = [zlib.crc32(each.encode('utf-8')) for each in shingles(text, index.ngram)]
+        assert index.signature(text) == [min((a * h + b) % PRIME for h in hashes) for a, b in index.permutations]
+
+
+def test_similar_names_are_candidates():
+    index = MinHashLSH()
+    index.add('run.halo.app.service.PostService.getById', 1)
+    index.add('run.halo.app.model.entity.Tag.setName', 2)
+    assert index.query('run.halo.app.service.PostService.getByIds') == [1]
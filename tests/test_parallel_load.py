@@ -0,0 +1,71 @@
+import json
+import os
+from array import array
+
+import parallel_load
+from parallel_load import ParallelLoader
+from parse_cache import ParseCache
+
+
+def dependencies(count: int):
+    return [{'dependencyType': 'Call', 'dependencySrcID': i, 'dependencyDestID': i + 1,
+             'startLine': i, 'startColumn': 0, 'endLine': i, 'endColumn': 0} for i in range(count)]
+
+
+def write_dependencies(path, records: list):
+    path.write_text(json.dumps({'schemaVersion': 1.0, 'dependency': records, 'projectName': 'p'}))
+    return str(path)
+
+
+def load(paths: list, cache):
+    with ParallelLoader(len(paths)) as loader:
+        loading = [loader.table(path, 'dependency', cache) for path in paths]
+        return [list(each.result()) for each in loading]
+
+
+# 测试机可能只有一个CPU，强制走子进程；子进程做完后、主进程接上之前，缓存条目被别的进程淘汰，结果仍要完整传回
+def test_workers_hand_back_tables_evicted_from_the_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(parallel_load, 'available_cpus', lambda: 4)
+    records = [dependencies(3), dependencies(5)]
+    paths = [write_dependencies(tmp_path / f'{i}.json', each) for i, each in enumerate(records)]
+    cache = ParseCache(str(tmp_path / 'cache'))
+    with ParallelLoader(len(paths)) as loader:
+        loading = [loader.table(path, 'dependency', cache) for path in paths]
+        for each in loading:
+            each.future.result()
+        assert len(cache.entries()) == 2
+        ParseCache(cache.directory, limit_mb=0).evict()
+        assert [list(each.result()) for each in loading] == records
+
+
+# 第二次加载在主进程里直接映射缓存文件
+def test_cache_hits_are_mapped_without_workers(tmp_path, monkeypatch):
+    monkeypatch.setattr(parallel_load, 'available_cpus', lambda: 4)
+    records = [dependencies(3), dependencies(5)]
+    paths = [write_dependencies(tmp_path / f'{i}.json', each) for i, each in enumerate(records)]
+    cache = ParseCache(str(tmp_path / 'cache'))
+    assert load(paths, cache) == records
+    assert len(cache.entries()) == 2
+    monkeypatch.setattr(ParallelLoader, 'submit', None)
+    assert load(paths, cache) == records
+    assert all(os.path.exists(entry) for entry in cache.entries())
+
+
+def unavailable():
+    raise AssertionError('resource_tracker.ensure_running is POSIX only')
+
+
+def lengths(records: list):
+    return {'lengths': array('q', [len(each) for each in records])}
+
+
+# Windows上不能启动资源跟踪进程，第一次提交子进程时不能调用它
+def test_workers_start_without_the_resource_tracker_off_posix(monkeypatch):
+    monkeypatch.setattr(parallel_load, 'available_cpus', lambda: 4)
+    monkeypatch.setattr(parallel_load.resource_tracker, 'ensure_running', unavailable)
+    with ParallelLoader(2) as loader:
+        # 只在提交时冒充Windows，出错时先恢复os.name，pytest才能正常报告
+        with monkeypatch.context() as windows:
+            windows.setattr(parallel_load.os, 'name', 'nt')
+            loading = loader.arrays(lengths, [[1], [1, 2, 3]])
+        assert list(loading.result()['lengths']) == [1, 3]
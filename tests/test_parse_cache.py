@@ -0,0 +1,34 @@
+import os
+
+from columnar import table_from_records
+from parse_cache import ParseCache
+
+
+def table():
+    return table_from_records('dependency', [{'dependencyType': 'Call', 'dependencySrcID': 1, 'dependencyDestID': 2,
+                                              'startLine': 1, 'startColumn': 0, 'endLine': 1, 'endColumn': 0}])
+
+
+# 列出条目之后另一个进程先把它删掉了，淘汰时跳过而不是报错
+def test_evict_skips_entries_removed_by_another_process(tmp_path):
+    cache = ParseCache(str(tmp_path), limit_mb=0)
+    cache.put('a', 'dependency', table())
+    vanished = cache.entry('b', 'dependency')
+    listed = cache.entries() + [vanished]
+    cache.entries = lambda: listed
+    cache.evict()
+    assert not os.path.exists(cache.entry('a', 'dependency'))
+
+
+# 两个进程各自算出的文件哈希都要留在索引里
+def test_digest_index_keeps_hashes_written_by_another_process(tmp_path):
+    first, second = tmp_path / 'first.json', tmp_path / 'second.json'
+    first.write_text('1')
+    second.write_text('2')
+    directory = str(tmp_path / 'cache')
+    one, other = ParseCache(directory), ParseCache(directory)
+    # 两个进程启动时索引都还是空的
+    one.digests, other.digests = dict(), dict()
+    one.digest(str(first))
+    other.digest(str(second))
+    assert set(ParseCache(directory).read_digests()) == {str(first), str(second)}
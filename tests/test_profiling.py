@@ -0,0 +1,17 @@
+import importlib
+import sys
+
+import profiling
+
+
+# resource只有Unix上有，导入profiling和开着--profile跑阶段都不能依赖它
+def test_profiling_works_without_the_resource_module(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'resource', None)
+    module = importlib.reload(profiling)
+    monkeypatch.setattr(module.sys, 'platform', 'win32')
+    profiler = module.Profiler(memory=False)
+    with profiler.phase('load'):
+        pass
+    # 这里没有kernel32，取不到就记成None
+    assert profiler.phases[0]['peak_rss_mb'] is None
+    assert profiler.report('differ')['peak_rss_mb'] is None
@@ -0,0 +1,31 @@
+from differ import Entity
+from result_store import ResultStore
+
+
+def entity(entity_id: int, name: str, dataset: str):
+    return Entity(entity_id, name, 'Method', f'{name}.java', 1, 0, 2, 0, dataset)
+
+
+def as_pairs(rows):
+    return [(row['result'], [(each['dataset'], each['entityID'], each['entityName']) for each in row['entities']])
+            for row in rows]
+
+
+# Understand会把同一个ID给多个实体，每个实体都要存下来，结果行要连回自己的那个实体
+def test_entities_sharing_an_id_are_stored_and_joined_separately(tmp_path):
+    left = [entity(1, 'a.run', 'enre'), entity(2, 'a.stop', 'enre'), entity(3, 'a.gone', 'enre')]
+    right = [entity(7, 'a.run', 'understand'), entity(7, 'a.stop', 'understand'), entity(7, 'a.new', 'understand')]
+    eq_set = [(left[0], right[0]), (left[1], right[1])]
+    ne_set = [left[2], right[2]]
+    with ResultStore(str(tmp_path / 'results.db')) as store:
+        store.write_entity_results('halo', 'enre', 'understand', eq_set, [], ne_set)
+        # 重写同一对工具时替换掉旧的实体和结果
+        store.write_entity_results('halo', 'enre', 'understand', eq_set, [], ne_set)
+        counts = dict(store.connection.execute('SELECT tool, COUNT(*) FROM entity GROUP BY tool'))
+        assert counts == {'enre': 3, 'understand': 3}
+        assert as_pairs(store.entity_results('halo', 'enre', 'understand')) == [
+            ('eq', [('enre', 1, 'a.run'), ('understand', 7, 'a.run')]),
+            ('eq', [('enre', 2, 'a.stop'), ('understand', 7, 'a.stop')]),
+            ('ne', [('enre', 3, 'a.gone')]),
+            ('ne', [('understand', 7, 'a.new')])]
+        assert sorted(store.equivalences('halo', 'enre', 'understand')) == [(1, 7, 0), (2, 7, 0)]
@@ -0,0 +1,55 @@
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import server
+from server import RequestHandler, Resident
+
+
+# 多个请求线程同时取同一张表，只加载一次，大家拿到的是同一个结果
+def test_resident_loads_once_under_concurrent_requests(tmp_path):
+    path = tmp_path / 'entity.json'
+    path.write_text('{}')
+    loads = []
+
+    def load(path):
+        loads.append(path)
+        time.sleep(0.05)
+        return object()
+
+    resident = Resident(str(path), load, threading.RLock())
+    values = []
+    threads = [threading.Thread(target=lambda: values.append(resident.get())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(loads) == 1
+    assert resident.version == 1
+    assert all(value is values[0] for value in values)
+
+
+# 意料之外的异常也要有响应：500和错误信息
+def test_unexpected_errors_return_500(monkeypatch):
+    def route(project, path, query):
+        raise TypeError("'NoneType' object is not subscriptable")
+
+    monkeypatch.setattr(server, 'route', route)
+    monkeypatch.setattr(RequestHandler, 'log_error', lambda self, *args: None)
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), RequestHandler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.start()
+    try:
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f'http://127.0.0.1:{httpd.server_address[1]}/status')
+        assert error.value.code == 500
+        assert json.loads(error.value.read())['error'] == "TypeError: 'NoneType' object is not subscriptable"
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        thread.join()